@@ -1,13 +1,14 @@
 from rest_framework import viewsets, status
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, BasePermission, SAFE_METHODS
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.filters import SearchFilter, OrderingFilter
 
 from django_filters import rest_framework as filters
 
 from family_tree_manager.models import FamilyTree
+from src.pagination import CursorOptInPagination
+from src.streaming import StreamingListMixin
 from .models import Event
 from .serializers import EventSerializer
 
@@ -26,7 +27,7 @@ class IsSuperUserOrReadOnly(BasePermission):
         return False
 
 
-class BasePagination(PageNumberPagination):
+class BasePagination(CursorOptInPagination):
     page_size = 10
     page_size_query_param = 'pageSize'
 
@@ -34,6 +35,7 @@ class BasePagination(PageNumberPagination):
 class EventFilter(filters.FilterSet):
     date_before = filters.DateFilter(field_name='date', lookup_expr='gte')
     date_after = filters.DateFilter(field_name='date', lookup_expr='lte')
+    branch = filters.NumberFilter(field_name='attendees__branch', distinct=True)
 
     class Meta:
         model = Event
@@ -42,7 +44,7 @@ class EventFilter(filters.FilterSet):
         }
 
 
-class EventViewSet(viewsets.ModelViewSet):
+class EventViewSet(StreamingListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsSuperUserOrReadOnly]
     queryset = Event.objects.all().order_by('-id')
     serializer_class = EventSerializer
@@ -55,8 +57,7 @@ class EventViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         if 'query_all' in request.query_params and request.user.is_superuser:
             queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+            return self.stream_list(queryset.prefetch_related('attendees'))
         if request.user.is_superuser:
             return super().list(request, *args, **kwargs)
 
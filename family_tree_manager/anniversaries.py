@@ -0,0 +1,118 @@
+import datetime
+from collections import defaultdict
+
+from django.db.models import Q
+from django.db.models.functions import ExtractDay, ExtractMonth
+
+from .lunar import lunar_month_length, solar_to_lunar
+
+BIRTHDAY = 'birthday'
+DEATH_ANNIVERSARY = 'death_anniversary'
+MAX_WINDOW_DAYS = 366
+
+
+def calendar_fields(bdate, ddate):
+    """Giá trị các cột ngày/tháng dùng cho lịch sinh nhật và ngày giỗ (âm lịch)."""
+    fields = {
+        'birth_month': bdate.month if bdate else None,
+        'birth_day': bdate.day if bdate else None,
+        'death_lunar_month': None,
+        'death_lunar_day': None,
+    }
+    if ddate:
+        fields['death_lunar_day'], fields['death_lunar_month'], _, _ = solar_to_lunar(ddate)
+    return fields
+
+
+def date_range(start, end):
+    for offset in range((end - start).days + 1):
+        yield start + datetime.timedelta(days=offset)
+
+
+def birthday_days(start, end):
+    """(tháng, ngày) dương lịch -> ngày trong khoảng. Sinh 29/2 thì năm thường tính vào 28/2."""
+    days = {}
+    for value in date_range(start, end):
+        days.setdefault((value.month, value.day), value)
+        if value.month == 2 and value.day == 28 and (value + datetime.timedelta(days=1)).month == 3:
+            days.setdefault((2, 29), value)
+    return days
+
+
+def death_anniversary_days(start, end):
+    """
+    (tháng, ngày) âm lịch -> ngày dương lịch trong khoảng. Giỗ làm theo tháng
+    thường nên bỏ qua tháng nhuận; mất ngày 30 thì tháng thiếu giỗ vào ngày 29.
+    """
+    days = {}
+    for value in date_range(start, end):
+        day, month, _, leap = solar_to_lunar(value)
+        if leap:
+            continue
+        days.setdefault((month, day), value)
+        if day == 29 and lunar_month_length(value) == 29:
+            days.setdefault((month, 30), value)
+    return days
+
+
+def month_day_filter(month_field, day_field, days):
+    # Gom theo tháng để mỗi tháng chỉ là một điều kiện khoảng trên index (tháng, ngày)
+    by_month = defaultdict(list)
+    for month, day in days:
+        by_month[month].append(day)
+    condition = Q(pk__in=[])
+    for month, month_days in by_month.items():
+        condition |= Q(**{month_field: month, f'{day_field}__range': (min(month_days), max(month_days))})
+    return condition
+
+
+def find_anniversaries(queryset, start, end, kinds=(BIRTHDAY, DEATH_ANNIVERSARY)):
+    """
+    Sinh nhật (thành viên còn sống) và ngày giỗ rơi vào [start, end], sắp theo
+    ngày. Mỗi thành viên trả về được gắn kind, date và years (số năm tròn).
+    """
+    results = []
+    if BIRTHDAY in kinds:
+        days = birthday_days(start, end)
+        members = queryset.filter(month_day_filter('birth_month', 'birth_day', days), ddate__isnull=True)
+        for member in members:
+            member.date = days.get((member.birth_month, member.birth_day))
+            if member.date is None:
+                continue
+            member.kind = BIRTHDAY
+            member.years = member.date.year - member.bdate.year
+            results.append(member)
+
+    if DEATH_ANNIVERSARY in kinds:
+        days = death_anniversary_days(start, end)
+        members = queryset.filter(month_day_filter('death_lunar_month', 'death_lunar_day', days))
+        for member in members:
+            member.date = days.get((member.death_lunar_month, member.death_lunar_day))
+            if member.date is None:
+                continue
+            member.kind = DEATH_ANNIVERSARY
+            member.years = solar_to_lunar(member.date)[2] - solar_to_lunar(member.ddate)[2]
+            results.append(member)
+
+    results.sort(key=lambda member: (member.date, member.kind, member.id))
+    return results
+
+
+def backfill_calendar_fields(model, batch_size=1000):
+    """
+    Tính lại các cột lịch cho mọi thành viên bằng UPDATE theo tập: ngày/tháng sinh
+    trích trực tiếp trong database, ngày giỗ chỉ đổi âm lịch một lần cho mỗi
+    ngày mất khác nhau. model có thể là model lịch sử trong migration.
+    """
+    updated = model.objects.update(birth_month=ExtractMonth('bdate'), birth_day=ExtractDay('bdate'))
+    model.objects.filter(ddate__isnull=True).update(death_lunar_month=None, death_lunar_day=None)
+
+    by_lunar_day = defaultdict(list)
+    for ddate in model.objects.filter(ddate__isnull=False).values_list('ddate', flat=True).distinct().iterator():
+        day, month, _, _ = solar_to_lunar(ddate)
+        by_lunar_day[(month, day)].append(ddate)
+    for (month, day), ddates in by_lunar_day.items():
+        for index in range(0, len(ddates), batch_size):
+            model.objects.filter(ddate__in=ddates[index:index + batch_size]).update(
+                death_lunar_month=month, death_lunar_day=day)
+    return updated
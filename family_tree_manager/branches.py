@@ -0,0 +1,205 @@
+import datetime
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .changes import record_changes
+from .lineage import BATCH_SIZE
+
+ROLLUP_FIELDS = ('member_count', 'living_count', 'dues_year', 'dues_paid', 'paid_member_count', 'refreshed_at')
+
+
+def compute_branches(nodes, roots, outside, partners):
+    """
+    Tính chi/nhánh theo dòng cha. nodes = {id: (mid, fid)} khép kín theo con cháu
+    dòng cha; roots = {id thành viên gốc: branch_id}; outside = {id: branch_id}
+    của cha/vợ chồng nằm ngoài nodes; partners = {id: [vợ/chồng]} cho thành viên
+    không có cha mẹ (dâu/rể), những người này theo chi của vợ/chồng.
+    """
+    computed = {}
+    for member_id in nodes:
+        path, seen, current = [], set(), member_id
+        while current not in computed:
+            fid = nodes[current][1]
+            if current in roots:
+                computed[current] = roots[current]
+            elif fid in nodes and fid not in seen:
+                path.append(current)
+                seen.add(current)
+                current = fid
+            else:
+                # Cha nằm ngoài tập (hoặc dữ liệu có vòng) thì lấy chi đã lưu của cha
+                computed[current] = outside.get(fid) if fid else None
+        for child in path:
+            computed[child] = computed[current]
+
+    for member_id, (mid, fid) in nodes.items():
+        if mid or fid or member_id in roots:
+            continue
+        computed[member_id] = next(
+            (branch for branch in (computed.get(partner, outside.get(partner))
+                                   for partner in sorted(partners.get(member_id, ()))) if branch), None)
+    return computed
+
+
+def load_branch_inputs(member_ids):
+    """Nạp các thành viên member_ids cùng con cháu dòng cha và vợ/chồng không có cha mẹ của họ."""
+    from .models import Branch, FamilyTree
+
+    nodes, stored = {}, {}
+    rows = FamilyTree.objects.filter(id__in=set(member_ids))
+    while True:
+        frontier = []
+        for member_id, mid, fid, branch_id in rows.values_list('id', 'mid_id', 'fid_id', 'branch_id'):
+            if member_id not in nodes:
+                nodes[member_id] = (mid, fid)
+                stored[member_id] = branch_id
+                frontier.append(member_id)
+        if not frontier:
+            break
+        rows = FamilyTree.objects.filter(fid_id__in=frontier)
+
+    through = FamilyTree.pids.through
+    spouse_ids = set(through.objects.filter(from_familytree_id__in=nodes).values_list(
+        'to_familytree_id', flat=True)) - set(nodes)
+    for member_id, mid, fid, branch_id in FamilyTree.objects.filter(
+            id__in=spouse_ids, mid__isnull=True, fid__isnull=True).values_list('id', 'mid_id', 'fid_id', 'branch_id'):
+        nodes[member_id] = (mid, fid)
+        stored[member_id] = branch_id
+
+    parentless = [member_id for member_id, (mid, fid) in nodes.items() if not mid and not fid]
+    partners = defaultdict(list)
+    for member_id, partner_id in through.objects.filter(from_familytree_id__in=parentless).values_list(
+            'from_familytree_id', 'to_familytree_id'):
+        partners[member_id].append(partner_id)
+
+    referenced = {fid for _, fid in nodes.values() if fid} | {p for ids in partners.values() for p in ids}
+    outside = dict(FamilyTree.objects.filter(id__in=referenced - set(nodes)).values_list('id', 'branch_id'))
+    roots = dict(Branch.objects.values_list('root_id', 'id'))
+    return nodes, stored, roots, outside, partners
+
+
+def save_branches(computed, stored):
+    """
+    Chỉ cập nhật các dòng đổi chi, mỗi chi một câu UPDATE, rồi hẹn tính lại
+    rollup của các chi bị ảnh hưởng. Trả về id các thành viên đã đổi chi.
+    """
+    from .models import FamilyTree, FamilyTreeChange
+
+    changed = defaultdict(list)
+    for member_id, branch_id in computed.items():
+        if stored.get(member_id) != branch_id:
+            changed[branch_id].append(member_id)
+
+    for branch_id, member_ids in changed.items():
+        for index in range(0, len(member_ids), BATCH_SIZE):
+            FamilyTree.objects.filter(id__in=member_ids[index:index + BATCH_SIZE]).update(branch_id=branch_id)
+
+    member_ids = [member_id for ids in changed.values() for member_id in ids]
+    record_changes(member_ids, FamilyTreeChange.UPSERT)
+    schedule_rollups(set(changed) | {stored[member_id] for member_id in member_ids})
+    return member_ids
+
+
+def assign_branches(member_ids):
+    """Tính lại chi cho member_ids và toàn bộ con cháu dòng cha của họ; trả về {id: branch_id}."""
+    if not member_ids:
+        return {}
+    nodes, stored, roots, outside, partners = load_branch_inputs(member_ids)
+    computed = compute_branches(nodes, roots, outside, partners)
+    save_branches(computed, stored)
+    return computed
+
+
+def rebuild_all_branches():
+    from .models import Branch, FamilyTree
+
+    nodes, stored = {}, {}
+    for member_id, mid, fid, branch_id in FamilyTree.objects.values_list(
+            'id', 'mid_id', 'fid_id', 'branch_id').iterator(chunk_size=BATCH_SIZE):
+        nodes[member_id] = (mid, fid)
+        stored[member_id] = branch_id
+    partners = defaultdict(list)
+    for member_id, partner_id in FamilyTree.pids.through.objects.values_list(
+            'from_familytree_id', 'to_familytree_id').iterator(chunk_size=BATCH_SIZE):
+        partners[member_id].append(partner_id)
+    roots = dict(Branch.objects.values_list('root_id', 'id'))
+
+    with transaction.atomic():
+        changed = save_branches(compute_branches(nodes, roots, {}, partners), stored)
+        schedule_rollups()
+    return changed
+
+
+def refresh_rollups(branch_ids=None):
+    """
+    Tính lại số thành viên, số người còn sống và tiền đóng góp năm nay của các
+    chi (mọi chi nếu branch_ids là None) bằng hai truy vấn GROUP BY.
+    """
+    from financial_management.models import Income
+    from .models import Branch, FamilyTree
+
+    branches = Branch.objects.all()
+    if branch_ids is not None:
+        branches = branches.filter(id__in=branch_ids)
+    branches = list(branches)
+    if not branches:
+        return []
+
+    year = datetime.date.today().year
+    ids = [branch.id for branch in branches]
+    counts = {row['branch']: row for row in FamilyTree.objects.filter(branch__in=ids).values('branch').annotate(
+        members=Count('id'), living=Count('id', filter=Q(ddate__isnull=True)))}
+    dues = {row['member__branch']: row for row in Income.objects.filter(
+        member__branch__in=ids, contributor__year=year).values('member__branch').annotate(
+        total=Sum('contributor__amount'), paid=Count('member', distinct=True))}
+
+    now = timezone.now()
+    for branch in branches:
+        branch.member_count = counts.get(branch.id, {}).get('members', 0)
+        branch.living_count = counts.get(branch.id, {}).get('living', 0)
+        branch.dues_year = year
+        branch.dues_paid = dues.get(branch.id, {}).get('total') or 0
+        branch.paid_member_count = dues.get(branch.id, {}).get('paid', 0)
+        branch.refreshed_at = now
+    Branch.objects.bulk_update(branches, ROLLUP_FIELDS)
+    return branches
+
+
+class PendingRollups:
+    """Các chi cần tính lại rollup khi transaction hiện tại commit (None = mọi chi)."""
+
+    def __init__(self):
+        self.branch_ids = set()
+
+    def add(self, branch_ids):
+        if branch_ids is None or self.branch_ids is None:
+            self.branch_ids = None
+        else:
+            self.branch_ids |= branch_ids
+
+    def __call__(self):
+        refresh_rollups(self.branch_ids)
+
+
+def schedule_rollups(branch_ids=None):
+    """
+    Tính lại rollup sau khi commit; branch_ids rỗng thì bỏ qua, None là mọi chi.
+    Mọi lần gọi trong cùng transaction được gom vào một callback on_commit.
+    """
+    if branch_ids is not None:
+        branch_ids = {branch_id for branch_id in branch_ids if branch_id}
+        if not branch_ids:
+            return
+    if not connection.in_atomic_block:
+        refresh_rollups(branch_ids)
+        return
+
+    # Callback bị bỏ khi savepoint chứa nó rollback, lúc đó đăng ký lại
+    pending = getattr(connection, 'pending_rollups', None)
+    if pending is None or all(entry[1] is not pending for entry in connection.run_on_commit):
+        pending = connection.pending_rollups = PendingRollups()
+        transaction.on_commit(pending)
+    pending.add(branch_ids)
@@ -0,0 +1,97 @@
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Func, Q
+from django.db.models.expressions import RawSQL
+
+CHANGES_PAGE_SIZE = 1000
+
+
+class CurrentTransactionId(Func):
+    template = 'txid_current()'
+    output_field = BigIntegerField()
+
+
+def record_changes(member_ids, action):
+    """Ghi nhật ký trong cùng transaction với thay đổi: commit hay rollback cùng nhau."""
+    from .models import FamilyTreeChange
+
+    member_ids = sorted({member_id for member_id in member_ids if member_id})
+    if not member_ids:
+        return
+
+    # id được cấp theo thứ tự INSERT chứ không theo thứ tự commit nên mỗi dòng ghi kèm
+    # txid của transaction; Postgres cấp txid tăng dần, database khác giữ 0
+    txid = CurrentTransactionId() if connection.vendor == 'postgresql' else 0
+    FamilyTreeChange.objects.bulk_create(
+        [FamilyTreeChange(member_id=member_id, action=action, txid=txid) for member_id in member_ids])
+
+
+def settled_changes():
+    """
+    Các dòng chắc chắn không còn dòng nào commit muộn chen vào trước chúng theo
+    thứ tự (txid, id): mọi transaction có txid nhỏ hơn xmin của snapshot hiện tại
+    đã kết thúc, transaction đang chạy hay bắt đầu sau đều có txid >= xmin.
+    Database khác Postgres ghi tuần tự nên thứ tự id đã là thứ tự commit.
+    """
+    from .models import FamilyTreeChange
+
+    if connection.vendor != 'postgresql':
+        return FamilyTreeChange.objects.all()
+    return FamilyTreeChange.objects.filter(
+        txid__lt=RawSQL('txid_snapshot_xmin(txid_current_snapshot())', [], output_field=BigIntegerField()))
+
+
+def after_position(txid, change_id):
+    return Q(txid__gt=txid) | Q(txid=txid, id__gt=change_id)
+
+
+def changes_since(since, limit=CHANGES_PAGE_SIZE):
+    """
+    Trả về (cursor, {member_id: action}, has_more) của các thay đổi sau since,
+    theo thứ tự (txid, id). cursor là id của dòng cuối cùng đã trả về. Trả về
+    None nếu since không còn trong nhật ký hoặc cũ hơn mốc baseline (nhật ký đã
+    bị nén), khi đó client phải tải lại toàn bộ cây.
+    """
+    from .models import FamilyTreeChange
+
+    if since is None:
+        return None
+    position = FamilyTreeChange.objects.filter(id=since).values_list('txid', 'id').first()
+    baseline = FamilyTreeChange.objects.filter(action=FamilyTreeChange.BASELINE).order_by(
+        '-txid', '-id').values_list('txid', 'id').first()
+    if position is None or (baseline is not None and position < baseline):
+        return None
+
+    rows = list(settled_changes().filter(after_position(*position)).exclude(
+        action=FamilyTreeChange.BASELINE).order_by('txid', 'id').values_list('id', 'member_id', 'action')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    latest = {}
+    for _, member_id, action in rows:
+        latest[member_id] = action
+    cursor = rows[-1][0] if rows else since
+    return cursor, latest, has_more
+
+
+def latest_cursor():
+    last = settled_changes().order_by('-txid', '-id').values_list('id', flat=True).first()
+    return last or 0
+
+
+def compact_changes(before):
+    """
+    Xóa nhật ký cũ hơn thời điểm before. Dòng mới nhất bị nén được giữ lại làm
+    mốc baseline: cursor nhỏ hơn mốc này không thể đồng bộ delta được nữa.
+    """
+    from .models import FamilyTreeChange
+
+    with transaction.atomic():
+        last = settled_changes().filter(created_at__lt=before).order_by('-txid', '-id').first()
+        if last is None:
+            return 0
+        deleted, _ = FamilyTreeChange.objects.exclude(after_position(last.txid, last.id)).exclude(id=last.id).delete()
+        if last.action != FamilyTreeChange.BASELINE:
+            last.action = FamilyTreeChange.BASELINE
+            last.save(update_fields=['action'])
+            deleted += 1
+    return deleted
@@ -0,0 +1,166 @@
+from collections import defaultdict
+from itertools import combinations
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from event_manager.models import Event
+from financial_management.models import Income
+
+from .generations import propagate_generations
+from .lineage import BATCH_SIZE, rebuild_lineage
+from .models import FamilyTree, FamilyTreeClosure
+from .search import trigrams
+from .signals import members_changed
+
+DUPLICATE_THRESHOLD = 0.75
+# Khối lớn hơn (họ Nguyễn sinh cùng năm...) bị bỏ qua để không so từng cặp
+MAX_BLOCK_SIZE = 200
+MERGE_FIELDS = ('ddate', 'phone', 'email', 'address', 'family_info', 'achievement', 'img', 'image_id')
+
+
+def blocking_keys(name, bdate, mid, fid):
+    words = name.split()
+    if words:
+        # Họ + chữ cái đầu của tên + năm sinh; tên + năm sinh (bắt được lỗi gõ sai họ)
+        yield 'surname', words[0], words[-1][:1], bdate.year
+        yield 'given', words[-1], bdate.year
+    if mid or fid:
+        yield 'parents', mid, fid
+
+
+def name_similarity(grams_a, grams_b):
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def parent_agreement(a, b):
+    score = []
+    for parent_a, parent_b in ((a['mid'], b['mid']), (a['fid'], b['fid'])):
+        if parent_a and parent_b:
+            score.append(1.0 if parent_a == parent_b else 0.0)
+        else:
+            score.append(0.5)
+    return sum(score) / len(score)
+
+
+def score_pair(a, b):
+    if a['gender'] != b['gender']:
+        return None
+    if a['bdate'] == b['bdate']:
+        bdate = 1.0
+    elif a['bdate'].year == b['bdate'].year:
+        bdate = 0.5
+    else:
+        bdate = 0.0
+    scores = {
+        'name': round(name_similarity(a['grams'], b['grams']), 3),
+        'bdate': bdate,
+        'parents': parent_agreement(a, b),
+    }
+    scores['total'] = round(0.6 * scores['name'] + 0.2 * scores['bdate'] + 0.2 * scores['parents'], 3)
+    return scores
+
+
+def find_duplicates(threshold=DUPLICATE_THRESHOLD, limit=None):
+    """
+    Tìm các cặp thành viên có thể trùng nhau. Chỉ so các cặp cùng khối
+    (họ/tên + năm sinh, hoặc cùng cha mẹ) nên số phép so gần tuyến tính.
+    """
+    members = {}
+    blocks = defaultdict(list)
+    rows = FamilyTree.objects.values_list('id', 'name_normalized', 'gender', 'bdate', 'mid_id', 'fid_id')
+    for member_id, name, gender, bdate, mid, fid in rows.iterator(chunk_size=BATCH_SIZE):
+        members[member_id] = {'grams': trigrams(name), 'gender': gender, 'bdate': bdate, 'mid': mid, 'fid': fid}
+        for key in blocking_keys(name, bdate, mid, fid):
+            blocks[key].append(member_id)
+
+    # Vợ chồng, cha mẹ - con không phải là trùng lặp
+    spouses = set(FamilyTree.pids.through.objects.values_list('from_familytree_id', 'to_familytree_id'))
+
+    scored = {}
+    for block in blocks.values():
+        if len(block) < 2 or len(block) > MAX_BLOCK_SIZE:
+            continue
+        for a_id, b_id in combinations(sorted(block), 2):
+            if (a_id, b_id) in scored or (a_id, b_id) in spouses:
+                continue
+            a, b = members[a_id], members[b_id]
+            if b_id in (a['mid'], a['fid']) or a_id in (b['mid'], b['fid']):
+                continue
+            scores = score_pair(a, b)
+            scored[(a_id, b_id)] = scores if scores and scores['total'] >= threshold else None
+
+    candidates = sorted(
+        ((pair, scores) for pair, scores in scored.items() if scores),
+        key=lambda item: (-item[1]['total'], item[0]))
+    if limit is not None:
+        candidates = candidates[:limit]
+    return [{'ids': list(pair), 'score': scores.pop('total'), 'scores': scores} for pair, scores in candidates]
+
+
+def merge_members(keep, duplicate):
+    """
+    Gộp duplicate vào keep trong một transaction: chuyển con (mid/fid), vợ/chồng
+    (pids), khoản thu (Income.member), sự kiện (Event.attendees) và tài khoản
+    sang keep, bổ sung các trường keep còn trống rồi xóa duplicate.
+    """
+    if keep.pk == duplicate.pk:
+        raise ValidationError("Không thể gộp một thành viên với chính nó")
+    if FamilyTreeClosure.objects.filter(
+            Q(ancestor=keep, descendant=duplicate) | Q(ancestor=duplicate, descendant=keep)).exists():
+        raise ValidationError("Không thể gộp thành viên với tổ tiên hoặc con cháu của mình")
+
+    conflicts = set(Income.objects.filter(member=keep, contributor__isnull=False).values_list(
+        'contributor__year', flat=True)) & set(Income.objects.filter(
+        member=duplicate, contributor__isnull=False).values_list('contributor__year', flat=True))
+    if conflicts:
+        raise ValidationError(
+            f"Cả hai thành viên đều đã đóng góp cho năm {', '.join(str(year) for year in sorted(conflicts))}")
+
+    with transaction.atomic():
+        children = list(FamilyTree.objects.filter(Q(mid=duplicate) | Q(fid=duplicate)).values_list('id', flat=True))
+        FamilyTree.objects.filter(mid=duplicate).update(mid=keep)
+        FamilyTree.objects.filter(fid=duplicate).update(fid=keep)
+
+        through = FamilyTree.pids.through
+        spouse_ids = set(duplicate.pids.values_list('id', flat=True)) - {keep.pk}
+        through.objects.bulk_create(
+            [through(from_familytree_id=a, to_familytree_id=b)
+             for spouse_id in spouse_ids for a, b in ((keep.pk, spouse_id), (spouse_id, keep.pk))],
+            ignore_conflicts=True)
+
+        Income.objects.filter(member=duplicate).update(member=keep)
+        attendees = Event.attendees.through
+        attendees.objects.bulk_create(
+            [attendees(event_id=event_id, familytree_id=keep.pk)
+             for event_id in attendees.objects.filter(familytree_id=duplicate.pk).values_list('event_id', flat=True)],
+            ignore_conflicts=True)
+
+        for field in MERGE_FIELDS:
+            if not getattr(keep, field) and getattr(duplicate, field):
+                setattr(keep, field, getattr(duplicate, field))
+        if keep.education in (None, '', 'none') and duplicate.education not in (None, '', 'none'):
+            keep.education = duplicate.education
+        if not keep.mid_id and not keep.fid_id:
+            keep.mid_id, keep.fid_id = duplicate.mid_id, duplicate.fid_id
+        if keep.user_id is None and duplicate.user_id is not None:
+            # OneToOne: phải gỡ tài khoản khỏi duplicate trước khi gán cho keep
+            keep.user_id = duplicate.user_id
+            FamilyTree.objects.filter(pk=duplicate.pk).update(user=None)
+            duplicate.user = None
+
+        duplicate.delete()
+        keep.save()
+
+        if children:
+            rebuild_lineage(children)
+            propagate_generations(children)
+            members_changed.send(sender=FamilyTree, member_ids=children)
+        if spouse_ids:
+            propagate_generations(spouse_ids | {keep.pk})
+            members_changed.send(sender=FamilyTree, member_ids=spouse_ids)
+
+    return keep
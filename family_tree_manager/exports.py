@@ -0,0 +1,181 @@
+import json
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef, Q
+
+from .gedcom import GEDCOM_MONTHS
+from .models import FamilyTree
+
+EXPORT_CHUNK_SIZE = 500
+GEDCOM_MONTH_NAMES = {number: name for name, number in GEDCOM_MONTHS.items()}
+
+
+def member_fields(exclude_images=False):
+    fields = [field.attname for field in FamilyTree._meta.concrete_fields]
+    if exclude_images:
+        fields.remove('img')
+    return fields
+
+
+def iter_member_chunks(chunk_size=EXPORT_CHUNK_SIZE, exclude_images=False):
+    """
+    Duyệt toàn bộ thành viên bằng server-side cursor, mỗi lần trả về một khối
+    chunk_size dòng đã gắn sẵn pids (một truy vấn phụ cho mỗi khối).
+    """
+    queryset = FamilyTree.objects.order_by('id').values(*member_fields(exclude_images))
+    chunk = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield attach_spouses(chunk)
+            chunk = []
+    if chunk:
+        yield attach_spouses(chunk)
+
+
+def attach_spouses(chunk):
+    spouses = defaultdict(list)
+    through = FamilyTree.pids.through.objects.filter(from_familytree_id__in=[row['id'] for row in chunk])
+    for member_id, spouse_id in through.values_list('from_familytree_id', 'to_familytree_id'):
+        spouses[member_id].append(spouse_id)
+    for row in chunk:
+        row['pids'] = spouses[row['id']]
+    return chunk
+
+
+def iter_ndjson(chunk_size=EXPORT_CHUNK_SIZE, exclude_images=False):
+    for chunk in iter_member_chunks(chunk_size, exclude_images):
+        lines = []
+        for row in chunk:
+            # Giữ tên khóa giống FamilyTreeSerializer
+            for attname in ('mid_id', 'fid_id', 'user_id'):
+                row[attname[:-3]] = row.pop(attname)
+            lines.append(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+        yield '\n'.join(lines) + '\n'
+
+
+def family_xref(*member_ids):
+    return '@F' + '_'.join(str(member_id) for member_id in sorted(m for m in member_ids if m)) + '@'
+
+
+def gedcom_date(value):
+    return f'{value.day} {GEDCOM_MONTH_NAMES[value.month]} {value.year}'
+
+
+def gedcom_name(name):
+    # Họ người Việt đứng đầu tên: "Nguyễn Văn Minh" -> "/Nguyễn/ Văn Minh"
+    parts = (name or '').split(maxsplit=1)
+    if not parts:
+        return '//'
+    return f'/{parts[0]}/ {parts[1]}' if len(parts) > 1 else f'/{parts[0]}/'
+
+
+def gedcom_text(level, tag, text):
+    lines = str(text).splitlines() or ['']
+    yield f'{level} {tag} {lines[0]}'.rstrip()
+    for line in lines[1:]:
+        yield f'{level + 1} CONT {line}'.rstrip()
+
+
+def iter_gedcom_individual(row, families):
+    yield f"0 @I{row['id']}@ INDI"
+    yield f"1 NAME {gedcom_name(row['name'])}"
+    if row['gender'] in ('male', 'female'):
+        yield f"1 SEX {'M' if row['gender'] == 'male' else 'F'}"
+    if row['bdate']:
+        yield '1 BIRT'
+        yield f"2 DATE {gedcom_date(row['bdate'])}"
+    if row['ddate']:
+        yield '1 DEAT'
+        yield f"2 DATE {gedcom_date(row['ddate'])}"
+    if row['mid_id'] or row['fid_id']:
+        yield f"1 FAMC {family_xref(row['mid_id'], row['fid_id'])}"
+    for xref in sorted(families):
+        yield f'1 FAMS {xref}'
+    if row['phone']:
+        yield f"1 PHON {row['phone']}"
+    if row['email']:
+        yield f"1 EMAIL {row['email']}"
+    if row['address']:
+        yield from gedcom_text(1, 'ADDR', row['address'])
+    if row.get('img') and not row['img'].startswith('data:'):
+        yield '1 OBJE'
+        yield f"2 FILE {row['img']}"
+    if row['family_info']:
+        yield from gedcom_text(1, 'NOTE', row['family_info'])
+
+
+def iter_gedcom_families(chunk_size):
+    # Gia đình có con: gom các con liên tiếp có cùng cặp (fid, mid)
+    children = FamilyTree.objects.filter(Q(mid__isnull=False) | Q(fid__isnull=False)).order_by(
+        'fid', 'mid', 'id').values_list('id', 'fid_id', 'mid_id')
+    current, members = None, []
+    for member_id, fid, mid in children.iterator(chunk_size=chunk_size):
+        if (fid, mid) != current:
+            if current is not None:
+                yield iter_gedcom_family(*current, members)
+            current, members = (fid, mid), []
+        members.append(member_id)
+    if current is not None:
+        yield iter_gedcom_family(*current, members)
+
+    # Vợ chồng chưa có con
+    has_children = FamilyTree.objects.filter(
+        Q(fid=OuterRef('from_familytree_id'), mid=OuterRef('to_familytree_id')) |
+        Q(fid=OuterRef('to_familytree_id'), mid=OuterRef('from_familytree_id')))
+    couples = FamilyTree.pids.through.objects.annotate(has_children=Exists(has_children)).filter(
+        has_children=False).order_by('from_familytree_id').values_list(
+        'from_familytree_id', 'to_familytree_id', 'from_familytree__gender')
+    for member_id, spouse_id, gender in couples.iterator(chunk_size=chunk_size):
+        if member_id > spouse_id:
+            continue
+        if gender == 'female':
+            yield iter_gedcom_family(spouse_id, member_id, [])
+        else:
+            yield iter_gedcom_family(member_id, spouse_id, [])
+
+
+def iter_gedcom_family(fid, mid, children):
+    yield f'0 {family_xref(fid, mid)} FAM'
+    if fid:
+        yield f'1 HUSB @I{fid}@'
+    if mid:
+        yield f'1 WIFE @I{mid}@'
+    for child_id in children:
+        yield f'1 CHIL @I{child_id}@'
+
+
+def iter_gedcom(chunk_size=EXPORT_CHUNK_SIZE, exclude_images=False):
+    yield '\r\n'.join([
+        '0 HEAD', '1 SOUR FAMILY_TREE', '1 GEDC', '2 VERS 5.5.1', '2 FORM LINEAGE-LINKED', '1 CHAR UTF-8',
+    ]) + '\r\n'
+
+    for chunk in iter_member_chunks(chunk_size, exclude_images):
+        ids = {row['id'] for row in chunk}
+        families = defaultdict(set)
+        for row in chunk:
+            for spouse_id in row['pids']:
+                families[row['id']].add(family_xref(row['id'], spouse_id))
+        parent_pairs = FamilyTree.objects.filter(Q(mid__in=ids) | Q(fid__in=ids)).values_list(
+            'mid_id', 'fid_id').distinct()
+        for mid, fid in parent_pairs:
+            for parent_id in (mid, fid):
+                if parent_id in ids:
+                    families[parent_id].add(family_xref(mid, fid))
+
+        lines = []
+        for row in chunk:
+            lines.extend(iter_gedcom_individual(row, families[row['id']]))
+        yield '\r\n'.join(lines) + '\r\n'
+
+    lines = []
+    for count, family in enumerate(iter_gedcom_families(chunk_size), start=1):
+        lines.extend(family)
+        if count % chunk_size == 0:
+            yield '\r\n'.join(lines) + '\r\n'
+            lines = []
+    if lines:
+        yield '\r\n'.join(lines) + '\r\n'
+
+    yield '0 TRLR\r\n'
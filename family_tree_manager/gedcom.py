@@ -0,0 +1,225 @@
+import datetime
+import re
+
+from django.db import transaction
+
+from .generations import propagate_generations
+from .lineage import BATCH_SIZE, rebuild_lineage
+from .models import FamilyTree, FamilyTreeClosure
+from .signals import members_changed
+
+GEDCOM_LINE = re.compile(r'^\s*(\d+)\s+(?:(@[^@]+@)\s+)?(\S+)(?:\s(.*))?$')
+GEDCOM_MONTHS = {
+    'JAN': 1, 'FEB': 2, 'MAR': 3, 'APR': 4, 'MAY': 5, 'JUN': 6,
+    'JUL': 7, 'AUG': 8, 'SEP': 9, 'OCT': 10, 'NOV': 11, 'DEC': 12,
+}
+GEDCOM_GENDERS = {'M': 'male', 'F': 'female'}
+
+
+class GedcomRecord:
+    __slots__ = ('tag', 'xref', 'value', 'children')
+
+    def __init__(self, tag, xref=None, value=''):
+        self.tag = tag
+        self.xref = xref
+        self.value = value
+        self.children = []
+
+    def first(self, *path):
+        node = self
+        for tag in path:
+            node = next((child for child in node.children if child.tag == tag), None)
+            if node is None:
+                return None
+        return node
+
+    def value_of(self, *path):
+        node = self.first(*path)
+        return node.value if node is not None else None
+
+    def values_of(self, tag):
+        return [child.value for child in self.children if child.tag == tag]
+
+
+def iter_lines(stream):
+    for number, line in enumerate(stream):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if number == 0:
+            line = line.lstrip('\ufeff')
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        match = GEDCOM_LINE.match(line)
+        if match is None:
+            continue
+        level, xref, tag, value = match.groups()
+        yield int(level), xref, tag.upper(), value or ''
+
+
+def iter_records(stream, tags=None):
+    """
+    Đọc file GEDCOM theo từng bản ghi cấp 0 (INDI, FAM, ...) mà không giữ
+    toàn bộ file trong bộ nhớ. tags giới hạn các loại bản ghi cần trả về.
+    """
+    record = None
+    stack = []
+    for level, xref, tag, value in iter_lines(stream):
+        if level == 0:
+            if record is not None and (tags is None or record.tag in tags):
+                yield record
+            record = GedcomRecord(tag, xref, value)
+            stack = [record]
+            continue
+        if record is None:
+            continue
+
+        del stack[level:]
+        parent = stack[-1]
+        if tag == 'CONC':
+            parent.value += value
+            continue
+        if tag == 'CONT':
+            parent.value += '\n' + value
+            continue
+
+        node = GedcomRecord(tag, xref, value)
+        parent.children.append(node)
+        stack.append(node)
+
+    if record is not None and (tags is None or record.tag in tags):
+        yield record
+
+
+def parse_gedcom_date(value):
+    if not value:
+        return None
+    # Bỏ các tiền tố ABT, BEF, AFT, EST, CAL, BET ... AND ...
+    tokens = [token for token in value.upper().replace('.', ' ').split()
+              if token not in ('ABT', 'BEF', 'AFT', 'EST', 'CAL', 'BET', 'FROM', 'TO', 'INT', 'ABOUT')]
+    if 'AND' in tokens:
+        tokens = tokens[:tokens.index('AND')]
+
+    day, month, year = 1, 1, None
+    for token in tokens[:3]:
+        if token in GEDCOM_MONTHS:
+            month = GEDCOM_MONTHS[token]
+        elif token.isdigit() and len(token) <= 2 and year is None:
+            day = int(token)
+        elif token.isdigit():
+            year = int(token)
+    if year is None:
+        return None
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_gedcom_name(value):
+    return ' '.join(value.replace('/', ' ').split()) if value else ''
+
+
+class GedcomImporter:
+    def __init__(self, batch_size=BATCH_SIZE, default_bdate=None, progress=None):
+        self.batch_size = batch_size
+        self.default_bdate = default_bdate
+        self.progress = progress
+        self.member_ids = {}
+        self.skipped = []
+        self.families = 0
+
+    def report(self, stage, count):
+        if self.progress:
+            self.progress(stage, count)
+
+    def build_member(self, record):
+        bdate = parse_gedcom_date(record.value_of('BIRT', 'DATE')) or self.default_bdate
+        if bdate is None:
+            return None
+
+        name = parse_gedcom_name(record.value_of('NAME'))[:255] or record.xref
+        return FamilyTree(
+            name=name,
+            gender=GEDCOM_GENDERS.get((record.value_of('SEX') or '').upper()[:1], 'male'),
+            bdate=bdate,
+            ddate=parse_gedcom_date(record.value_of('DEAT', 'DATE')),
+            family_info=record.value_of('NOTE'),
+        )
+
+    def import_individuals(self, stream):
+        batch = []
+        for record in iter_records(stream, tags={'INDI'}):
+            member = self.build_member(record)
+            if member is None:
+                self.skipped.append(record.xref)
+                continue
+            batch.append((record.xref, member))
+            if len(batch) >= self.batch_size:
+                self.save_individuals(batch)
+                batch = []
+        self.save_individuals(batch)
+
+    def save_individuals(self, batch):
+        if not batch:
+            return
+        # Các cột suy ra (tên không dấu, ngày sinh/ngày giỗ, closure...) do bulk_create_members tính
+        FamilyTree.objects.bulk_create_members([member for _, member in batch])
+        for xref, member in batch:
+            self.member_ids[xref] = member.id
+        self.report('individuals', len(self.member_ids))
+
+    def import_families(self, stream):
+        parents = {}
+        spouses = set()
+        for record in iter_records(stream, tags={'FAM'}):
+            fid = self.member_ids.get(record.value_of('HUSB'))
+            mid = self.member_ids.get(record.value_of('WIFE'))
+            if fid and mid:
+                spouses.update(((fid, mid), (mid, fid)))
+            for child in record.values_of('CHIL'):
+                child_id = self.member_ids.get(child)
+                if child_id:
+                    parents[child_id] = (mid, fid)
+
+            self.families += 1
+            if len(parents) >= self.batch_size or len(spouses) >= self.batch_size:
+                self.save_families(parents, spouses)
+                parents, spouses = {}, set()
+        self.save_families(parents, spouses)
+
+    def save_families(self, parents, spouses):
+        through = FamilyTree.pids.through
+        with transaction.atomic():
+            FamilyTree.objects.bulk_update(
+                [FamilyTree(id=child_id, mid_id=mid, fid_id=fid) for child_id, (mid, fid) in parents.items()],
+                ['mid', 'fid'], batch_size=self.batch_size)
+            through.objects.bulk_create(
+                [through(from_familytree_id=a, to_familytree_id=b) for a, b in spouses],
+                batch_size=self.batch_size, ignore_conflicts=True)
+        self.report('families', self.families)
+
+    def run(self, stream):
+        """
+        stream phải đọc lại được từ đầu (seek) vì file được duyệt hai lượt:
+        lượt đầu tạo thành viên, lượt sau nối mid/fid/pids theo FAM.
+        """
+        self.import_individuals(stream)
+        stream.seek(0)
+        self.import_families(stream)
+
+        imported = list(self.member_ids.values())
+        with transaction.atomic():
+            # bulk_create_members đã ghi dòng depth 0 khi mid/fid chưa được nối, nên
+            # closure của cả lô được dựng lại từ đầu thay vì cập nhật từng phần
+            FamilyTreeClosure.objects.filter(descendant_id__in=imported).delete()
+            rebuild_lineage(imported)
+            propagate_generations(imported)
+            members_changed.send(sender=FamilyTree, member_ids=imported)
+        self.report('lineage', len(imported))
+
+        return {
+            'individuals': len(imported),
+            'families': self.families,
+            'skipped': self.skipped,
+        }
@@ -0,0 +1,149 @@
+from collections import defaultdict
+
+from django.db.models import Q
+
+from .lineage import BATCH_SIZE, topological_order
+from .signals import members_changed
+
+
+def compute_generations(nodes, spouses, stored, external):
+    """
+    nodes: {id: (mid, fid)} của các thành viên cần tính.
+    spouses: {id: [pid, ...]} của các thành viên không có cha mẹ.
+    stored: {id: generation} đang lưu của các thành viên trên.
+    external: {id: (generation, has_parents)} của cha mẹ/vợ chồng nằm ngoài tập.
+
+    Quy tắc giống FamilyTree.save trước đây: có cha mẹ thì lấy đời lớn nhất của
+    cha mẹ + 1; không có cha mẹ nhưng có đúng một vợ/chồng có cha mẹ (dâu/rể)
+    thì cùng đời với vợ/chồng; còn lại giữ nguyên giá trị đang lưu.
+    """
+    def has_parents(member_id):
+        if member_id in nodes:
+            return any(nodes[member_id])
+        return external.get(member_id, (None, False))[1]
+
+    dependencies = {}
+    for member_id, member_parents in nodes.items():
+        member_parents = tuple(p for p in member_parents if p)
+        member_spouses = tuple(spouses.get(member_id, ()))
+        if member_parents:
+            dependencies[member_id] = member_parents
+        elif len(member_spouses) == 1 and has_parents(member_spouses[0]):
+            dependencies[member_id] = member_spouses
+        else:
+            dependencies[member_id] = ()
+
+    generations = {}
+
+    def lookup(member_id):
+        if member_id in generations:
+            return generations[member_id]
+        return external.get(member_id, (None, False))[0]
+
+    for member_id in topological_order(dependencies):
+        member_parents = tuple(p for p in nodes[member_id] if p)
+        generation = stored[member_id]
+        if member_parents:
+            values = [lookup(p) for p in member_parents]
+            values = [value for value in values if value is not None]
+            generation = max(values) + 1 if values else 1
+        elif dependencies[member_id]:
+            spouse_generation = lookup(dependencies[member_id][0])
+            if spouse_generation is not None:
+                generation = spouse_generation
+        generations[member_id] = generation
+
+    return generations
+
+
+def _load_spouses(member_ids):
+    from .models import FamilyTree
+
+    # Đọc cả hai chiều vì m2m_changed post_add được gửi trước khi Django thêm dòng đối xứng
+    spouses = defaultdict(set)
+    through = FamilyTree.pids.through.objects
+    for member_id, spouse_id in through.filter(from_familytree_id__in=member_ids).values_list(
+            'from_familytree_id', 'to_familytree_id'):
+        spouses[member_id].add(spouse_id)
+    for spouse_id, member_id in through.filter(to_familytree_id__in=member_ids).values_list(
+            'from_familytree_id', 'to_familytree_id'):
+        spouses[member_id].add(spouse_id)
+    return {member_id: list(member_spouses) for member_id, member_spouses in spouses.items()}
+
+
+def _save_generations(generations, stored):
+    from .models import FamilyTree
+
+    changed = [FamilyTree(id=member_id, generation=generation)
+               for member_id, generation in generations.items() if stored.get(member_id) != generation]
+    FamilyTree.objects.bulk_update(changed, ['generation'], batch_size=BATCH_SIZE)
+    changed_ids = [member.id for member in changed]
+    if changed_ids:
+        members_changed.send(sender=FamilyTree, member_ids=changed_ids)
+    return changed_ids
+
+
+def propagate_generations(member_ids):
+    """
+    Tính lại đời cho các thành viên và toàn bộ những người phụ thuộc (con cháu,
+    dâu/rể) bằng BFS theo từng tầng rồi ghi lại bằng một lệnh bulk update.
+    Trả về {id: generation} của các thành viên đã tính.
+    """
+    from .models import FamilyTree
+
+    nodes = {}
+    stored = {}
+    spouses = {}
+
+    frontier = FamilyTree.objects.filter(id__in=set(member_ids))
+    while True:
+        level = []
+        for member_id, mid, fid, generation in frontier.values_list('id', 'mid_id', 'fid_id', 'generation'):
+            if member_id not in nodes:
+                nodes[member_id] = (mid, fid)
+                stored[member_id] = generation
+                level.append(member_id)
+        if not level:
+            break
+
+        roots = [member_id for member_id in level if not any(nodes[member_id])]
+        spouses.update(_load_spouses(roots))
+
+        # Tầng tiếp theo: con của tầng hiện tại và dâu/rể (không có cha mẹ) của họ
+        frontier = FamilyTree.objects.filter(
+            Q(mid_id__in=level) | Q(fid_id__in=level) |
+            Q(pids__in=level, mid__isnull=True, fid__isnull=True)
+        ).distinct()
+
+    referenced = {p for member_parents in nodes.values() for p in member_parents if p}
+    referenced.update(s for member_spouses in spouses.values() for s in member_spouses)
+    referenced.difference_update(nodes)
+    external = {
+        member_id: (generation, bool(mid or fid))
+        for member_id, mid, fid, generation in FamilyTree.objects.filter(
+            id__in=referenced).values_list('id', 'mid_id', 'fid_id', 'generation')
+    }
+
+    generations = compute_generations(nodes, spouses, stored, external)
+    _save_generations(generations, stored)
+    return generations
+
+
+def rebuild_all_generations():
+    from .models import FamilyTree
+
+    nodes = {}
+    stored = {}
+    for member_id, mid, fid, generation in FamilyTree.objects.values_list(
+            'id', 'mid_id', 'fid_id', 'generation').iterator():
+        nodes[member_id] = (mid, fid)
+        stored[member_id] = generation
+
+    spouses = defaultdict(list)
+    for member_id, spouse_id in FamilyTree.pids.through.objects.values_list(
+            'from_familytree_id', 'to_familytree_id').iterator():
+        if not any(nodes.get(member_id, (None, None))):
+            spouses[member_id].append(spouse_id)
+
+    generations = compute_generations(nodes, spouses, stored, {})
+    return _save_generations(generations, stored)
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.db.models import Case, CharField, Count, F, Max, Value, When
+from django.db.models.functions import Concat
+
+from .models import FamilyTree, FamilyTreeChange
+
+
+def build_tree_graph():
+    """
+    Dữ liệu tối thiểu cho widget cây gia phả ở dạng cột (các mảng song song).
+    pids được mã hóa kiểu CSR: vợ/chồng của dòng i là
+    ids[index[k]] với offsets[i] <= k < offsets[i + 1].
+    """
+    # Ưu tiên thumbnail trong kho ảnh; ảnh base64 chưa chuyển đổi không được gửi kèm
+    thumbnail = Case(
+        When(image__thumbnail__gt='', then=Concat(Value(settings.MEDIA_URL), F('image__thumbnail'))),
+        When(img__startswith='data:', then=Value(None)),
+        default=F('img'),
+        output_field=CharField(),
+    )
+    rows = FamilyTree.objects.order_by('id').annotate(thumbnail=thumbnail).values_list(
+        'id', 'mid_id', 'fid_id', 'name', 'gender', 'thumbnail')
+
+    graph = {'id': [], 'mid': [], 'fid': [], 'name': [], 'gender': [], 'img': []}
+    for row in rows.iterator():
+        for column, value in zip(graph.values(), row):
+            column.append(value)
+
+    positions = {member_id: position for position, member_id in enumerate(graph['id'])}
+    offsets = [0] * (len(positions) + 1)
+    index = []
+    links = FamilyTree.pids.through.objects.order_by('from_familytree_id', 'to_familytree_id').values_list(
+        'from_familytree_id', 'to_familytree_id')
+    for member_id, spouse_id in links.iterator():
+        offsets[positions[member_id] + 1] += 1
+        index.append(positions[spouse_id])
+    for position in range(len(positions)):
+        offsets[position + 1] += offsets[position]
+
+    graph['pids'] = {'offsets': offsets, 'index': index}
+    return graph
+
+
+def graph_version():
+    """
+    Phiên bản của cây đọc từ nhật ký thay đổi (mọi thay đổi thành viên, vợ/chồng,
+    ảnh đều ghi một dòng) bằng một truy vấn, để kiểm tra trước khi dựng graph.
+    Số dòng đi kèm id lớn nhất để dòng có id nhỏ hơn nhưng commit muộn vẫn làm
+    đổi phiên bản.
+    """
+    state = FamilyTreeChange.objects.aggregate(last=Max('id'), count=Count('id'))
+    return f"{state['last'] or 0}-{state['count']}"
@@ -0,0 +1,125 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from .generations import compute_generations, rebuild_all_generations
+from .lineage import BATCH_SIZE, topological_order
+from .signals import members_changed
+
+
+def find_cycles(parents):
+    """
+    DFS không đệ quy theo cạnh con -> cha mẹ; trả về danh sách các chu trình
+    (mỗi chu trình là list id). Độ phức tạp O(n + e).
+    """
+    WHITE, GRAY, BLACK = 0, 1, 2
+    color = dict.fromkeys(parents, WHITE)
+    cycles = []
+
+    for start in parents:
+        if color[start] != WHITE:
+            continue
+        color[start] = GRAY
+        path = [start]
+        stack = [iter(p for p in parents[start] if p in parents)]
+        while stack:
+            parent = next(stack[-1], None)
+            if parent is None:
+                color[path.pop()] = BLACK
+                stack.pop()
+            elif color[parent] == WHITE:
+                color[parent] = GRAY
+                path.append(parent)
+                stack.append(iter(p for p in parents[parent] if p in parents))
+            elif color[parent] == GRAY:
+                cycles.append(path[path.index(parent):])
+    return cycles
+
+
+def load_tree():
+    from .models import FamilyTree
+
+    members = {}
+    for member_id, mid, fid, gender, bdate, generation in FamilyTree.objects.values_list(
+            'id', 'mid_id', 'fid_id', 'gender', 'bdate', 'generation').iterator(chunk_size=BATCH_SIZE):
+        members[member_id] = (mid, fid, gender, bdate, generation)
+    links = set(FamilyTree.pids.through.objects.values_list(
+        'from_familytree_id', 'to_familytree_id').iterator(chunk_size=BATCH_SIZE))
+    return members, links
+
+
+def scan_tree():
+    """
+    Đọc toàn bộ cây một lần và liệt kê các bất thường: chu trình cha mẹ, pids
+    không đối xứng hoặc tự trỏ, con sinh trước cha mẹ, cha/mẹ sai giới tính
+    và cột generation lệch so với giá trị tính lại.
+    """
+    members, links = load_tree()
+    parents = {member_id: tuple(p for p in member[:2] if p) for member_id, member in members.items()}
+
+    cycles = find_cycles(parents)
+    in_cycle = {member_id for cycle in cycles for member_id in cycle}
+    # Con cháu của nút trong chu trình không sắp xếp topo được, đời của chúng không xác định
+    ordered = set(topological_order(parents))
+
+    report = {
+        'checked': len(members),
+        'cycles': cycles,
+        'unordered': sorted(set(members) - ordered - in_cycle),
+        'self_spouses': sorted(a for a, b in links if a == b),
+        'asymmetric_pids': sorted([a, b] for a, b in links if a != b and (b, a) not in links),
+        'born_before_parent': [],
+        'wrong_parent_gender': [],
+        'generation_mismatch': [],
+    }
+
+    for member_id, (mid, fid, gender, bdate, generation) in members.items():
+        for parent_id, expected_gender in ((mid, 'female'), (fid, 'male')):
+            if not parent_id or parent_id not in members:
+                continue
+            parent_gender, parent_bdate = members[parent_id][2], members[parent_id][3]
+            if bdate <= parent_bdate:
+                report['born_before_parent'].append({'id': member_id, 'parent': parent_id})
+            if parent_gender != expected_gender:
+                report['wrong_parent_gender'].append({'id': member_id, 'parent': parent_id})
+
+    spouses = defaultdict(set)
+    for a, b in links:
+        if a != b:
+            spouses[a].add(b)
+            spouses[b].add(a)
+    nodes = {member_id: member[:2] for member_id, member in members.items()}
+    stored = {member_id: member[4] for member_id, member in members.items()}
+    expected = compute_generations(
+        nodes, {member_id: sorted(spouses[member_id]) for member_id in nodes if not any(nodes[member_id])},
+        stored, {})
+    report['generation_mismatch'] = [
+        {'id': member_id, 'stored': stored[member_id], 'expected': generation}
+        for member_id, generation in sorted(expected.items()) if stored[member_id] != generation]
+
+    return report
+
+
+def repair_tree(report):
+    """Sửa các lỗi suy ra được: pids tự trỏ/không đối xứng rồi tính lại generation."""
+    from .models import FamilyTree
+
+    through = FamilyTree.pids.through
+    with transaction.atomic():
+        deleted, _ = through.objects.filter(from_familytree_id=F('to_familytree_id')).delete()
+        created = through.objects.bulk_create(
+            [through(from_familytree_id=b, to_familytree_id=a) for a, b in report['asymmetric_pids']],
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+        regenerated = rebuild_all_generations()
+
+        touched = set(report['self_spouses'])
+        touched.update(member_id for pair in report['asymmetric_pids'] for member_id in pair)
+        if touched:
+            members_changed.send(sender=FamilyTree, member_ids=sorted(touched))
+
+    return {
+        'self_spouses_removed': deleted,
+        'pids_added': len(created),
+        'generations_updated': len(regenerated),
+    }
@@ -0,0 +1,163 @@
+from django.db.models import Q
+
+from .models import FamilyTree, FamilyTreeClosure
+
+ANCESTOR_TERMS = {1: ('bố', 'mẹ'), 2: ('ông', 'bà'), 3: ('cụ ông', 'cụ bà'), 4: ('kỵ ông', 'kỵ bà')}
+DESCENDANT_TERMS = {3: 'chắt', 4: 'chút', 5: 'chít'}
+# Vợ/chồng của người thân: thím, mợ, dượng, con dâu...
+IN_LAW_TERMS = {
+    'bác': ('bác', 'bác'), 'chú': ('chú', 'thím'), 'cô': ('chú', 'cô'), 'cậu': ('cậu', 'mợ'), 'dì': ('dượng', 'dì'),
+    'anh': ('anh', 'chị dâu'), 'chị': ('anh rể', 'chị'), 'em trai': ('em trai', 'em dâu'),
+    'em gái': ('em rể', 'em gái'), 'con trai': ('con trai', 'con dâu'), 'con gái': ('con rể', 'con gái'),
+}
+
+
+def is_male(member):
+    return member.gender != 'female'
+
+
+def is_older(member, other):
+    # Ngày sinh bằng nhau thì coi người có id nhỏ hơn (nhập trước) là lớn hơn
+    return (member.bdate, member.id) < (other.bdate, other.id)
+
+
+def ancestor_depths(member_id):
+    return dict(FamilyTreeClosure.objects.filter(descendant_id=member_id).values_list('ancestor_id', 'depth'))
+
+
+def branch_child(ancestor_ids, member, depth):
+    """Con của một trong các tổ tiên chung nằm trên đường từ tổ tiên đó xuống member."""
+    if depth == 0:
+        return member
+    return FamilyTree.objects.filter(
+        Q(mid_id__in=ancestor_ids) | Q(fid_id__in=ancestor_ids),
+        descendant_links__descendant=member, descendant_links__depth=depth - 1,
+    ).order_by('bdate', 'id').first()
+
+
+def parent_side(member, ancestor_ids):
+    if not member.fid_id:
+        return 'ngoại'
+    if member.fid_id in ancestor_ids or FamilyTreeClosure.objects.filter(
+            descendant_id=member.fid_id, ancestor_id__in=ancestor_ids).exists():
+        return 'nội'
+    return 'ngoại'
+
+
+def uncle_term(other, senior, side, suffix=''):
+    # senior: nhánh của other lớn hơn nhánh của bố/mẹ member
+    if senior:
+        return 'bác' + suffix
+    if side == 'nội':
+        return ('chú' if is_male(other) else 'cô') + suffix
+    return ('cậu' if is_male(other) else 'dì') + suffix
+
+
+def kinship_label(member, other, member_depth, other_depth, side, member_branch, other_branch):
+    if member_depth == 0 and other_depth == 0:
+        return 'bản thân'
+
+    if other_depth == 0:
+        if member_depth in ANCESTOR_TERMS:
+            term = ANCESTOR_TERMS[member_depth][0 if is_male(other) else 1]
+            return term if member_depth == 1 else f'{term} {side}'
+        return f'tổ tiên đời thứ {member_depth}'
+
+    if member_depth == 0:
+        if other_depth == 1:
+            return 'con trai' if is_male(other) else 'con gái'
+        if other_depth == 2:
+            return 'cháu nội' if is_male(other_branch) else 'cháu ngoại'
+        return DESCENDANT_TERMS.get(other_depth, f'hậu duệ đời thứ {other_depth}')
+
+    if member_depth == 1 and other_depth == 1:
+        if is_older(other, member):
+            return 'anh' if is_male(other) else 'chị'
+        return 'em trai' if is_male(other) else 'em gái'
+
+    if member_depth == 2 and other_depth == 1:
+        return uncle_term(other, is_older(other, member_branch), side)
+
+    if member_depth == 1 and other_depth == 2:
+        return 'cháu'
+
+    # Họ hàng xa: vai vế theo thứ bậc của nhánh (con chú con bác), không theo tuổi
+    difference = member_depth - other_depth
+    if difference == 0:
+        if is_older(other_branch, member_branch):
+            return 'anh họ' if is_male(other) else 'chị họ'
+        return 'em họ'
+    if difference == 1:
+        return uncle_term(other, is_older(other_branch, member_branch), side, suffix=' họ')
+    if difference == 2:
+        return 'ông họ' if is_male(other) else 'bà họ'
+    if difference > 2:
+        return 'cụ họ'
+    if difference == -1:
+        return 'cháu họ'
+    if difference == -2:
+        return 'chắt họ'
+    return 'hậu duệ họ'
+
+
+def blood_relationship(member, other):
+    member_ancestors = ancestor_depths(member.id)
+    other_ancestors = ancestor_depths(other.id)
+    common = member_ancestors.keys() & other_ancestors.keys()
+    if not common:
+        return None
+
+    # Tổ tiên chung gần nhất: tổng khoảng cách nhỏ nhất (thường là cả bố và mẹ)
+    distance = min(member_ancestors[a] + other_ancestors[a] for a in common)
+    nearest = sorted(a for a in common if member_ancestors[a] + other_ancestors[a] == distance)
+    member_depth = member_ancestors[nearest[0]]
+    other_depth = other_ancestors[nearest[0]]
+
+    side = parent_side(member, nearest) if member_depth >= 2 else None
+    member_branch = branch_child(nearest, member, member_depth)
+    other_branch = branch_child(nearest, other, other_depth)
+    label = kinship_label(member, other, member_depth, other_depth, side,
+                          member_branch or member, other_branch or other)
+
+    return {
+        'common_ancestors': list(FamilyTree.objects.filter(id__in=nearest).values('id', 'name')),
+        'distance': {'member': member_depth, 'other': other_depth},
+        'side': side,
+        'label': label,
+    }
+
+
+def find_relationship(member, other):
+    """Quan hệ của other đối với member, kèm tổ tiên chung gần nhất và khoảng cách đời."""
+    result = {
+        'member': {'id': member.id, 'name': member.name},
+        'other': {'id': other.id, 'name': other.name},
+        'common_ancestors': [],
+        'distance': None,
+        'side': None,
+        'label': None,
+    }
+
+    if member.pids.filter(id=other.id).exists():
+        result['label'] = 'chồng' if is_male(other) else 'vợ'
+        return result
+
+    blood = blood_relationship(member, other)
+    if blood is not None:
+        result.update(blood)
+        return result
+
+    # Không cùng huyết thống: thử qua vợ/chồng của other (thím, mợ, con dâu...)
+    for spouse in other.pids.all():
+        blood = blood_relationship(member, spouse)
+        if blood is None:
+            continue
+        terms = IN_LAW_TERMS.get(blood['label'].removesuffix(' họ'))
+        if terms:
+            label = terms[0 if is_male(other) else 1] + (' họ' if blood['label'].endswith(' họ') else '')
+        else:
+            label = f"{'chồng' if is_male(other) else 'vợ'} của {blood['label']}"
+        result.update(blood, label=label)
+        return result
+
+    return result
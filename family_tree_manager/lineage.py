@@ -0,0 +1,188 @@
+from collections import defaultdict, deque
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+
+BATCH_SIZE = 1000
+
+
+def topological_order(parents):
+    # Sắp xếp Kahn trên đồ thị cha -> con; các nút nằm trong chu trình bị bỏ qua
+    children = defaultdict(list)
+    pending = {}
+    for member_id, member_parents in parents.items():
+        internal = [p for p in member_parents if p in parents]
+        pending[member_id] = len(internal)
+        for parent_id in internal:
+            children[parent_id].append(member_id)
+
+    queue = deque(member_id for member_id, count in pending.items() if count == 0)
+    while queue:
+        member_id = queue.popleft()
+        yield member_id
+        for child_id in children[member_id]:
+            pending[child_id] -= 1
+            if pending[child_id] == 0:
+                queue.append(child_id)
+
+
+def compute_ancestors(parents, known=None):
+    """
+    parents: {id: (mid, fid)} của các nút cần tính.
+    known: {id: {ancestor: depth}} của các cha mẹ nằm ngoài tập trên.
+    Trả về (id, {ancestor: depth}) theo thứ tự topo, không gồm dòng depth 0.
+    """
+    known = known or {}
+    computed = {}
+    for member_id in topological_order(parents):
+        ancestors = {}
+        for parent_id in parents[member_id]:
+            if not parent_id:
+                continue
+            if parent_id in parents:
+                parent_ancestors = computed.get(parent_id, {})
+            else:
+                parent_ancestors = known.get(parent_id, {})
+            candidates = [(parent_id, 1)] + [(a, d + 1) for a, d in parent_ancestors.items()]
+            for ancestor_id, depth in candidates:
+                if depth < ancestors.get(ancestor_id, depth + 1):
+                    ancestors[ancestor_id] = depth
+        computed[member_id] = ancestors
+        yield member_id, ancestors
+
+
+def _closure_rows(closure_model, member_id, ancestors, include_self):
+    if include_self:
+        yield closure_model(ancestor_id=member_id, descendant_id=member_id, depth=0)
+    for ancestor_id, depth in ancestors.items():
+        yield closure_model(ancestor_id=ancestor_id, descendant_id=member_id, depth=depth)
+
+
+def rebuild_lineage(member_ids):
+    """
+    Cập nhật bảng closure sau khi mid/fid của các thành viên thay đổi.
+    Các dòng giữa hai nút cùng nằm trong cây con không đổi, chỉ các dòng
+    nối cây con với tổ tiên bên ngoài được xóa và chèn lại.
+    """
+    from .models import FamilyTree, FamilyTreeClosure
+
+    member_ids = set(member_ids)
+    if not member_ids:
+        return
+
+    subtree = set(member_ids)
+    subtree.update(FamilyTreeClosure.objects.filter(ancestor_id__in=member_ids).values_list('descendant_id', flat=True))
+
+    parents = {
+        member_id: (mid, fid)
+        for member_id, mid, fid in FamilyTree.objects.filter(id__in=subtree).values_list('id', 'mid_id', 'fid_id')
+    }
+    subtree = set(parents)
+
+    external = {p for member_parents in parents.values() for p in member_parents if p and p not in subtree}
+    known = defaultdict(dict)
+    for ancestor_id, descendant_id, depth in FamilyTreeClosure.objects.filter(
+            descendant_id__in=external, depth__gt=0).values_list('ancestor_id', 'descendant_id', 'depth'):
+        known[descendant_id][ancestor_id] = depth
+
+    internal_parents = {member_id: tuple(p for p in member_parents if p) for member_id, member_parents in parents.items()}
+    if sum(1 for _ in topological_order(internal_parents)) != len(internal_parents):
+        raise ValidationError("Không thể chọn hậu duệ làm cha mẹ của thành viên này")
+
+    # Thành viên mới thêm chưa có dòng closure nào, kể cả dòng depth 0
+    fresh = member_ids - set(FamilyTreeClosure.objects.filter(
+        descendant_id__in=member_ids, depth=0).values_list('descendant_id', flat=True))
+
+    FamilyTreeClosure.objects.filter(descendant_id__in=subtree).exclude(ancestor_id__in=subtree).delete()
+
+    rows = []
+    # Chỉ ghi lại phần tổ tiên bên ngoài cây con và các dòng còn thiếu của thành viên mới
+    for member_id, ancestors in compute_ancestors(internal_parents, known):
+        missing = {a: d for a, d in ancestors.items() if a not in subtree or a in fresh}
+        rows.extend(_closure_rows(FamilyTreeClosure, member_id, missing, include_self=member_id in fresh))
+        if len(rows) >= BATCH_SIZE:
+            FamilyTreeClosure.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            rows = []
+    FamilyTreeClosure.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def rebuild_all_lineage(member_model=None, closure_model=None):
+    if member_model is None or closure_model is None:
+        from .models import FamilyTree, FamilyTreeClosure
+        member_model, closure_model = FamilyTree, FamilyTreeClosure
+
+    parents = {
+        member_id: tuple(p for p in (mid, fid) if p)
+        for member_id, mid, fid in member_model.objects.values_list('id', 'mid_id', 'fid_id').iterator()
+    }
+
+    closure_model.objects.all().delete()
+    rows = []
+    for member_id, ancestors in compute_ancestors(parents):
+        rows.extend(_closure_rows(closure_model, member_id, ancestors, include_self=True))
+        if len(rows) >= BATCH_SIZE:
+            closure_model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            rows = []
+    closure_model.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def ancestors_of(member, max_depth=None):
+    from .models import FamilyTree
+
+    condition = Q(descendant_links__descendant=member, descendant_links__depth__gt=0)
+    if max_depth is not None:
+        condition &= Q(descendant_links__depth__lte=max_depth)
+    return FamilyTree.objects.filter(condition).annotate(
+        depth=F('descendant_links__depth')).order_by('depth', 'id')
+
+
+def descendants_of(member, max_depth=None):
+    from .models import FamilyTree
+
+    condition = Q(ancestor_links__ancestor=member, ancestor_links__depth__gt=0)
+    if max_depth is not None:
+        condition &= Q(ancestor_links__depth__lte=max_depth)
+    return FamilyTree.objects.filter(condition).annotate(
+        depth=F('ancestor_links__depth')).order_by('depth', 'id')
+
+
+def neighbourhood(member, up=2, down=2, spouses=True):
+    """
+    Thành viên, tổ tiên trong up đời, con cháu trong down đời và (tùy chọn) vợ/chồng
+    của họ, lấy từ bảng closure nên không phụ thuộc kích thước cả cây. Mỗi nút có
+    level (âm: đời trên, dương: đời dưới), has_more_parents và has_more_children
+    để client mở rộng tiếp.
+    """
+    from .models import FamilyTree
+
+    member.level = 0
+    nodes = {member.id: member}
+    if up > 0:
+        for node in ancestors_of(member, up).prefetch_related('pids'):
+            node.level = -node.depth
+            nodes[node.id] = node
+    if down > 0:
+        for node in descendants_of(member, down).prefetch_related('pids'):
+            node.level = node.depth
+            nodes[node.id] = node
+
+    if spouses:
+        through = FamilyTree.pids.through.objects.filter(from_familytree_id__in=list(nodes))
+        partner_level = {}
+        for member_id, spouse_id in through.values_list('from_familytree_id', 'to_familytree_id'):
+            if spouse_id not in nodes:
+                partner_level.setdefault(spouse_id, nodes[member_id].level)
+        for node in FamilyTree.objects.filter(id__in=list(partner_level)).prefetch_related('pids'):
+            node.level = partner_level[node.id]
+            nodes[node.id] = node
+
+    with_children_outside = set()
+    for mid, fid in FamilyTree.objects.filter(Q(mid__in=list(nodes)) | Q(fid__in=list(nodes))).exclude(
+            id__in=list(nodes)).values_list('mid_id', 'fid_id').distinct():
+        with_children_outside.update((mid, fid))
+
+    for node in nodes.values():
+        node.has_more_parents = any(parent and parent not in nodes for parent in (node.mid_id, node.fid_id))
+        node.has_more_children = node.id in with_children_outside
+
+    return sorted(nodes.values(), key=lambda node: (node.level, node.id))
@@ -0,0 +1,122 @@
+"""
+Đổi ngày dương lịch sang âm lịch Việt Nam (múi giờ +7) theo thuật toán của
+Hồ Ngọc Đức. Điểm sóc và trung khí chỉ được tính khi dựng bảng tháng cho từng
+năm âm lịch; bảng được cache nên đổi một ngày chỉ còn là tìm nhị phân.
+"""
+import bisect
+import math
+from functools import lru_cache
+
+TIME_ZONE = 7.0
+SYNODIC_MONTH = 29.530588853
+# Ngày Julius của điểm sóc gốc (1900-01-01 13:52 UTC)
+NEW_MOON_EPOCH = 2415021.076998695
+
+
+def jd_from_date(day, month, year):
+    """Số ngày Julius của một ngày dương lịch (lịch Gregory, kể cả trước 1582)."""
+    a = (14 - month) // 12
+    y = year + 4800 - a
+    m = month + 12 * a - 3
+    return day + (153 * m + 2) // 5 + 365 * y + y // 4 - y // 100 + y // 400 - 32045
+
+
+def new_moon(k):
+    """Thời điểm (ngày Julius, UTC) của điểm sóc thứ k tính từ NEW_MOON_EPOCH."""
+    t = k / 1236.85
+    t2 = t * t
+    t3 = t2 * t
+    dr = math.pi / 180
+    jd1 = 2415020.75933 + 29.53058868 * k + 0.0001178 * t2 - 0.000000155 * t3
+    jd1 += 0.00033 * math.sin((166.56 + 132.87 * t - 0.009173 * t2) * dr)
+    m = 359.2242 + 29.10535608 * k - 0.0000333 * t2 - 0.00000347 * t3
+    mpr = 306.0253 + 385.81691806 * k + 0.0107306 * t2 + 0.00001236 * t3
+    f = 21.2964 + 390.67050646 * k - 0.0016528 * t2 - 0.00000239 * t3
+    c1 = (0.1734 - 0.000393 * t) * math.sin(m * dr) + 0.0021 * math.sin(2 * dr * m)
+    c1 = c1 - 0.4068 * math.sin(mpr * dr) + 0.0161 * math.sin(dr * 2 * mpr)
+    c1 = c1 - 0.0004 * math.sin(dr * 3 * mpr)
+    c1 = c1 + 0.0104 * math.sin(dr * 2 * f) - 0.0051 * math.sin(dr * (m + mpr))
+    c1 = c1 - 0.0074 * math.sin(dr * (m - mpr)) + 0.0004 * math.sin(dr * (2 * f + m))
+    c1 = c1 - 0.0004 * math.sin(dr * (2 * f - m)) - 0.0006 * math.sin(dr * (2 * f + mpr))
+    c1 = c1 + 0.0010 * math.sin(dr * (2 * f - mpr)) + 0.0005 * math.sin(dr * (2 * mpr + m))
+    if t < -11:
+        delta_t = 0.001 + 0.000839 * t + 0.0002261 * t2 - 0.00000845 * t3 - 0.000000081 * t * t3
+    else:
+        delta_t = -0.000278 + 0.000265 * t + 0.000262 * t2
+    return jd1 + c1 - delta_t
+
+
+def new_moon_day(k):
+    return math.floor(new_moon(k) + 0.5 + TIME_ZONE / 24)
+
+
+def sun_longitude_sector(jdn):
+    """Kinh độ mặt trời lúc 0h ngày jdn, quy về cung 30 độ (0..11)."""
+    t = (jdn - 2451545.5 - TIME_ZONE / 24) / 36525
+    t2 = t * t
+    dr = math.pi / 180
+    m = 357.52910 + 35999.05030 * t - 0.0001559 * t2 - 0.00000048 * t * t2
+    l0 = 280.46645 + 36000.76983 * t + 0.0003032 * t2
+    dl = (1.914600 - 0.004817 * t - 0.000014 * t2) * math.sin(dr * m)
+    dl += (0.019993 - 0.000101 * t) * math.sin(dr * 2 * m) + 0.000290 * math.sin(dr * 3 * m)
+    longitude = (l0 + dl) * dr
+    longitude -= math.pi * 2 * math.floor(longitude / (math.pi * 2))
+    return math.floor(longitude / math.pi * 6)
+
+
+@lru_cache(maxsize=None)
+def month_11_start(year):
+    """Ngày Julius bắt đầu tháng 11 âm lịch (tháng chứa Đông chí) của năm dương lịch year."""
+    k = math.floor((jd_from_date(31, 12, year) - 2415021) / SYNODIC_MONTH)
+    start = new_moon_day(k)
+    if sun_longitude_sector(start) >= 9:
+        start = new_moon_day(k - 1)
+    return start
+
+
+@lru_cache(maxsize=None)
+def month_table(year):
+    """
+    Các tháng âm lịch từ tháng 11 năm year - 1 đến hết tháng 10 năm year:
+    (ngày bắt đầu, danh sách (tháng, năm âm lịch, nhuận)). Năm có 13 tháng thì
+    tháng nhuận là tháng đầu tiên không chứa trung khí.
+    """
+    a11, b11 = month_11_start(year - 1), month_11_start(year)
+    k = math.floor((a11 - NEW_MOON_EPOCH) / SYNODIC_MONTH + 0.5)
+    starts = [a11]
+    while starts[-1] < b11:
+        starts.append(new_moon_day(k + len(starts)))
+    starts.pop()
+
+    leap_index = None
+    if len(starts) == 13:
+        sectors = [sun_longitude_sector(new_moon_day(k + i)) for i in range(1, 15)]
+        leap_index = next((i for i in range(1, 14) if sectors[i] == sectors[i - 1]), 13)
+
+    months = []
+    for index in range(len(starts)):
+        offset = index - 1 if leap_index is not None and index >= leap_index else index
+        month = (offset + 10) % 12 + 1
+        lunar_year = year - 1 if month >= 11 and index < 4 else year
+        months.append((month, lunar_year, index == leap_index))
+    return starts, months
+
+
+def solar_to_lunar(value):
+    """date -> (ngày, tháng, năm, nhuận) âm lịch."""
+    jdn = jd_from_date(value.day, value.month, value.year)
+    year = value.year + 1 if jdn >= month_11_start(value.year) else value.year
+    starts, months = month_table(year)
+    index = bisect.bisect_right(starts, jdn) - 1
+    month, lunar_year, leap = months[index]
+    return jdn - starts[index] + 1, month, lunar_year, leap
+
+
+def lunar_month_length(value):
+    """Số ngày (29 hoặc 30) của tháng âm lịch chứa ngày dương lịch value."""
+    jdn = jd_from_date(value.day, value.month, value.year)
+    year = value.year + 1 if jdn >= month_11_start(value.year) else value.year
+    starts, _ = month_table(year)
+    index = bisect.bisect_right(starts, jdn) - 1
+    end = starts[index + 1] if index + 1 < len(starts) else month_11_start(year)
+    return end - starts[index]
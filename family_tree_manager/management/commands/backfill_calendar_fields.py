@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from family_tree_manager.anniversaries import backfill_calendar_fields
+from family_tree_manager.models import FamilyTree
+
+
+class Command(BaseCommand):
+    help = 'Tính lại ngày/tháng sinh và ngày/tháng giỗ âm lịch cho toàn bộ thành viên'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with transaction.atomic():
+            updated = backfill_calendar_fields(FamilyTree, options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Đã cập nhật {updated} thành viên trong {time.monotonic() - started:.1f}s'))
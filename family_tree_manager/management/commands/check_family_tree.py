@@ -0,0 +1,21 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from family_tree_manager.integrity import repair_tree, scan_tree
+
+
+class Command(BaseCommand):
+    help = 'Kiểm tra tính toàn vẹn của cây gia phả (chu trình, pids, ngày sinh, đời)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Sửa các lỗi suy ra được: pids tự trỏ/không đối xứng và cột generation')
+
+    def handle(self, *args, **options):
+        report = scan_tree()
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+
+        if options['repair']:
+            repaired = repair_tree(report)
+            self.stdout.write(self.style.SUCCESS(json.dumps(repaired, ensure_ascii=False)))
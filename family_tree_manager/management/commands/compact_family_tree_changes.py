@@ -0,0 +1,19 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from family_tree_manager.changes import compact_changes
+
+
+class Command(BaseCommand):
+    help = 'Xóa nhật ký thay đổi cũ của cây gia phả (client có cursor cũ hơn sẽ phải tải lại toàn bộ)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Giữ lại nhật ký trong số ngày gần nhất')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        deleted = compact_changes(before)
+
+        self.stdout.write(self.style.SUCCESS(f'Đã nén {deleted} dòng nhật ký'))
@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from family_tree_manager.exports import EXPORT_CHUNK_SIZE, iter_gedcom, iter_ndjson
+
+
+class Command(BaseCommand):
+    help = 'Xuất toàn bộ gia phả ra GEDCOM 5.5.1 hoặc NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['ged', 'ndjson'], default='ged')
+        parser.add_argument('--output', help='Đường dẫn file (mặc định: stdout)')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--exclude-images', action='store_true')
+
+    def handle(self, *args, **options):
+        exporter = iter_gedcom if options['format'] == 'ged' else iter_ndjson
+        chunks = exporter(chunk_size=options['chunk_size'], exclude_images=options['exclude_images'])
+
+        if not options['output']:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stdout.write(self.style.SUCCESS(f"Đã xuất ra {options['output']}"))
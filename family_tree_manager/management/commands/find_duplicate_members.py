@@ -0,0 +1,20 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from family_tree_manager.duplicates import DUPLICATE_THRESHOLD, find_duplicates
+
+
+class Command(BaseCommand):
+    help = 'Tìm các thành viên có thể bị nhập trùng (mỗi dòng JSON là một cặp ứng viên)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=DUPLICATE_THRESHOLD)
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        candidates = find_duplicates(options['threshold'], options['limit'])
+        for candidate in candidates:
+            self.stdout.write(json.dumps(candidate, ensure_ascii=False))
+
+        self.stderr.write(self.style.SUCCESS(f'Tìm thấy {len(candidates)} cặp có thể trùng'))
@@ -0,0 +1,32 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from family_tree_manager.gedcom import GedcomImporter
+
+
+class Command(BaseCommand):
+    help = 'Nhập thành viên từ file GEDCOM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--default-bdate', type=datetime.date.fromisoformat, default=None,
+                            help='Ngày sinh dùng khi bản ghi không có BIRT DATE (mặc định: bỏ qua bản ghi)')
+
+    def handle(self, *args, **options):
+        def progress(stage, count):
+            self.stdout.write(f'{stage}: {count}')
+
+        importer = GedcomImporter(batch_size=options['batch_size'], default_bdate=options['default_bdate'],
+                                  progress=progress)
+        try:
+            with open(options['path'], 'rb') as stream:
+                result = importer.run(stream)
+        except OSError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Đã nhập {result['individuals']} thành viên, {result['families']} gia đình"))
+        if result['skipped']:
+            self.stdout.write(self.style.WARNING(f"Bỏ qua {len(result['skipped'])} bản ghi không có ngày sinh"))
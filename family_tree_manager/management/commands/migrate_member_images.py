@@ -0,0 +1,59 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from family_tree_manager.models import FamilyTree
+from family_tree_manager.signals import members_changed
+from image_upload.models import Image
+from image_upload.thumbnails import convert_data_url
+
+
+class Command(BaseCommand):
+    help = 'Chuyển ảnh base64 trong FamilyTree.img sang kho ảnh và tạo thumbnail'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Số process giải mã/tạo thumbnail (mặc định: số CPU)')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        converted_count = 0
+        failed = []
+        last_id = 0
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                batch = list(FamilyTree.objects.filter(id__gt=last_id, img__startswith='data:').order_by(
+                    'id').values_list('id', 'img')[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+
+                # Phần tốn CPU (base64, Pillow) chạy song song, phần ghi DB chạy ở process chính
+                results = pool.map(convert_data_url, [img for _, img in batch])
+
+                members = []
+                try:
+                    with transaction.atomic():
+                        for (member_id, _), converted in zip(batch, results):
+                            if converted is None:
+                                failed.append(member_id)
+                                continue
+                            image = Image.objects.create_from_converted(converted)
+                            members.append(FamilyTree(id=member_id, image=image, img=image.file.url))
+                        FamilyTree.objects.bulk_update(members, ['image', 'img'])
+                        members_changed.send(sender=FamilyTree, member_ids=[member.id for member in members])
+                except Exception:
+                    # Lô bị rollback: xóa các file đã ghi để không bỏ lại file mồ côi
+                    for member in members:
+                        member.image.delete_files()
+                    raise
+
+                converted_count += len(members)
+                self.stdout.write(f'{converted_count} ảnh đã chuyển (đến id {last_id})')
+
+        self.stdout.write(self.style.SUCCESS(f'Hoàn tất: {converted_count} ảnh'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Không đọc được ảnh của các thành viên: {failed}'))
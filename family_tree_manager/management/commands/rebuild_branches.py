@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from family_tree_manager.branches import rebuild_all_branches
+
+
+class Command(BaseCommand):
+    help = 'Tính lại chi/nhánh của toàn bộ thành viên theo dòng cha và rollup của các chi'
+
+    def handle(self, *args, **options):
+        changed = rebuild_all_branches()
+
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật chi cho {len(changed)} thành viên'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from family_tree_manager.generations import rebuild_all_generations
+
+
+class Command(BaseCommand):
+    help = 'Tính lại cột generation cho toàn bộ cây gia phả'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            changed = rebuild_all_generations()
+
+        self.stdout.write(self.style.SUCCESS(f'Đã cập nhật đời cho {len(changed)} thành viên'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from family_tree_manager.lineage import rebuild_all_lineage
+from family_tree_manager.models import FamilyTreeClosure
+
+
+class Command(BaseCommand):
+    help = 'Xây dựng lại bảng tổ tiên/hậu duệ (closure) từ mid/fid'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_all_lineage()
+
+        self.stdout.write(self.style.SUCCESS(f'Đã tạo {FamilyTreeClosure.objects.count()} dòng closure'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from family_tree_manager.branches import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = ('Tính lại rollup của mọi chi. Chạy định kỳ (vd. cron ngày 1/1) để tiền đóng góp '
+            '"năm nay" chuyển sang năm mới; trong năm rollup được cập nhật bằng signal')
+
+    def handle(self, *args, **options):
+        branches = refresh_rollups()
+
+        self.stdout.write(self.style.SUCCESS(f'Đã tính lại rollup của {len(branches)} chi'))
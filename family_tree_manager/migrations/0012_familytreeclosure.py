@@ -0,0 +1,86 @@
+# Generated by Django 4.1 on 2026-10-18 17:01
+
+from collections import defaultdict, deque
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def populate_closure(apps, schema_editor):
+    # Chép lại thuật toán của lineage.rebuild_all_lineage để migration không phụ thuộc code hiện tại của app
+    FamilyTree = apps.get_model('family_tree_manager', 'FamilyTree')
+    FamilyTreeClosure = apps.get_model('family_tree_manager', 'FamilyTreeClosure')
+
+    parents = {
+        member_id: tuple(p for p in (mid, fid) if p)
+        for member_id, mid, fid in FamilyTree.objects.values_list('id', 'mid_id', 'fid_id').iterator()
+    }
+
+    # Sắp xếp Kahn trên đồ thị cha -> con; các nút nằm trong chu trình bị bỏ qua
+    children = defaultdict(list)
+    pending = {}
+    for member_id, member_parents in parents.items():
+        internal = [p for p in member_parents if p in parents]
+        pending[member_id] = len(internal)
+        for parent_id in internal:
+            children[parent_id].append(member_id)
+    queue = deque(member_id for member_id, count in pending.items() if count == 0)
+
+    computed = {}
+    rows = []
+    while queue:
+        member_id = queue.popleft()
+        for child_id in children[member_id]:
+            pending[child_id] -= 1
+            if pending[child_id] == 0:
+                queue.append(child_id)
+
+        ancestors = {}
+        for parent_id in parents[member_id]:
+            candidates = [(parent_id, 1)] + [(a, d + 1) for a, d in computed.get(parent_id, {}).items()]
+            for ancestor_id, depth in candidates:
+                if depth < ancestors.get(ancestor_id, depth + 1):
+                    ancestors[ancestor_id] = depth
+        computed[member_id] = ancestors
+
+        rows.append(FamilyTreeClosure(ancestor_id=member_id, descendant_id=member_id, depth=0))
+        rows.extend(FamilyTreeClosure(ancestor_id=ancestor_id, descendant_id=member_id, depth=depth)
+                    for ancestor_id, depth in ancestors.items())
+        if len(rows) >= BATCH_SIZE:
+            FamilyTreeClosure.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            rows = []
+    FamilyTreeClosure.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('family_tree_manager', '0011_familytree_achievement_familytree_education'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FamilyTreeClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='family_tree_manager.familytree')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='family_tree_manager.familytree')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='familytreeclosure',
+            index=models.Index(fields=['ancestor', 'depth'], name='family_tree_ancesto_01ea6e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='familytreeclosure',
+            index=models.Index(fields=['descendant', 'depth'], name='family_tree_descend_a3184c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='familytreeclosure',
+            unique_together={('ancestor', 'descendant')},
+        ),
+        migrations.RunPython(populate_closure, migrations.RunPython.noop),
+    ]
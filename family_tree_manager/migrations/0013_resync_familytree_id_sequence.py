@@ -0,0 +1,24 @@
+# Generated by Django 4.1 on 2026-10-18 17:20
+
+from django.core.management.color import no_style
+from django.db import migrations
+
+
+def resync_id_sequence(apps, schema_editor):
+    # Trước đây id được tự cấp bằng max(id) + 1 nên sequence có thể bị lệch
+    FamilyTree = apps.get_model('family_tree_manager', 'FamilyTree')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for statement in connection.ops.sequence_reset_sql(no_style(), [FamilyTree]):
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('family_tree_manager', '0012_familytreeclosure'),
+    ]
+
+    operations = [
+        migrations.RunPython(resync_id_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.1 on 2026-10-18 17:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_upload', '0008_image_thumbnail'),
+        ('family_tree_manager', '0013_resync_familytree_id_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='familytree',
+            name='image',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='members', to='image_upload.image'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.1 on 2026-10-18 19:20
+
+import unicodedata
+
+from django.db import migrations, models
+
+TRIGRAM_INDEX = 'family_tree_name_normalized_trgm'
+
+
+def normalize_name(value):
+    # Bản chép của search.normalize_name tại thời điểm tạo cột
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFD', value.replace('đ', 'd').replace('Đ', 'D'))
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.lower().split())
+
+
+def populate_name_normalized(apps, schema_editor):
+    FamilyTree = apps.get_model('family_tree_manager', 'FamilyTree')
+    batch = []
+    for member in FamilyTree.objects.only('id', 'name').iterator(chunk_size=1000):
+        member.name_normalized = normalize_name(member.name)
+        batch.append(member)
+        if len(batch) >= 1000:
+            FamilyTree.objects.bulk_update(batch, ['name_normalized'])
+            batch = []
+    FamilyTree.objects.bulk_update(batch, ['name_normalized'])
+
+
+def create_trigram_index(apps, schema_editor):
+    # Index GIN trigram chỉ có trên Postgres; database khác dùng chỉ mục trong bộ nhớ
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    FamilyTree = apps.get_model('family_tree_manager', 'FamilyTree')
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON {schema_editor.quote_name(FamilyTree._meta.db_table)} '
+        f'USING gin (name_normalized gin_trgm_ops)')
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {TRIGRAM_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('family_tree_manager', '0014_familytree_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='familytree',
+            name='name_normalized',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_name_normalized, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+def create_baseline(apps, schema_editor):
+    # Mốc đầu tiên: client chưa có cursor phải tải toàn bộ cây một lần
+    FamilyTreeChange = apps.get_model('family_tree_manager', 'FamilyTreeChange')
+    FamilyTreeChange.objects.create(action='baseline')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('family_tree_manager', '0015_familytree_name_normalized'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FamilyTreeChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_id', models.IntegerField(blank=True, null=True)),
+                ('action', models.CharField(choices=[('upsert', 'Thêm/sửa'), ('delete', 'Xóa'), ('baseline', 'Mốc nén nhật ký')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.RunPython(create_baseline, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.1 on 2026-10-18 20:10
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models.functions import ExtractDay, ExtractMonth
+
+# Chỉ dùng hàm đổi lịch thuần (không đụng tới model); phần ghi dữ liệu được chép vào migration
+from family_tree_manager.lunar import solar_to_lunar
+
+BATCH_SIZE = 1000
+
+
+def populate_calendar_fields(apps, schema_editor):
+    FamilyTree = apps.get_model('family_tree_manager', 'FamilyTree')
+    FamilyTree.objects.update(birth_month=ExtractMonth('bdate'), birth_day=ExtractDay('bdate'))
+
+    # Mỗi ngày mất khác nhau chỉ đổi âm lịch một lần
+    by_lunar_day = defaultdict(list)
+    for ddate in FamilyTree.objects.filter(ddate__isnull=False).values_list('ddate', flat=True).distinct().iterator():
+        day, month, _, _ = solar_to_lunar(ddate)
+        by_lunar_day[(month, day)].append(ddate)
+    for (month, day), ddates in by_lunar_day.items():
+        for index in range(0, len(ddates), BATCH_SIZE):
+            FamilyTree.objects.filter(ddate__in=ddates[index:index + BATCH_SIZE]).update(
+                death_lunar_month=month, death_lunar_day=day)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('family_tree_manager', '0016_familytreechange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='familytree',
+            name='birth_day',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='familytree',
+            name='birth_month',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='familytree',
+            name='death_lunar_day',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='familytree',
+            name='death_lunar_month',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='familytree',
+            name='ddate',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='familytree',
+            index=models.Index(fields=['birth_month', 'birth_day'], name='family_tree_birth_md_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='familytree',
+            index=models.Index(fields=['death_lunar_month', 'death_lunar_day'], name='family_tree_death_lunar_md_idx'),
+        ),
+        migrations.RunPython(populate_calendar_fields, migrations.RunPython.noop),
+    ]
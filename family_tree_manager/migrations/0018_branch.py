@@ -0,0 +1,34 @@
+# Generated by Django 4.1 on 2026-10-18 20:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('family_tree_manager', '0017_familytree_calendar_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Branch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('note', models.TextField(blank=True, null=True)),
+                ('member_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('living_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('dues_year', models.PositiveIntegerField(blank=True, editable=False, null=True)),
+                ('dues_paid', models.BigIntegerField(default=0, editable=False)),
+                ('paid_member_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('refreshed_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('root', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='founded_branch', to='family_tree_manager.familytree')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='familytree',
+            name='branch',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='members', to='family_tree_manager.branch'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('family_tree_manager', '0018_branch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='familytreechange',
+            name='txid',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='familytreechange',
+            index=models.Index(fields=['txid', 'id'], name='family_tree_txid_fafe74_idx'),
+        ),
+    ]
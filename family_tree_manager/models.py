@@ -1,14 +1,104 @@
-from django.db import models
+from django.db import models, transaction
 
 from django.contrib.auth.models import User
 from django.db.models import Q
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 
+from financial_management.signals import incomes_created
+from image_upload.models import Image
+
+from .anniversaries import calendar_fields
+from .branches import ROLLUP_FIELDS, assign_branches, refresh_rollups, schedule_rollups
+from .changes import record_changes
+from .generations import compute_generations, propagate_generations
+from .lineage import BATCH_SIZE, rebuild_lineage, topological_order
+from .signals import members_changed, members_deleted
+from .search import normalize_name, reset_ngram_index
+from .statistics import invalidate_statistics
 from .validators import phone_regex
 
 
+class FamilyTreeManager(models.Manager):
+    def bulk_create_members(self, members, spouses=()):
+        """
+        Thêm nhiều thành viên chưa lưu cùng lúc. mid/fid có thể trỏ tới thành
+        viên đã có hoặc thành viên khác trong cùng danh sách; spouses là các cặp
+        (a, b) sẽ được thêm vào pids. Mỗi tầng cha-con trong danh sách chỉ tốn
+        một câu INSERT; đời và bảng closure được tính luôn trong lượt này.
+        """
+        members = list(members)
+        if not members:
+            return members
+
+        # Khóa tạm (số âm) cho thành viên chưa có id
+        keys = {id(member): -index for index, member in enumerate(members, start=1)}
+
+        def key_of(member):
+            return keys.get(id(member), member.pk)
+
+        def parent_key(member, name):
+            field = self.model._meta.get_field(name)
+            if field.is_cached(member):
+                parent = field.get_cached_value(member)
+                return key_of(parent) if parent is not None else None
+            return getattr(member, field.attname)
+
+        nodes = {keys[id(member)]: (parent_key(member, 'mid'), parent_key(member, 'fid')) for member in members}
+        if len(set(topological_order(nodes))) != len(nodes):
+            raise ValidationError("Danh sách thành viên có quan hệ cha mẹ vòng tròn")
+
+        spouse_keys = {}
+        for member_a, member_b in spouses:
+            spouse_keys.setdefault(key_of(member_a), set()).add(key_of(member_b))
+            spouse_keys.setdefault(key_of(member_b), set()).add(key_of(member_a))
+
+        referenced = {key for parents in nodes.values() for key in parents if key and key > 0}
+        referenced.update(key for key_set in spouse_keys.values() for key in key_set if key > 0)
+        external = {
+            member_id: (generation, bool(mid or fid))
+            for member_id, mid, fid, generation in self.filter(id__in=referenced).values_list(
+                'id', 'mid_id', 'fid_id', 'generation')
+        }
+        stored = {keys[id(member)]: member.generation for member in members}
+        generations = compute_generations(
+            nodes, {key: list(spouse_keys.get(key, ())) for key in nodes}, stored, external)
+
+        by_key = {keys[id(member)]: member for member in members}
+        for member in members:
+            member.name_normalized = normalize_name(member.name)
+            for field, value in calendar_fields(member.bdate, member.ddate).items():
+                setattr(member, field, value)
+        for key, generation in generations.items():
+            by_key[key].generation = generation
+
+        levels = {}
+        for key in topological_order(nodes):
+            parent_levels = [levels[parent] for parent in nodes[key] if parent in levels]
+            levels[key] = max(parent_levels) + 1 if parent_levels else 0
+
+        with transaction.atomic(using=self.db):
+            for level in range(max(levels.values()) + 1):
+                batch = [by_key[key] for key, member_level in levels.items() if member_level == level]
+                self.bulk_create(batch, batch_size=BATCH_SIZE)
+
+            through = self.model.pids.through
+            links = {(a.pk, b.pk) for member_a, member_b in spouses
+                     for a, b in ((member_a, member_b), (member_b, member_a))}
+            through.objects.using(self.db).bulk_create(
+                [through(from_familytree_id=a, to_familytree_id=b) for a, b in links],
+                batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+            rebuild_lineage([member.pk for member in members])
+
+        members_changed.send(sender=self.model, member_ids=[member.pk for member in members])
+        for member in members:
+            member._loaded_parents = (member.mid_id, member.fid_id)
+            member._loaded_generation = member.generation
+        return members
+
+
 class FamilyTree(models.Model):
     id = models.AutoField(primary_key=True)
     mid = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='children',
@@ -18,9 +108,17 @@ class FamilyTree(models.Model):
     pids = models.ManyToManyField('self', blank=True, related_name='parents')
     gender = models.CharField(max_length=10)
     name = models.CharField(max_length=255)
+    # Tên không dấu, chữ thường dùng cho tìm kiếm (có index trigram trên Postgres)
+    name_normalized = models.CharField(max_length=255, blank=True, default='', editable=False)
     img = models.TextField(null=True, blank=True)
+    image = models.ForeignKey(Image, on_delete=models.SET_NULL, null=True, blank=True, related_name='members')
     bdate = models.DateField()
-    ddate = models.DateField(null=True, blank=True)
+    ddate = models.DateField(null=True, blank=True, db_index=True)
+    # Ngày/tháng sinh (dương lịch) và ngày/tháng mất (âm lịch) để tra sinh nhật, ngày giỗ theo index
+    birth_month = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    birth_day = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    death_lunar_month = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
+    death_lunar_day = models.PositiveSmallIntegerField(null=True, blank=True, editable=False)
     phone = models.CharField(max_length=11, validators=[phone_regex], blank=True, null=True)
     email = models.EmailField(max_length=50, blank=True, null=True)
     address = models.CharField(max_length=255, blank=True, null=True)
@@ -28,6 +126,9 @@ class FamilyTree(models.Model):
     generation = models.PositiveIntegerField(default=1)
     user = models.OneToOneField(User, on_delete=models.CASCADE, blank=True, null=True)
     is_admin = models.BooleanField(default=False, blank=True, null=True)
+    # Chi/nhánh suy ra từ dòng cha (fid), được cập nhật tự động
+    branch = models.ForeignKey('Branch', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+                               related_name='members')
     EDUCATION_CHOICES = (
         ('none', 'Không có'),
         ('elementary', 'Tiểu học'),
@@ -42,33 +143,70 @@ class FamilyTree(models.Model):
     education = models.CharField(max_length=20, choices=EDUCATION_CHOICES, default='none', blank=True, null=True)
     achievement = models.TextField(blank=True, null=True)
 
+    objects = FamilyTreeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['birth_month', 'birth_day'], name='family_tree_birth_md_idx'),
+            models.Index(fields=['death_lunar_month', 'death_lunar_day'], name='family_tree_death_lunar_md_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_parents = (instance.__dict__.get('mid_id'), instance.__dict__.get('fid_id'))
+        instance._loaded_generation = instance.__dict__.get('generation')
+        instance._loaded_image = instance.__dict__.get('image_id')
+        return instance
+
     def save(self, *args, **kwargs):
-        # self.save_base(*args, **kwargs)
-
-        if not self.id:
-            if FamilyTree.objects.order_by('-id').first():
-                self.id = FamilyTree.objects.order_by('-id').first().id + 1
-            else:
-                self.id = 1
-
-        if self.mid or self.fid:
-            max_generation = \
-                FamilyTree.objects.filter(id__in=[self.mid.id, self.fid.id]).aggregate(
-                    max_generation=models.Max('generation'))[
-                    'max_generation']
-            self.generation = max_generation + 1 if max_generation is not None else 1
-        elif self.pids and self.pids.count() == 1:
-            for pid in self.pids.all():
-                if pid.mid or pid.fid:
-                    max_generation = \
-                        FamilyTree.objects.filter(id__in=[pid.mid.id, pid.fid.id]).aggregate(
-                            max_generation=models.Max('generation'))[
-                            'max_generation']
-                    self.generation = max_generation + 1 if max_generation is not None else 1
-                else:
-                    self.generation = 1
-
-        super().save(*args, **kwargs)
+        self.name_normalized = normalize_name(self.name)
+        for field, value in calendar_fields(self.bdate, self.ddate).items():
+            setattr(self, field, value)
+
+        # id do sequence của database cấp phát
+        parents_changed = (self.mid_id, self.fid_id) != getattr(self, '_loaded_parents', None)
+        generation_changed = self.generation != getattr(self, '_loaded_generation', None)
+        # Thành viên mới không có cha mẹ: chưa có con cháu, vợ/chồng nên không có chi,
+        # đời giữ nguyên; closure chỉ có dòng của chính nó
+        new_root = self._state.adding and not self.mid_id and not self.fid_id
+
+        img, image_id, new_image = self.img, self.image_id, None
+        try:
+            with transaction.atomic():
+                # Ảnh base64 được chuyển sang kho ảnh, img chỉ giữ URL
+                if self.img and self.img.startswith('data:'):
+                    new_image = Image.objects.create_from_data_url(self.img)
+                    if new_image is not None:
+                        self.image = new_image
+                        self.img = new_image.file.url
+
+                super().save(*args, **kwargs)
+
+                if new_root:
+                    FamilyTreeClosure.objects.create(ancestor_id=self.id, descendant_id=self.id, depth=0)
+                elif parents_changed:
+                    rebuild_lineage([self.id])
+                    self.branch_id = assign_branches([self.id]).get(self.id)
+
+                if not new_root and (parents_changed or generation_changed):
+                    # Đời của thành viên và toàn bộ con cháu được tính lại trong một lượt
+                    self.generation = propagate_generations([self.id]).get(self.id, self.generation)
+        except Exception:
+            # Dòng Image đã rollback, file vừa ghi lên storage phải xóa tay
+            if new_image is not None:
+                new_image.delete_files()
+                self.img, self.image_id = img, image_id
+            raise
+
+        old_image_id = getattr(self, '_loaded_image', None)
+        if old_image_id and old_image_id != self.image_id:
+            # Ảnh cũ bị thay thế được dọn sau khi commit (nếu không còn ai dùng)
+            transaction.on_commit(lambda: Image.objects.delete_unused([old_image_id]))
+
+        self._loaded_parents = (self.mid_id, self.fid_id)
+        self._loaded_generation = self.generation
+        self._loaded_image = self.image_id
 
     def delete(self, *args, **kwargs):
         # Kiểm tra xem đối tượng này có được liên kết làm fid hoặc mid cho đối tượng khác không
@@ -83,6 +221,84 @@ class FamilyTree(models.Model):
         return self.name
 
 
+class FamilyTreeClosure(models.Model):
+    ancestor = models.ForeignKey(FamilyTree, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(FamilyTree, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['ancestor', 'depth']),
+            models.Index(fields=['descendant', 'depth']),
+        ]
+
+    def __str__(self):
+        return f'{self.ancestor_id} -> {self.descendant_id} ({self.depth})'
+
+
+class FamilyTreeChange(models.Model):
+    # Nhật ký chỉ ghi thêm, dùng cho đồng bộ delta (?since=)
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    BASELINE = 'baseline'
+    ACTION_CHOICES = (
+        (UPSERT, 'Thêm/sửa'),
+        (DELETE, 'Xóa'),
+        (BASELINE, 'Mốc nén nhật ký'),
+    )
+    # Không dùng khóa ngoại vì dòng xóa phải tồn tại lâu hơn thành viên
+    member_id = models.IntegerField(null=True, blank=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # txid của transaction đã ghi dòng (Postgres), đồng bộ delta đi theo thứ tự (txid, id)
+    txid = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['txid', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.id}: {self.action} {self.member_id}'
+
+
+class Branch(models.Model):
+    name = models.CharField(max_length=255)
+    # Thành viên gốc của chi; con cháu theo dòng cha (fid) thuộc chi này cho tới khi gặp gốc của chi khác
+    root = models.OneToOneField(FamilyTree, on_delete=models.CASCADE, related_name='founded_branch')
+    note = models.TextField(null=True, blank=True)
+    # Rollup được tính lại bằng signal, không tính theo từng request
+    member_count = models.PositiveIntegerField(default=0, editable=False)
+    living_count = models.PositiveIntegerField(default=0, editable=False)
+    dues_year = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    dues_paid = models.BigIntegerField(default=0, editable=False)
+    paid_member_count = models.PositiveIntegerField(default=0, editable=False)
+    refreshed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_root = instance.__dict__.get('root_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        loaded_root = getattr(self, '_loaded_root', None)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.root_id != loaded_root:
+                # Gốc cũ trở về chi của cha, gốc mới kéo theo toàn bộ con cháu dòng cha
+                assign_branches([member_id for member_id in (loaded_root, self.root_id) if member_id])
+                # Tính ngay rollup của chi này để response tạo/sửa chi có số liệu
+                for branch in refresh_rollups([self.id]):
+                    for field in ROLLUP_FIELDS:
+                        setattr(self, field, getattr(branch, field))
+        self._loaded_root = self.root_id
+
+    def __str__(self):
+        return self.name
+
+
 # @receiver(post_save, sender=FamilyTree)
 # def create_user_and_assign_role(sender, instance, created, **kwargs):
 #     if created:
@@ -104,3 +320,108 @@ def delete_user(sender, instance, **kwargs):
     if instance.user:
         instance.user.delete()
 
+
+@receiver(pre_delete, sender=FamilyTree)
+def collect_orphaned_children(sender, instance, **kwargs):
+    # Con của thành viên bị xóa sẽ mất mid/fid (SET_NULL), cần tính lại closure sau khi xóa
+    instance._orphaned_children = list(
+        FamilyTree.objects.filter(Q(mid=instance) | Q(fid=instance)).values_list('id', flat=True))
+    # Dòng pids bị xóa theo cascade, không phát m2m_changed
+    instance._former_spouses = list(instance.pids.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=FamilyTree)
+def rebuild_orphaned_lineage(sender, instance, **kwargs):
+    orphaned = getattr(instance, '_orphaned_children', None)
+    if orphaned:
+        rebuild_lineage(orphaned)
+        propagate_generations(orphaned)
+        members_changed.send(sender=FamilyTree, member_ids=orphaned)
+
+
+@receiver(m2m_changed, sender=FamilyTree.pids.through)
+def update_spouse_generations(sender, instance, action, pk_set, **kwargs):
+    # Dâu/rể lấy đời theo vợ/chồng nên cần tính lại khi pids thay đổi
+    if action == 'pre_clear':
+        instance._cleared_pids = set(instance.pids.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        affected = set(pk_set or getattr(instance, '_cleared_pids', ()))
+        affected.add(instance.pk)
+        propagate_generations(affected)
+        assign_branches(affected)
+        record_changes(affected, FamilyTreeChange.UPSERT)
+
+
+@receiver(post_save, sender=FamilyTree)
+@receiver(post_delete, sender=FamilyTree)
+@receiver(members_changed)
+@receiver(members_deleted)
+def reset_member_caches(sender, **kwargs):
+    # Xóa cache thống kê và chỉ mục tên sau khi commit để request khác không kịp lưu lại dữ liệu cũ
+    transaction.on_commit(invalidate_statistics)
+    transaction.on_commit(reset_ngram_index)
+
+
+@receiver(post_save, sender=FamilyTree)
+def record_member_saved(sender, instance, **kwargs):
+    record_changes([instance.id], FamilyTreeChange.UPSERT)
+
+
+@receiver(post_delete, sender=FamilyTree)
+def record_member_deleted(sender, instance, **kwargs):
+    record_changes([instance.id], FamilyTreeChange.DELETE)
+    record_changes(getattr(instance, '_former_spouses', ()), FamilyTreeChange.UPSERT)
+
+
+@receiver(members_changed)
+def record_members_changed(sender, member_ids=(), **kwargs):
+    record_changes(member_ids, FamilyTreeChange.UPSERT)
+
+
+@receiver(members_deleted)
+def record_members_deleted(sender, member_ids=(), **kwargs):
+    record_changes(member_ids, FamilyTreeChange.DELETE)
+
+
+@receiver(members_changed)
+def update_members_branches(sender, member_ids=(), **kwargs):
+    # Chi đổi do assign_branches đã được hẹn trong save_branches; thêm chi hiện tại của
+    # các thành viên vì số người/người còn sống có thể đổi mà chi không đổi
+    branches = assign_branches(member_ids)
+    schedule_rollups(branches.get(member_id) for member_id in member_ids)
+
+
+@receiver(post_save, sender=FamilyTree)
+@receiver(post_delete, sender=FamilyTree)
+def refresh_member_branch(sender, instance, **kwargs):
+    schedule_rollups([instance.branch_id])
+
+
+@receiver(members_deleted)
+def refresh_branches_after_delete(sender, branch_ids=(), **kwargs):
+    schedule_rollups(branch_ids)
+
+
+@receiver(post_delete, sender=Branch)
+def release_branch_members(sender, instance, **kwargs):
+    # Thành viên của chi đã bị gỡ chi (SET_NULL), gốc cũ và con cháu nhận lại chi của cha
+    assign_branches([instance.root_id])
+
+
+@receiver(pre_save, sender='financial_management.Income')
+def collect_income_branch(sender, instance, **kwargs):
+    instance._previous_member_id = sender.objects.filter(pk=instance.pk).values_list(
+        'member_id', flat=True).first() if instance.pk else None
+
+
+@receiver(post_save, sender='financial_management.Income')
+@receiver(post_delete, sender='financial_management.Income')
+def refresh_income_branch(sender, instance, **kwargs):
+    member_ids = {instance.member_id, getattr(instance, '_previous_member_id', None)} - {None}
+    if member_ids:
+        schedule_rollups(FamilyTree.objects.filter(id__in=member_ids).values_list('branch_id', flat=True))
+
+
+@receiver(incomes_created)
+def refresh_incomes_branches(sender, income_ids=(), **kwargs):
+    schedule_rollups(FamilyTree.objects.filter(income__id__in=income_ids).values_list('branch_id', flat=True))
@@ -0,0 +1,132 @@
+import unicodedata
+from collections import Counter
+from functools import reduce
+from operator import and_, or_
+
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from rest_framework.filters import SearchFilter
+
+# Ngưỡng giống pg_trgm.word_similarity_threshold mặc định
+WORD_SIMILARITY_THRESHOLD = 0.6
+MAX_FALLBACK_RESULTS = 500
+
+
+def normalize_name(value):
+    """'Nguyễn Văn Đức' -> 'nguyen van duc': bỏ dấu, đổi đ -> d, chữ thường."""
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFD', value.replace('đ', 'd').replace('Đ', 'D'))
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(value.lower().split())
+
+
+def trigrams(value):
+    # Cách tách giống pg_trgm: mỗi từ được đệm "  " ở đầu và " " ở cuối
+    grams = set()
+    for word in value.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NgramIndex:
+    """Chỉ mục trigram trong bộ nhớ, dùng khi database không phải Postgres."""
+
+    def __init__(self, rows):
+        self.names = {}
+        self.postings = {}
+        for member_id, name in rows:
+            self.names[member_id] = name
+            for gram in trigrams(name):
+                self.postings.setdefault(gram, []).append(member_id)
+
+    def search(self, term, limit=MAX_FALLBACK_RESULTS):
+        query_grams = trigrams(term)
+        if not query_grams:
+            return {}
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self.postings.get(gram, ()))
+
+        ranks = {}
+        for member_id, count in shared.items():
+            rank = count / len(query_grams)
+            if term in self.names[member_id]:
+                rank = 1.0
+            if rank >= WORD_SIMILARITY_THRESHOLD:
+                ranks[member_id] = rank
+        best = sorted(ranks.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return dict(best)
+
+
+_ngram_index = None
+
+
+def member_ngram_index():
+    global _ngram_index
+    if _ngram_index is None:
+        from .models import FamilyTree
+        _ngram_index = NgramIndex(FamilyTree.objects.values_list('id', 'name_normalized').iterator())
+    return _ngram_index
+
+
+def reset_ngram_index():
+    global _ngram_index
+    _ngram_index = None
+
+
+class NameSearchFilter(SearchFilter):
+    """
+    SearchFilter cho tên thành viên: so khớp không dấu trên cột name_normalized
+    và xếp hạng theo độ tương đồng trigram. Các trường tên khai báo trong
+    name_search_fields của view ('name', 'member__name', ...); search_fields còn
+    lại vẫn được tìm như SearchFilter thông thường.
+    """
+
+    def get_name_search_fields(self, view):
+        return getattr(view, 'name_search_fields', [])
+
+    def filter_queryset(self, request, queryset, view):
+        name_fields = self.get_name_search_fields(view)
+        term = normalize_name(' '.join(self.get_search_terms(request)))
+        if not name_fields or not term:
+            return super().filter_queryset(request, queryset, view)
+
+        other_fields = self.get_search_fields(view, request) or []
+        condition = Q()
+        other_lookups = [self.construct_search(str(field)) for field in other_fields]
+        if other_lookups:
+            condition = reduce(and_, (
+                reduce(or_, (Q(**{lookup: search_term}) for lookup in other_lookups))
+                for search_term in self.get_search_terms(request)))
+
+        prefixes = [field[:-len('name')] for field in name_fields]
+        if connection.vendor == 'postgresql':
+            queryset = self.filter_trigram(queryset, prefixes, term, condition)
+        else:
+            queryset = self.filter_ngram_index(queryset, prefixes, term, condition)
+
+        if other_fields and self.must_call_distinct(queryset, other_fields):
+            queryset = queryset.distinct()
+        return queryset
+
+    def filter_trigram(self, queryset, prefixes, term, condition):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        for prefix in prefixes:
+            field = f'{prefix}name_normalized'
+            condition |= Q(**{f'{field}__contains': term}) | Q(**{f'{field}__trigram_word_similar': term})
+        ranks = [TrigramWordSimilarity(term, f'{prefix}name_normalized') for prefix in prefixes]
+        rank = ranks[0] if len(ranks) == 1 else reduce(lambda a, b: a + b, ranks)
+        return queryset.filter(condition).annotate(search_rank=rank).order_by('-search_rank', '-pk')
+
+    def filter_ngram_index(self, queryset, prefixes, term, condition):
+        ranks = member_ngram_index().search(term)
+        whens = []
+        for prefix in prefixes:
+            field = f'{prefix}id' if prefix else 'id'
+            condition |= Q(**{f'{field}__in': list(ranks)})
+            whens.extend(When(**{field: member_id}, then=Value(rank)) for member_id, rank in ranks.items())
+        rank = Case(*whens, default=Value(0.0), output_field=FloatField())
+        return queryset.filter(condition).annotate(search_rank=rank).order_by('-search_rank', '-pk')
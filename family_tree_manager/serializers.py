@@ -1,5 +1,5 @@
-from rest_framework.serializers import ModelSerializer
-from .models import FamilyTree
+from rest_framework.serializers import ModelSerializer, IntegerField, BooleanField, CharField, DateField
+from .models import Branch, FamilyTree
 
 
 class FamilyTreeSerializer(ModelSerializer):
@@ -8,3 +8,30 @@ class FamilyTreeSerializer(ModelSerializer):
         # fields = ["id", "mid", "fid", "pids", "gender", "name", "img", "bdate", "ddate", "email",
         #           "phone", "address", "family_info", "generation", "is_admin"]
         fields = '__all__'
+
+
+class FamilyTreeLineageSerializer(FamilyTreeSerializer):
+    depth = IntegerField(read_only=True)
+
+
+class FamilyTreeNeighbourSerializer(FamilyTreeSerializer):
+    level = IntegerField(read_only=True)
+    has_more_parents = BooleanField(read_only=True)
+    has_more_children = BooleanField(read_only=True)
+
+
+class FamilyTreeAnniversarySerializer(ModelSerializer):
+    kind = CharField(read_only=True)
+    date = DateField(read_only=True)
+    years = IntegerField(read_only=True)
+
+    class Meta:
+        model = FamilyTree
+        fields = ['id', 'name', 'gender', 'img', 'generation', 'bdate', 'ddate', 'death_lunar_day',
+                  'death_lunar_month', 'kind', 'date', 'years']
+
+
+class BranchSerializer(ModelSerializer):
+    class Meta:
+        model = Branch
+        fields = '__all__'
@@ -0,0 +1,11 @@
+from django.dispatch import Signal
+
+# Gửi sau các thao tác ghi hàng loạt (bulk_create/bulk_update, import GEDCOM...)
+# vốn không phát post_save/post_delete cho từng thành viên. member_ids là id các
+# thành viên đã thay đổi.
+members_changed = Signal()
+
+# Gửi sau khi xóa hàng loạt (xóa cả nhánh) bằng câu lệnh DELETE trực tiếp, không
+# phát post_delete cho từng thành viên. member_ids là id các thành viên đã bị xóa,
+# branch_ids là các chi họ thuộc về trước khi xóa.
+members_deleted = Signal()
@@ -0,0 +1,117 @@
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+STATISTICS_CACHE_KEY = 'family_tree:statistics'
+STATISTICS_CACHE_TIMEOUT = getattr(settings, 'FAMILY_TREE_STATISTICS_CACHE_TIMEOUT', 60 * 60)
+# (nhãn, tuổi nhỏ nhất, tuổi lớn nhất) - chỉ tính cho người còn sống
+AGE_BUCKETS = (
+    ('0-17', 0, 17),
+    ('18-39', 18, 39),
+    ('40-59', 40, 59),
+    ('60-79', 60, 79),
+    ('80+', 80, None),
+)
+
+# Một lần quét bảng cho cả năm nhóm thống kê
+GROUPING_SETS_SQL = """
+    SELECT generation, education, gender, status, age_bucket,
+           GROUPING(generation), GROUPING(education), GROUPING(gender), GROUPING(status), GROUPING(age_bucket),
+           COUNT(*)
+    FROM (
+        SELECT generation, education, gender, status, CASE {age_cases} END AS age_bucket
+        FROM (
+            SELECT generation, education, gender,
+                   CASE WHEN ddate IS NULL THEN 'living' ELSE 'deceased' END AS status,
+                   CASE WHEN ddate IS NULL THEN DATE_PART('year', AGE(%s::date, bdate)) END AS age
+            FROM {table}
+        ) ages
+    ) members
+    GROUP BY GROUPING SETS ((generation), (education), (gender), (status), (age_bucket))
+"""
+
+
+def age_bucket(age):
+    if age is None or age < 0:
+        return None
+    for label, low, high in AGE_BUCKETS:
+        if age >= low and (high is None or age <= high):
+            return label
+    return None
+
+
+def age_on(bdate, today):
+    return today.year - bdate.year - ((today.month, today.day) < (bdate.month, bdate.day))
+
+
+def _grouping_sets_counts(today):
+    from .models import FamilyTree
+
+    age_cases = ' '.join(
+        f"WHEN age >= {low} AND age <= {high} THEN '{label}'" if high is not None
+        else f"WHEN age >= {low} THEN '{label}'"
+        for label, low, high in AGE_BUCKETS)
+    sql = GROUPING_SETS_SQL.format(table=connection.ops.quote_name(FamilyTree._meta.db_table), age_cases=age_cases)
+
+    counters = {name: Counter() for name in ('generation', 'education', 'gender', 'status', 'age_bucket')}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [today])
+        for *values, count in cursor.fetchall():
+            keys, grouped = values[:5], values[5:]
+            # GROUPING() = 0 đánh dấu cột đang được gom nhóm trong dòng này
+            for name, key, flag in zip(counters, keys, grouped):
+                if flag == 0:
+                    counters[name][key] += count
+    return counters
+
+
+def _single_scan_counts(today):
+    from .models import FamilyTree
+
+    counters = {name: Counter() for name in ('generation', 'education', 'gender', 'status', 'age_bucket')}
+    rows = FamilyTree.objects.values_list('generation', 'education', 'gender', 'bdate', 'ddate')
+    for generation, education, gender, bdate, ddate in rows.iterator(chunk_size=2000):
+        counters['generation'][generation] += 1
+        counters['education'][education] += 1
+        counters['gender'][gender] += 1
+        counters['status']['deceased' if ddate else 'living'] += 1
+        counters['age_bucket'][None if ddate else age_bucket(age_on(bdate, today))] += 1
+    return counters
+
+
+def compute_statistics(today=None):
+    today = today or datetime.date.today()
+    if connection.vendor == 'postgresql':
+        counters = _grouping_sets_counts(today)
+    else:
+        counters = _single_scan_counts(today)
+
+    ages = counters['age_bucket']
+    return {
+        'generations': [{'generation': generation, 'member_count': count}
+                        for generation, count in sorted(counters['generation'].items())],
+        'educations': [{'education': education, 'member_count': count}
+                       for education, count in counters['education'].items()],
+        'genders': [{'gender': gender, 'member_count': count} for gender, count in counters['gender'].items()],
+        'living': counters['status']['living'],
+        'deceased': counters['status']['deceased'],
+        'age_buckets': [{'age_bucket': label, 'member_count': ages[label]} for label, _, _ in AGE_BUCKETS],
+    }
+
+
+def get_statistics():
+    # Khóa theo ngày để nhóm tuổi tự cập nhật khi sang ngày mới
+    today = datetime.date.today()
+    key = f'{STATISTICS_CACHE_KEY}:{today.isoformat()}'
+    data = cache.get(key)
+    if data is None:
+        data = compute_statistics(today)
+        cache.set(key, data, STATISTICS_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate_statistics():
+    cache.delete(f'{STATISTICS_CACHE_KEY}:{datetime.date.today().isoformat()}')
@@ -0,0 +1,118 @@
+from django.contrib.auth.models import User
+from django.db import connection, models, transaction
+from django.db.models import ProtectedError, Q, RestrictedError
+
+from .generations import propagate_generations
+from .lineage import BATCH_SIZE
+from .models import FamilyTree, FamilyTreeClosure
+from .signals import members_changed, members_deleted
+
+
+def subtree_ids(member):
+    return list(FamilyTreeClosure.objects.filter(ancestor=member).values_list('descendant_id', flat=True))
+
+
+def on_delete_value(relation):
+    """Giá trị mới của khóa ngoại cho SET_NULL, SET_DEFAULT và SET(...)."""
+    if relation.on_delete is models.SET_NULL:
+        return None
+    if relation.on_delete is models.SET_DEFAULT:
+        return relation.field.get_default()
+    _, args, _ = relation.on_delete.deconstruct()
+    return args[0]() if callable(args[0]) else args[0]
+
+
+def clear_references(member_ids):
+    """
+    Xử lý các bảng trỏ tới FamilyTree theo on_delete của từng quan hệ bằng một câu
+    lệnh cho mỗi bảng, thay vì để Collector nạp và phát signal cho từng dòng.
+    PROTECT/RESTRICT được kiểm tra trước khi sửa bất kỳ dòng nào.
+    """
+    references = []
+    for relation in FamilyTree._meta.related_objects:
+        if relation.many_to_many:
+            continue
+        queryset = relation.related_model._base_manager.filter(**{f'{relation.field.name}__in': member_ids})
+        if relation.related_model is FamilyTree:
+            queryset = queryset.exclude(id__in=member_ids)
+        if relation.on_delete in (models.PROTECT, models.RESTRICT):
+            blocking = list(queryset[:10])
+            if blocking:
+                error = ProtectedError if relation.on_delete is models.PROTECT else RestrictedError
+                raise error(f'Không thể xóa nhánh vì còn {relation.related_model._meta.verbose_name} '
+                            f'tham chiếu tới thành viên trong nhánh.', set(blocking))
+        elif relation.on_delete is not models.DO_NOTHING:
+            references.append((relation, queryset))
+
+    through = FamilyTree.pids.through
+    through.objects.filter(models.Q(from_familytree_id__in=member_ids) |
+                           models.Q(to_familytree_id__in=member_ids)).delete()
+    for relation in FamilyTree._meta.related_objects:
+        # Bảng trung gian tự tạo của quan hệ many-to-many khác (vd. người tham dự sự kiện)
+        if relation.many_to_many and relation.related_model is not FamilyTree and relation.through._meta.auto_created:
+            field = next(f for f in relation.through._meta.fields
+                         if f.is_relation and f.related_model is FamilyTree)
+            relation.through.objects.filter(**{f'{field.name}__in': member_ids}).delete()
+
+    for relation, queryset in references:
+        if relation.on_delete is models.CASCADE:
+            queryset.delete()
+        else:
+            queryset.update(**{relation.field.name: on_delete_value(relation)})
+
+
+def delete_rows(member_ids):
+    """
+    DELETE trực tiếp các dòng thành viên sau khi clear_references đã xử lý mọi
+    tham chiếu. Receiver post_delete theo từng dòng (xóa User, nhật ký, cache,
+    chi, tin realtime) được thay bằng xử lý theo tập trong delete_subtree và
+    signal members_deleted.
+    """
+    table = connection.ops.quote_name(FamilyTree._meta.db_table)
+    column = connection.ops.quote_name(FamilyTree._meta.pk.column)
+    deleted = 0
+    with connection.cursor() as cursor:
+        for index in range(0, len(member_ids), BATCH_SIZE):
+            batch = member_ids[index:index + BATCH_SIZE]
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({", ".join(["%s"] * len(batch))})', batch)
+            deleted += cursor.rowcount
+    return deleted
+
+
+def delete_subtree(member):
+    """
+    Xóa thành viên cùng toàn bộ con cháu và tài khoản User đi kèm trong một
+    transaction, với số câu lệnh không phụ thuộc kích thước nhánh.
+    """
+    with transaction.atomic():
+        member_ids = subtree_ids(member) or [member.id]
+        owners = list(FamilyTree.objects.filter(id__in=member_ids).filter(
+            Q(user__isnull=False) | Q(branch__isnull=False)).values_list('user_id', 'branch_id'))
+        user_ids = [user_id for user_id, _ in owners if user_id]
+        branch_ids = {branch_id for _, branch_id in owners if branch_id}
+        # Vợ/chồng ngoài nhánh (dâu/rể) có thể phải tính lại đời
+        outside_spouses = set(FamilyTree.pids.through.objects.filter(
+            from_familytree_id__in=member_ids).exclude(to_familytree_id__in=member_ids).values_list(
+            'to_familytree_id', flat=True))
+
+        clear_references(member_ids)
+        deleted = delete_rows(member_ids)
+        users_deleted = User.objects.filter(id__in=user_ids).delete()[1].get(User._meta.label, 0) if user_ids else 0
+
+        members_deleted.send(sender=FamilyTree, member_ids=member_ids, branch_ids=branch_ids)
+        if outside_spouses:
+            propagate_generations(outside_spouses)
+            members_changed.send(sender=FamilyTree, member_ids=sorted(outside_spouses))
+
+    return {'members_deleted': deleted, 'users_deleted': users_deleted}
+
+
+def move_subtree(member, mid=None, fid=None):
+    """
+    Gắn nhánh vào cha mẹ mới (None = tách thành nhánh riêng). Bảng closure và
+    đời của cả nhánh được cập nhật trong FamilyTree.save bằng thao tác hàng loạt.
+    """
+    member.mid = mid
+    member.fid = fid
+    member.save()
+    return member
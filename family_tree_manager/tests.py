@@ -1,3 +1,425 @@
-from django.test import TestCase
+import base64
+import datetime
+import importlib
+import io
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from financial_management.models import Income
+from live_updates.broker import InProcessBroker, PostgresBroker
+from image_upload.models import Image
+from PIL import Image as PILImage
+
+from .anniversaries import DEATH_ANNIVERSARY, find_anniversaries
+from .changes import changes_since, compact_changes, latest_cursor
+from .gedcom import GedcomImporter
+from .lineage import descendants_of
+from .generations import compute_generations
+from .models import Branch, FamilyTree, FamilyTreeChange, FamilyTreeClosure
+from .statistics import get_statistics
+from .subtree import delete_subtree
+
+
+def make_member(name, **kwargs):
+    return FamilyTree.objects.create(name=name, gender=kwargs.pop('gender', 'male'),
+                                     bdate=kwargs.pop('bdate', datetime.date(1950, 1, 1)), **kwargs)
+
+
+class ComputeGenerationsTests(SimpleTestCase):
+    def test_married_root_couple(self):
+        # Hai vợ chồng đều không có cha mẹ không được phụ thuộc lẫn nhau
+        nodes = {1: (None, None), 2: (None, None), 3: (2, 1), 4: (None, 3)}
+        spouses = {1: [2], 2: [1]}
+        stored = {1: 1, 2: 1, 3: 1, 4: 1}
+
+        self.assertEqual(compute_generations(nodes, spouses, stored, {}), {1: 1, 2: 1, 3: 2, 4: 3})
+
+    def test_in_law_follows_spouse(self):
+        nodes = {1: (None, None), 2: (None, 1), 3: (None, None)}
+        spouses = {3: [2]}
+        stored = {1: 1, 2: 1, 3: 1}
+
+        self.assertEqual(compute_generations(nodes, spouses, stored, {}), {1: 1, 2: 2, 3: 2})
+
+
+class GenerationPropagationTests(TestCase):
+    def test_children_of_married_root_couple(self):
+        father = make_member('Nguyễn Văn A')
+        mother = make_member('Trần Thị B', gender='female')
+        father.pids.add(mother)
+        child = make_member('Nguyễn Văn C', fid=father, mid=mother, bdate=datetime.date(1975, 1, 1))
+        grandchild = make_member('Nguyễn Văn D', fid=child, bdate=datetime.date(2000, 1, 1))
+
+        generations = dict(FamilyTree.objects.values_list('id', 'generation'))
+        self.assertEqual(generations[father.id], 1)
+        self.assertEqual(generations[mother.id], 1)
+        self.assertEqual(generations[child.id], 2)
+        self.assertEqual(generations[grandchild.id], 3)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('root', 'root@example.com', 'root'))
+        make_member('Nguyễn Văn A')
+
+    def test_export_urls_without_trailing_slash(self):
+        for export_format, content_type in (('ged', 'text/x-gedcom'), ('ndjson', 'application/x-ndjson')):
+            response = self.client.get(f'/api/family-trees/export.{export_format}')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith(content_type))
+            self.assertIn('Văn A', b''.join(response.streaming_content).decode('utf-8'))
+
+
+class GedcomImportTests(TestCase):
+    GEDCOM = '\n'.join([
+        '0 HEAD',
+        '1 CHAR UTF-8',
+        '0 @I1@ INDI',
+        '1 NAME Nguyễn Văn /An/',
+        '1 SEX M',
+        '1 BIRT',
+        '2 DATE 12 MAR 1930',
+        '1 DEAT',
+        '2 DATE 10 FEB 2024',
+        '0 @I2@ INDI',
+        '1 NAME Nguyễn Văn /Bình/',
+        '1 SEX M',
+        '1 BIRT',
+        '2 DATE 5 JUN 1960',
+        '0 @I3@ INDI',
+        '1 NAME Trần Thị /Cúc/',
+        '1 SEX F',
+        '1 BIRT',
+        '2 DATE 1 JAN 1962',
+        '0 @I4@ INDI',
+        '1 NAME Nguyễn Văn /Dũng/',
+        '1 SEX M',
+        '1 BIRT',
+        '2 DATE 2 FEB 1990',
+        '0 @F1@ FAM',
+        '1 HUSB @I1@',
+        '1 CHIL @I2@',
+        '0 @F2@ FAM',
+        '1 HUSB @I2@',
+        '1 WIFE @I3@',
+        '1 CHIL @I4@',
+        '0 TRLR',
+    ]).encode('utf-8')
+
+    def import_sample(self):
+        return GedcomImporter().run(io.BytesIO(self.GEDCOM))
+
+    def test_imported_members_get_derived_fields(self):
+        self.assertEqual(self.import_sample()['individuals'], 4)
+
+        father = FamilyTree.objects.get(name='Nguyễn Văn An')
+        child = FamilyTree.objects.get(name='Nguyễn Văn Bình')
+        self.assertEqual(father.name_normalized, 'nguyen van an')
+        self.assertEqual((child.fid_id, child.generation), (father.id, 2))
+        self.assertEqual((father.birth_month, father.birth_day), (3, 12))
+        # 10/02/2024 dương lịch là mùng 1 tháng Giêng năm Giáp Thìn
+        self.assertEqual((father.death_lunar_month, father.death_lunar_day), (1, 1))
+
+        # Tết Ất Tỵ (29/01/2025) là ngày giỗ
+        members = find_anniversaries(FamilyTree.objects.all(), datetime.date(2025, 1, 29), datetime.date(2025, 1, 29),
+                                     (DEATH_ANNIVERSARY,))
+        self.assertEqual([member.id for member in members], [father.id])
+
+    def test_imported_members_get_closure_rows(self):
+        self.import_sample()
+        ids = {name: member_id for member_id, name in FamilyTree.objects.values_list('id', 'name')}
+        an, binh, cuc, dung = (ids[name] for name in (
+            'Nguyễn Văn An', 'Nguyễn Văn Bình', 'Trần Thị Cúc', 'Nguyễn Văn Dũng'))
+
+        self.assertEqual(set(FamilyTreeClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')), {
+            (an, an, 0), (binh, binh, 0), (cuc, cuc, 0), (dung, dung, 0),
+            (an, binh, 1), (binh, dung, 1), (cuc, dung, 1), (an, dung, 2),
+        })
+        self.assertEqual([(member.id, member.depth) for member in descendants_of(FamilyTree.objects.get(id=an))],
+                         [(binh, 1), (dung, 2)])
+
+
+class ChangeLogTests(TestCase):
+    def test_changes_are_written_in_the_same_transaction(self):
+        member = make_member('Nguyễn Văn A')
+        # TestCase không chạy on_commit: dòng nhật ký phải có ngay trong transaction
+        self.assertTrue(FamilyTreeChange.objects.filter(member_id=member.id, action=FamilyTreeChange.UPSERT).exists())
+
+    def test_changes_follow_transaction_order(self):
+        since = latest_cursor()
+        first = make_member('Nguyễn Văn A')
+        second = make_member('Nguyễn Văn B')
+        # Dòng của first có id nhỏ hơn nhưng thuộc transaction commit sau second
+        FamilyTreeChange.objects.filter(member_id=first.id).update(txid=20)
+        FamilyTreeChange.objects.filter(member_id=second.id).update(txid=10)
+        second_change = FamilyTreeChange.objects.get(member_id=second.id).id
+
+        self.assertEqual(changes_since(since, limit=1), (second_change, {second.id: FamilyTreeChange.UPSERT}, True))
+        cursor, latest, has_more = changes_since(second_change)
+        self.assertEqual((latest, has_more), ({first.id: FamilyTreeChange.UPSERT}, False))
+        self.assertEqual(cursor, latest_cursor())
+
+    def test_unknown_cursor_needs_full_resync(self):
+        self.assertIsNone(changes_since(0))
+
+    def test_compaction_keeps_a_baseline_in_transaction_order(self):
+        since = latest_cursor()
+        first = make_member('Nguyễn Văn A')
+        second = make_member('Nguyễn Văn B')
+        FamilyTreeChange.objects.filter(member_id=first.id).update(txid=20)
+        FamilyTreeChange.objects.filter(member_id=second.id).update(txid=10)
+
+        compact_changes(datetime.datetime.max.replace(tzinfo=datetime.timezone.utc))
+
+        baseline = FamilyTreeChange.objects.get()
+        self.assertEqual((baseline.member_id, baseline.action), (first.id, FamilyTreeChange.BASELINE))
+        self.assertIsNone(changes_since(since))
+        self.assertEqual(changes_since(baseline.id), (baseline.id, {}, False))
+
+
+class SaveQueryCountTests(TestCase):
+    def test_new_root_member(self):
+        # SAVEPOINT, INSERT thành viên, INSERT closure, INSERT nhật ký, RELEASE
+        with self.assertNumQueries(5):
+            member = make_member('Nguyễn Văn A')
+        self.assertEqual(list(FamilyTreeClosure.objects.filter(descendant=member).values_list(
+            'ancestor_id', 'depth')), [(member.id, 0)])
+        self.assertEqual((member.generation, member.branch_id), (1, None))
+
+    def test_update_without_parent_change(self):
+        member = make_member('Nguyễn Văn A')
+        member.phone = '0900000000'
+        # SAVEPOINT, UPDATE, INSERT nhật ký, RELEASE
+        with self.assertNumQueries(4):
+            member.save()
+
+
+class SubtreeDeleteTests(TestCase):
+    def test_delete_subtree_applies_on_delete_of_each_relation(self):
+        root = make_member('Nguyễn Văn A')
+        wife = make_member('Trần Thị B', gender='female')
+        root.pids.add(wife)
+        user = User.objects.create_user('member-c')
+        child = make_member('Nguyễn Văn C', fid=root, mid=wife, user=user)
+        grandchild = make_member('Nguyễn Văn D', fid=child)
+        branch = Branch.objects.create(name='Chi C', root=child)
+        income = Income.objects.create(date=datetime.date(2024, 1, 1), member=grandchild)
+
+        result = delete_subtree(child)
+
+        self.assertEqual(result, {'members_deleted': 2, 'users_deleted': 1})
+        self.assertFalse(FamilyTree.objects.filter(id__in=[child.id, grandchild.id]).exists())
+        self.assertFalse(FamilyTreeClosure.objects.filter(descendant_id__in=[child.id, grandchild.id]).exists())
+        self.assertFalse(Branch.objects.filter(id=branch.id).exists())
+        self.assertFalse(User.objects.filter(id=user.id).exists())
+        income.refresh_from_db()
+        self.assertIsNone(income.member_id)
+        self.assertEqual(set(FamilyTree.objects.values_list('id', flat=True)), {root.id, wife.id})
+        self.assertEqual(list(root.pids.values_list('id', flat=True)), [wife.id])
+
+
+class BranchApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('root', 'root@example.com', 'root'))
+
+    def test_create_returns_rollups(self):
+        root = make_member('Nguyễn Văn A')
+        make_member('Nguyễn Văn B', fid=root)
+
+        response = self.client.post('/api/branches/', {'name': 'Chi A', 'root': root.id}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['member_count'], response.data['living_count']), (2, 2))
+        self.assertIsNotNone(response.data['refreshed_at'])
+
+    def test_list_does_not_write(self):
+        branch = Branch.objects.create(name='Chi A', root=make_member('Nguyễn Văn A'))
+        Branch.objects.filter(id=branch.id).update(dues_year=2000)
+
+        self.assertEqual(self.client.get('/api/branches/').status_code, 200)
+        self.assertEqual(Branch.objects.get(id=branch.id).dues_year, 2000)
+
+
+class BranchRollupScheduleTests(TransactionTestCase):
+    def test_rollups_run_once_per_transaction_for_affected_branches(self):
+        branch_a = Branch.objects.create(name='Chi A', root=make_member('Nguyễn Văn A'))
+        Branch.objects.create(name='Chi B', root=make_member('Nguyễn Văn B'))
+
+        with mock.patch('family_tree_manager.branches.refresh_rollups') as refresh:
+            with transaction.atomic():
+                child = make_member('Nguyễn Văn C', fid=branch_a.root)
+                FamilyTree.objects.bulk_create_members([FamilyTree(
+                    name='Nguyễn Văn D', gender='male', bdate=datetime.date(2000, 1, 1), fid=child)])
+        refresh.assert_called_once_with({branch_a.id})
+
+
+class GraphVersionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('root', 'root@example.com', 'root'))
+        make_member('Nguyễn Văn A')
+
+    def test_not_modified_without_building_the_graph(self):
+        etag = self.client.get('/api/family-trees/graph/')['ETag']
+
+        with mock.patch('family_tree_manager.views.build_tree_graph') as build:
+            response = self.client.get('/api/family-trees/graph/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        build.assert_not_called()
+
+        make_member('Nguyễn Văn B')
+        self.assertNotEqual(self.client.get('/api/family-trees/graph/')['ETag'], etag)
+
+
+def png_data_url(color):
+    output = io.BytesIO()
+    PILImage.new('RGB', (200, 200), color).save(output, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(output.getvalue()).decode('ascii')
+
+
+class MemberImageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.media_root = media_root.name
+
+    def stored_files(self):
+        return sorted(name for _, _, names in os.walk(self.media_root) for name in names)
+
+    def test_failed_save_removes_written_files(self):
+        member = FamilyTree(name='Nguyễn Văn A', gender='male', bdate=datetime.date(1950, 1, 1), img=png_data_url('red'))
+
+        with mock.patch.object(FamilyTreeClosure.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                member.save()
+
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(Image.objects.exists())
+        self.assertTrue(member.img.startswith('data:'))
+
+    def test_replaced_image_is_deleted_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            member = make_member('Nguyễn Văn A', img=png_data_url('red'))
+        old_image = member.image
+        old_files = self.stored_files()
+
+        member = FamilyTree.objects.get(id=member.id)
+        member.img = png_data_url('blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            member.save()
+
+        self.assertEqual(list(Image.objects.values_list('id', flat=True)), [member.image_id])
+        self.assertNotEqual(member.image_id, old_image.id)
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertFalse(set(old_files) & set(self.stored_files()))
+
+
+class StatisticsCacheTests(TestCase):
+    def test_cache_is_shared_and_invalidated_on_commit(self):
+        make_member('Nguyễn Văn A')
+        self.assertEqual(get_statistics()['living'], 1)
+        # Cache nằm trong database nên mọi tiến trình đọc/xóa cùng một bản
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM family_tree_cache')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_member('Nguyễn Văn B')
+        self.assertEqual(get_statistics()['living'], 2)
+
+
+class AsgiRoutingTests(SimpleTestCase):
+    def request(self, path):
+        from src.asgi import application
+
+        async def run():
+            communicator = ApplicationCommunicator(application, {
+                'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': path,
+                'raw_path': path.encode(), 'root_path': '', 'query_string': b'', 'headers': [],
+                'server': ('testserver', 80), 'client': ('127.0.0.1', 1234),
+            })
+            await communicator.send_input({'type': 'http.request', 'body': b''})
+            return await communicator.receive_output(timeout=5)
+
+        return async_to_sync(run)()
+
+    def test_api_outside_live_updates_goes_through_wsgi(self):
+        from django.core.handlers.wsgi import WSGIHandler
+
+        with mock.patch.object(WSGIHandler, '__call__', autospec=True, side_effect=WSGIHandler.__call__) as handler:
+            self.assertEqual(self.request('/api/family-trees/export.ged')['status'], 401)
+        handler.assert_called_once()
+
+    def test_live_updates_require_token(self):
+        self.assertEqual(self.request('/api/live/')['status'], 401)
+
+
+class PostgresBrokerTests(SimpleTestCase):
+    def test_bad_payload_does_not_stop_the_listener(self):
+        broker = PostgresBroker()
+        with mock.patch.object(InProcessBroker, 'publish') as publish, self.assertLogs('live_updates.broker', 'ERROR'):
+            broker.dispatch('{không phải json')
+            broker.dispatch('{"topic": "family_tree", "action": "upsert", "ids": [1], "user_ids": null}')
+        publish.assert_called_once_with({'topic': 'family_tree', 'action': 'upsert', 'ids': [1], 'user_ids': None})
+
+    def test_dead_listener_is_restarted(self):
+        broker = PostgresBroker()
+        broker._listener = mock.Mock(is_alive=mock.Mock(return_value=False))
+
+        with mock.patch('live_updates.broker.connection', vendor='postgresql'), \
+                mock.patch.object(InProcessBroker, 'subscribe'), \
+                mock.patch('live_updates.broker.threading.Thread') as thread:
+            broker.subscribe()
+        thread.return_value.start.assert_called_once()
+        self.assertIs(broker._listener, thread.return_value)
+
+
+class DataMigrationTests(TestCase):
+    def migration(self, name):
+        return importlib.import_module(f'family_tree_manager.migrations.{name}')
+
+    def test_closure_migration_matches_rebuild(self):
+        root = make_member('Nguyễn Văn A')
+        wife = make_member('Trần Thị B', gender='female')
+        child = make_member('Nguyễn Văn C', fid=root, mid=wife)
+        make_member('Nguyễn Văn D', fid=child)
+        expected = set(FamilyTreeClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+        FamilyTreeClosure.objects.all().delete()
+        self.migration('0012_familytreeclosure').populate_closure(apps, None)
+
+        self.assertEqual(set(FamilyTreeClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth')), expected)
+
+    def test_name_migration_normalizes_like_search(self):
+        member = make_member('Đặng  Thị Ánh')
+        FamilyTree.objects.update(name_normalized='')
+
+        self.migration('0015_familytree_name_normalized').populate_name_normalized(apps, None)
+
+        member.refresh_from_db()
+        self.assertEqual(member.name_normalized, 'dang thi anh')
+
+    def test_calendar_migration_matches_save(self):
+        make_member('Nguyễn Văn An', bdate=datetime.date(1930, 3, 12), ddate=datetime.date(2024, 2, 10))
+        fields = ('birth_month', 'birth_day', 'death_lunar_month', 'death_lunar_day')
+        expected = list(FamilyTree.objects.values_list(*fields))
+        FamilyTree.objects.update(**dict.fromkeys(fields))
+
+        self.migration('0017_familytree_calendar_fields').populate_calendar_fields(apps, None)
+
+        self.assertEqual(list(FamilyTree.objects.values_list(*fields)), expected)
+        self.assertEqual(expected, [(3, 12, 1, 1)])
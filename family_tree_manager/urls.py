@@ -1,12 +1,17 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from . import views
 from rest_framework.routers import DefaultRouter
 
 
 router = DefaultRouter()
 router.register('family-trees', views.FamilyTreeViewSet, basename='family_tree')
+router.register('branches', views.BranchViewSet, basename='branch')
 
 urlpatterns = [
+    # Đường dẫn file export không có dấu / ở cuối như trong tài liệu (router chỉ nhận dạng có /)
+    re_path(r'^api/family-trees/export\.(?P<export_format>ged|ndjson)$',
+            views.FamilyTreeViewSet.as_view({'get': 'export'}), name='family_tree-export-file'),
     path('api/', include(router.urls)),
     path('api/family-tree-statistics/', views.FamilyTreeStatisticsAPIView.as_view(), name='family_tree_statistics'),
+    path('api/family-tree-integrity/', views.FamilyTreeIntegrityAPIView.as_view(), name='family_tree_integrity'),
 ]
\ No newline at end of file
@@ -1,11 +1,29 @@
+import datetime
+
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.views import APIView
-from django.db.models import Count
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import ProtectedError, RestrictedError
+from django.http import StreamingHttpResponse
 
-from .models import FamilyTree
-from .serializers import FamilyTreeSerializer
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.filters import SearchFilter, OrderingFilter
+from .anniversaries import BIRTHDAY, DEATH_ANNIVERSARY, MAX_WINDOW_DAYS, find_anniversaries
+from .duplicates import DUPLICATE_THRESHOLD, find_duplicates, merge_members
+from .exports import iter_gedcom, iter_ndjson
+from .gedcom import GedcomImporter
+from .graph import build_tree_graph, graph_version
+from .integrity import repair_tree, scan_tree
+from .kinship import find_relationship
+from .lineage import ancestors_of, descendants_of, neighbourhood
+from .changes import changes_since, latest_cursor
+from .models import Branch, FamilyTree, FamilyTreeChange
+from .search import NameSearchFilter
+from .statistics import get_statistics
+from .subtree import delete_subtree, move_subtree
+from .serializers import (FamilyTreeSerializer, FamilyTreeLineageSerializer, FamilyTreeNeighbourSerializer,
+                          FamilyTreeAnniversarySerializer, BranchSerializer)
+from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, BasePermission, SAFE_METHODS
 from django.contrib.auth.models import User
@@ -14,6 +32,12 @@ from rest_framework.exceptions import ValidationError
 
 from django_filters import rest_framework as filters
 
+from src.pagination import CursorOptInPagination
+from src.streaming import StreamingListMixin
+
+
+MAX_NEIGHBOURHOOD_DEPTH = 10
+
 
 class FamilyTreeFilter(filters.FilterSet):
     gender = filters.CharFilter(lookup_expr='exact')
@@ -21,10 +45,11 @@ class FamilyTreeFilter(filters.FilterSet):
     pids = filters.ModelMultipleChoiceFilter(queryset=FamilyTree.objects.all())
     mid = filters.ModelChoiceFilter(queryset=FamilyTree.objects.all())
     fid = filters.ModelChoiceFilter(queryset=FamilyTree.objects.all())
+    branch = filters.ModelChoiceFilter(queryset=Branch.objects.all())
 
     class Meta:
         model = FamilyTree
-        fields = ['gender', 'generation', 'pids', 'mid', 'fid']
+        fields = ['gender', 'generation', 'pids', 'mid', 'fid', 'branch']
 
 
 class IsSuperUserOrReadOnly(BasePermission):
@@ -41,20 +66,25 @@ class IsSuperUserOrReadOnly(BasePermission):
         return False
 
 
-class FamilyTreePagination(PageNumberPagination):
+class IsSuperUser(BasePermission):
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_superuser)
+
+
+class FamilyTreePagination(CursorOptInPagination):
     page_size = 10
     page_size_query_param = 'pageSize'
 
 
-class FamilyTreeViewSet(viewsets.ModelViewSet):
+class FamilyTreeViewSet(StreamingListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsSuperUserOrReadOnly]
     queryset = FamilyTree.objects.all().order_by('-id')
     serializer_class = FamilyTreeSerializer
     pagination_class = FamilyTreePagination
-    filter_backends = [SearchFilter, OrderingFilter, filters.DjangoFilterBackend]
+    filter_backends = [NameSearchFilter, OrderingFilter, filters.DjangoFilterBackend]
     filterset_class = FamilyTreeFilter
     # filterset_fields = ['id', 'gender', 'generation']
-    search_fields = ['name']
+    name_search_fields = ['name']
     ordering_fields = '__all__'
 
     def list(self, request, *args, **kwargs):
@@ -63,8 +93,7 @@ class FamilyTreeViewSet(viewsets.ModelViewSet):
 
             queryset = self.filter_queryset(queryset)
 
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+            return self.stream_list(queryset.prefetch_related('pids'))
         else:
             return super().list(request, *args, **kwargs)
 
@@ -107,25 +136,234 @@ class FamilyTreeViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    @action(detail=True)
+    def ancestors(self, request, *args, **kwargs):
+        member = self.get_object()
+        return self.lineage_response(ancestors_of(member, self.get_max_depth()))
 
-class FamilyTreeStatisticsAPIView(APIView):
-    def get(self, request, format=None):
-        statistics_generations = FamilyTree.objects.values('generation').annotate(member_count=Count('id')).order_by(
-            'generation')
-        generations = [{'generation': stat['generation'], 'member_count': stat['member_count']} for stat in
-                       statistics_generations]
+    @action(detail=True)
+    def descendants(self, request, *args, **kwargs):
+        member = self.get_object()
+        return self.lineage_response(descendants_of(member, self.get_max_depth()))
+
+    @action(detail=True)
+    def neighbourhood(self, request, *args, **kwargs):
+        member = self.get_object()
+        up = self.get_depth_param('up', 2)
+        down = self.get_depth_param('down', 2)
+        spouses = request.query_params.get('spouses', '1') not in ('0', 'false')
+
+        nodes = neighbourhood(member, up, down, spouses)
+        return Response({'root': member.id, 'nodes': FamilyTreeNeighbourSerializer(nodes, many=True).data})
+
+    @action(detail=False, permission_classes=[IsAuthenticated, IsSuperUser])
+    def duplicates(self, request, *args, **kwargs):
+        try:
+            threshold = float(request.query_params.get('threshold', DUPLICATE_THRESHOLD))
+            limit = int(request.query_params.get('limit', 100))
+        except ValueError:
+            raise ValidationError('threshold/limit không hợp lệ.')
+
+        candidates = find_duplicates(threshold, limit)
+        ids = {member_id for candidate in candidates for member_id in candidate['ids']}
+        members = {member['id']: member for member in self.get_serializer(
+            FamilyTree.objects.filter(id__in=ids).prefetch_related('pids'), many=True).data}
+        for candidate in candidates:
+            candidate['members'] = [members[member_id] for member_id in candidate.pop('ids')]
+        return Response(candidates)
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsSuperUser])
+    def merge(self, request, *args, **kwargs):
+        keep = self.get_object()
+        duplicate = get_object_or_404(FamilyTree, pk=request.data.get('duplicate'))
+        try:
+            keep = merge_members(keep, duplicate)
+        except DjangoValidationError as e:
+            raise ValidationError(e.messages)
+        return Response(self.get_serializer(keep).data)
+
+    @action(detail=True, methods=['delete'], permission_classes=[IsAuthenticated, IsSuperUser])
+    def subtree(self, request, *args, **kwargs):
+        member = self.get_object()
+        try:
+            return Response(delete_subtree(member))
+        except (ProtectedError, RestrictedError) as e:
+            raise ValidationError(e.args[0])
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsSuperUser])
+    def detach(self, request, *args, **kwargs):
+        member = self.get_object()
+        return Response(self.get_serializer(move_subtree(member)).data)
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated, IsSuperUser])
+    def move(self, request, *args, **kwargs):
+        member = self.get_object()
+        mid_id, fid_id = request.data.get('mid'), request.data.get('fid')
+        if not mid_id and not fid_id:
+            raise ValidationError('Cần chọn cha hoặc mẹ mới.')
+        mid = get_object_or_404(FamilyTree, pk=mid_id) if mid_id else None
+        fid = get_object_or_404(FamilyTree, pk=fid_id) if fid_id else None
+        try:
+            member = move_subtree(member, mid, fid)
+        except DjangoValidationError as e:
+            raise ValidationError(e.messages)
+        return Response(self.get_serializer(member).data)
+
+    @action(detail=True, url_path=r'relationship/(?P<other_id>[^/.]+)')
+    def relationship(self, request, other_id=None, *args, **kwargs):
+        member = self.get_object()
+        other = get_object_or_404(FamilyTree, pk=other_id)
+        return Response(find_relationship(member, other))
+
+    @action(detail=False)
+    def changes(self, request, *args, **kwargs):
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                raise ValidationError('since phải là số nguyên.')
+
+        result = changes_since(since)
+        if result is None:
+            return Response({'cursor': latest_cursor(), 'full_resync': True, 'has_more': False,
+                             'upserts': [], 'deletes': []})
+
+        cursor, latest, has_more = result
+        upsert_ids = [member_id for member_id, change in latest.items() if change == FamilyTreeChange.UPSERT]
+        upserts = self.get_serializer(
+            FamilyTree.objects.filter(id__in=upsert_ids).order_by('id').prefetch_related('pids'), many=True).data
+        # Thành viên đã bị xóa sau lần sửa cuối cũng được trả về như dòng xóa
+        found = {member['id'] for member in upserts}
+        deletes = sorted(member_id for member_id, change in latest.items()
+                         if change == FamilyTreeChange.DELETE or member_id not in found)
+
+        return Response({'cursor': cursor, 'full_resync': False, 'has_more': has_more,
+                         'upserts': upserts, 'deletes': deletes})
+
+    @action(detail=False)
+    def anniversaries(self, request, *args, **kwargs):
+        try:
+            start = datetime.date.fromisoformat(request.query_params.get('from', datetime.date.today().isoformat()))
+            end = request.query_params.get('to')
+            end = datetime.date.fromisoformat(end) if end else start + datetime.timedelta(days=30)
+        except ValueError:
+            raise ValidationError('from/to phải có dạng YYYY-MM-DD.')
+        if not 0 <= (end - start).days < MAX_WINDOW_DAYS:
+            raise ValidationError(f'Khoảng ngày phải từ 1 đến {MAX_WINDOW_DAYS} ngày.')
+
+        kinds = (BIRTHDAY, DEATH_ANNIVERSARY)
+        kind = request.query_params.get('kind')
+        if kind:
+            if kind not in kinds:
+                raise ValidationError(f'kind phải là một trong: {", ".join(kinds)}.')
+            kinds = (kind,)
+
+        members = find_anniversaries(self.filter_queryset(self.get_queryset()), start, end, kinds)
+        return Response(FamilyTreeAnniversarySerializer(members, many=True).data)
 
-        statistics_educations = FamilyTree.objects.values('education').annotate(member_count=Count('id'))
-        educations = [{'education': stat['education'], 'member_count': stat['member_count']} for stat in
-                      statistics_educations]
+    @action(detail=False)
+    def graph(self, request, *args, **kwargs):
+        version = graph_version()
+        etag = f'"{version}"'
 
-        statistics_genders = FamilyTree.objects.values('gender').annotate(member_count=Count('id'))
-        genders = [{'gender': stat['gender'], 'member_count': stat['member_count']} for stat in statistics_genders]
+        if request.query_params.get('version') == version or request.headers.get('If-None-Match') == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
 
-        data = {
-            'generations': generations,
-            'educations': educations,
-            'genders': genders
-        }
+        return Response({'version': version, **build_tree_graph()}, headers={'ETag': etag})
 
-        return Response(data)
+    @action(detail=False, methods=['post'], url_path='import-gedcom')
+    def import_gedcom(self, request, *args, **kwargs):
+        gedcom_file = request.FILES.get('file')
+        if gedcom_file is None:
+            raise ValidationError('Thiếu file GEDCOM.')
+
+        default_bdate = request.data.get('default_bdate')
+        if default_bdate:
+            try:
+                default_bdate = datetime.date.fromisoformat(default_bdate)
+            except ValueError:
+                raise ValidationError('default_bdate không hợp lệ.')
+
+        result = GedcomImporter(default_bdate=default_bdate or None).run(gedcom_file)
+        return Response(result, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, url_path=r'export\.(?P<export_format>ged|ndjson)')
+    def export(self, request, export_format=None, *args, **kwargs):
+        exclude_images = 'exclude_images' in request.query_params
+
+        if export_format == 'ged':
+            response = StreamingHttpResponse(iter_gedcom(exclude_images=exclude_images),
+                                             content_type='text/x-gedcom; charset=utf-8')
+        else:
+            response = StreamingHttpResponse(iter_ndjson(exclude_images=exclude_images),
+                                             content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="family-tree.{export_format}"'
+        return response
+
+    def get_max_depth(self):
+        max_depth = self.request.query_params.get('max_depth')
+        if max_depth is None:
+            return None
+        try:
+            max_depth = int(max_depth)
+        except ValueError:
+            raise ValidationError('max_depth phải là số nguyên.')
+        if max_depth < 1:
+            raise ValidationError('max_depth phải lớn hơn 0.')
+        return max_depth
+
+    def get_depth_param(self, name, default):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValidationError(f'{name} phải là số nguyên.')
+        if not 0 <= value <= MAX_NEIGHBOURHOOD_DEPTH:
+            raise ValidationError(f'{name} phải nằm trong khoảng 0-{MAX_NEIGHBOURHOOD_DEPTH}.')
+        return value
+
+    def lineage_response(self, queryset):
+        queryset = queryset.prefetch_related('pids')
+
+        if 'query_all' not in self.request.query_params:
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                serializer = FamilyTreeLineageSerializer(page, many=True)
+                return self.get_paginated_response(serializer.data)
+
+        serializer = FamilyTreeLineageSerializer(queryset, many=True)
+        return Response(serializer.data)
+
+
+class BranchViewSet(viewsets.ModelViewSet):
+    queryset = Branch.objects.select_related('root').order_by('id')
+    serializer_class = BranchSerializer
+    pagination_class = FamilyTreePagination
+    filter_backends = [SearchFilter, OrderingFilter]
+    search_fields = ['name', 'root__name']
+    ordering_fields = '__all__'
+
+    def get_permissions(self):
+        if self.request.method in SAFE_METHODS:
+            return [IsAuthenticated()]
+        return [IsAuthenticated(), IsSuperUser()]
+
+
+class FamilyTreeIntegrityAPIView(APIView):
+    permission_classes = [IsAuthenticated, IsSuperUser]
+
+    def get(self, request, format=None):
+        return Response(scan_tree())
+
+    def post(self, request, format=None):
+        report = scan_tree()
+        report['repaired'] = repair_tree(report)
+        return Response(report)
+
+
+class FamilyTreeStatisticsAPIView(APIView):
+    def get(self, request, format=None):
+        return Response(get_statistics())
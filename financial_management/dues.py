@@ -0,0 +1,128 @@
+import datetime
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from rest_framework.exceptions import ValidationError
+
+from family_tree_manager.models import FamilyTree
+
+from .models import ContributionLevel, Income
+from .signals import incomes_created
+
+# Giới hạn số năm trong một truy vấn để ma trận thành viên x năm không quá lớn
+MAX_DUES_YEARS = 50
+MAX_BULK_DUES = 1000
+
+
+def parse_years(value):
+    """'2020-2026', '2020,2022' hoặc '2024' -> danh sách năm tăng dần."""
+    years = set()
+    try:
+        for part in value.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '-' in part:
+                start, end = (int(bound) for bound in part.split('-', 1))
+                years.update(range(start, end + 1))
+            else:
+                years.add(int(part))
+    except ValueError:
+        raise ValidationError('years phải có dạng 2020-2026 hoặc 2020,2022.')
+    if not years:
+        raise ValidationError('years không được để trống.')
+    if len(years) > MAX_DUES_YEARS:
+        raise ValidationError(f'Chỉ tra cứu tối đa {MAX_DUES_YEARS} năm một lần.')
+    return sorted(years)
+
+
+class DuesMatrix:
+    """
+    Trạng thái đóng góp của thành viên theo các năm. Năm không có mức đóng góp
+    (ContributionLevel) thì không ai đóng được nên luôn tính là chưa đóng.
+    """
+
+    def __init__(self, years):
+        self.years = list(years)
+        self.levels = {level_id: (year, amount) for level_id, year, amount in
+                       ContributionLevel.objects.filter(year__in=self.years).values_list('id', 'year', 'amount')}
+        self.amounts = {year: amount for year, amount in self.levels.values()}
+
+    def unpaid(self, queryset):
+        """Lọc các thành viên còn thiếu ít nhất một năm bằng anti-join trong database."""
+        paid = Income.objects.filter(member=OuterRef('pk'), contributor_id__in=list(self.levels))
+        if len(self.years) == 1:
+            return queryset.filter(~Exists(paid))
+
+        paid_years = paid.order_by().values('member').annotate(
+            paid=Count('contributor_id', distinct=True)).values('paid')
+        return queryset.annotate(
+            paid_years=Coalesce(Subquery(paid_years, output_field=IntegerField()), Value(0))).filter(
+            paid_years__lt=len(self.years))
+
+    def annotate_page(self, members):
+        """Gắn unpaid_years và arrears cho một trang thành viên bằng một truy vấn."""
+        paid = defaultdict(set)
+        for member_id, level_id in Income.objects.filter(
+                member__in=members, contributor_id__in=list(self.levels)).values_list('member_id', 'contributor_id'):
+            paid[member_id].add(self.levels[level_id][0])
+
+        for member in members:
+            member.unpaid_years = [year for year in self.years if year not in paid[member.id]]
+            member.arrears = sum(self.amounts.get(year, 0) for year in member.unpaid_years)
+        return members
+
+
+def record_dues(entries):
+    """
+    Ghi nhiều khoản đóng góp [{'member', 'year', 'date'}] trong một transaction.
+    Thành viên, mức đóng góp và trùng lặp được kiểm tra bằng vài truy vấn theo
+    tập; dòng hợp lệ được thêm bằng bulk_create. Trả về kết quả cho từng dòng.
+    """
+    for attempt in range(2):
+        results, incomes = validate_dues(entries)
+        try:
+            with transaction.atomic():
+                Income.objects.bulk_create([income for _, income in incomes])
+                for index, income in incomes:
+                    results[index] = {'index': index, 'status': 'created', 'id': income.id}
+                # Sổ cái và rollup của chi được cập nhật trong cùng transaction như post_save
+                if incomes:
+                    incomes_created.send(sender=Income, income_ids=[income.id for _, income in incomes])
+        except IntegrityError:
+            # Thủ quỹ khác vừa ghi cùng khoản: kiểm tra lại một lần với dữ liệu mới
+            if attempt:
+                raise
+            continue
+        break
+
+    return results
+
+
+def validate_dues(entries):
+    member_ids = {entry['member'] for entry in entries}
+    years = {entry['year'] for entry in entries}
+    members = set(FamilyTree.objects.filter(id__in=member_ids).values_list('id', flat=True))
+    levels = dict(ContributionLevel.objects.filter(year__in=years).values_list('year', 'id'))
+    recorded = set(Income.objects.filter(member_id__in=member_ids, contributor_id__in=levels.values()).values_list(
+        'contributor_id', 'member_id'))
+
+    results, incomes = [None] * len(entries), []
+    for index, entry in enumerate(entries):
+        errors = {}
+        if entry['member'] not in members:
+            errors['member'] = ['Thành viên không tồn tại.']
+        if entry['year'] not in levels:
+            errors['year'] = [f"Chưa có mức đóng góp cho năm {entry['year']}."]
+        elif (levels[entry['year']], entry['member']) in recorded:
+            errors['non_field_errors'] = [f"Thành viên đã đóng góp cho năm {entry['year']}."]
+        if errors:
+            results[index] = {'index': index, 'status': 'error', 'errors': errors}
+            continue
+
+        recorded.add((levels[entry['year']], entry['member']))
+        incomes.append((index, Income(date=entry.get('date') or datetime.date.today(),
+                                      contributor_id=levels[entry['year']], member_id=entry['member'])))
+    return results, incomes
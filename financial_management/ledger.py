@@ -0,0 +1,250 @@
+import datetime
+from collections import defaultdict
+
+from django.apps import apps as django_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncYear
+
+GRANULARITIES = ('day', 'month', 'year')
+TRUNCATE = {'day': TruncDay, 'month': TruncMonth, 'year': TruncYear}
+# kind -> (trường ngày, trường số tiền, trường danh mục)
+SOURCES = {
+    'income': ('date', 'contributor__amount', None),
+    'sponsor': ('start_date', 'amount', None),
+    'expense': ('date', 'amount', 'category_id'),
+}
+
+
+def truncate(value, granularity):
+    if granularity == 'year':
+        return value.replace(month=1, day=1)
+    if granularity == 'month':
+        return value.replace(day=1)
+    return value
+
+
+def income_entries(income):
+    """(kind, ngày, category_id, số tiền) của một khoản thu; chỉ khoản có mức đóng góp mới vào sổ."""
+    if income.contributor_id is None:
+        return []
+    return [('income', income.date, None, income.contributor.amount)]
+
+
+def sponsor_entries(sponsor):
+    return [('sponsor', sponsor.start_date, None, sponsor.amount)]
+
+
+def expense_entries(expense):
+    return [('expense', expense.date, expense.category_id, expense.amount)]
+
+
+def apply_deltas(deltas):
+    """
+    Cộng dồn {(kind, ngày, category_id): (số tiền, số giao dịch)} vào cả ba mức
+    ngày/tháng/năm. Mỗi dòng rollup là một câu UPDATE, chỉ INSERT khi chưa có;
+    dòng không còn giao dịch nào bị xóa để bảng luôn giống rebuild_ledger().
+    """
+    from .models import LedgerRollup
+
+    rows = defaultdict(lambda: [0, 0])
+    for (kind, date, category_id), (amount, count) in deltas.items():
+        if isinstance(date, str):
+            date = datetime.date.fromisoformat(date)
+        for granularity in GRANULARITIES:
+            row = rows[(granularity, truncate(date, granularity), kind, category_id)]
+            row[0] += amount
+            row[1] += count
+
+    for (granularity, period, kind, category_id), (amount, count) in rows.items():
+        if not amount and not count:
+            continue
+        lookup = {'granularity': granularity, 'period': period, 'kind': kind, 'category_id': category_id}
+        changes = {'amount': F('amount') + amount, 'count': F('count') + count}
+        if count < 0:
+            # Giao dịch bị bớt đi: dòng đã có sẵn, hết giao dịch thì xóa luôn
+            LedgerRollup.objects.filter(**lookup).update(**changes)
+            LedgerRollup.objects.filter(count=0, **lookup).delete()
+            continue
+        if LedgerRollup.objects.filter(**lookup).update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                LedgerRollup.objects.create(amount=amount, count=count, **lookup)
+        except IntegrityError:
+            # Request khác vừa tạo dòng này
+            LedgerRollup.objects.filter(**lookup).update(**changes)
+
+
+def entries_delta(before=(), after=()):
+    deltas = defaultdict(lambda: [0, 0])
+    for sign, entries in ((-1, before), (1, after)):
+        for kind, date, category_id, amount in entries:
+            delta = deltas[(kind, date, category_id)]
+            delta[0] += sign * amount
+            delta[1] += sign
+    return deltas
+
+
+def grouped_income_deltas(incomes, amount, sign=1):
+    """Delta theo ngày cho một nhóm khoản thu cùng số tiền (vd. đổi mức đóng góp của một năm)."""
+    return {('income', row['date'], None): (sign * amount * row['count'], sign * row['count'])
+            for row in incomes.values('date').annotate(count=Count('id')).order_by()}
+
+
+def grouped_amounts(queryset, kind, granularity):
+    """(kỳ, category_id, tổng tiền, số giao dịch) của queryset, GROUP BY trong database."""
+    date_field, amount_field, category_field = SOURCES[kind]
+    group_by = ['period'] + ([category_field] if category_field else [])
+    for row in queryset.annotate(period=TRUNCATE[granularity](date_field)).values(*group_by).annotate(
+            amount=Sum(amount_field), count=Count('id')).order_by():
+        yield row['period'], row[category_field] if category_field else None, row['amount'] or 0, row['count']
+
+
+def filter_dates(queryset, kind, start=None, end=None):
+    date_field = SOURCES[kind][0]
+    if start is not None:
+        queryset = queryset.filter(**{f'{date_field}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{date_field}__lte': end})
+    return queryset
+
+
+def rebuild_ledger(get_model=django_apps.get_model):
+    """Tính lại toàn bộ bảng rollup từ giao dịch: mỗi loại x mỗi mức là một truy vấn GROUP BY."""
+    LedgerRollup = get_model('financial_management', 'LedgerRollup')
+    Income = get_model('financial_management', 'Income')
+    Sponsor = get_model('financial_management', 'Sponsor')
+    Expense = get_model('financial_management', 'Expense')
+
+    querysets = {
+        'income': Income.objects.filter(contributor__isnull=False),
+        'sponsor': Sponsor.objects.all(),
+        'expense': Expense.objects.all(),
+    }
+    rollups = []
+    for kind, queryset in querysets.items():
+        for granularity in GRANULARITIES:
+            for period, category_id, amount, count in grouped_amounts(queryset, kind, granularity):
+                rollups.append(LedgerRollup(granularity=granularity, period=period, kind=kind,
+                                            category_id=category_id, amount=amount, count=count))
+
+    with transaction.atomic():
+        LedgerRollup.objects.all().delete()
+        LedgerRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+def covering_filter(granularity, start, end):
+    """
+    Phủ [start, end] bằng các kỳ trọn vẹn không thô hơn granularity: kỳ lẻ ở hai
+    đầu được lấy từ mức mịn hơn nên tổng luôn khớp với giao dịch trong khoảng.
+    """
+    levels = GRANULARITIES[:GRANULARITIES.index(granularity) + 1]
+    periods = defaultdict(list)
+    current = start
+    while current <= end:
+        for level in reversed(levels):
+            if truncate(current, level) != current:
+                continue
+            following = next_period(current, level)
+            if following - datetime.timedelta(days=1) <= end:
+                break
+        periods[level].append(current)
+        current = following
+    condition = Q(pk__in=[])
+    for level, starts in periods.items():
+        condition |= Q(granularity=level, period__in=starts)
+    return condition
+
+
+def next_period(value, granularity):
+    if granularity == 'year':
+        return value.replace(year=value.year + 1, month=1, day=1)
+    if granularity == 'month':
+        return (value.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return value + datetime.timedelta(days=1)
+
+
+def opening_filter(start):
+    """Các dòng rollup (năm, tháng, ngày) phủ mọi ngày trước start."""
+    return (Q(granularity='year', period__lt=truncate(start, 'year')) |
+            Q(granularity='month', period__gte=truncate(start, 'year'), period__lt=truncate(start, 'month')) |
+            Q(granularity='day', period__gte=truncate(start, 'month'), period__lt=start))
+
+
+def ledger_report(granularity='month', start=None, end=None, kinds=('income', 'sponsor', 'expense')):
+    """
+    Tổng thu/chi theo kỳ và số dư lũy kế, đọc từ bảng rollup: số dòng đọc tỉ lệ
+    với số kỳ chứ không phải số giao dịch.
+    """
+    from .models import LedgerRollup
+
+    rollups = LedgerRollup.objects.filter(kind__in=kinds)
+    if start is None and end is None:
+        rows = rollups.filter(granularity=granularity)
+    else:
+        # Khoảng mở một đầu được chặn bởi kỳ sớm/muộn nhất có dữ liệu
+        bounds = rollups.filter(granularity='day').aggregate(first=Min('period'), last=Max('period'))
+        start_bound = start or bounds['first'] or end
+        end_bound = end or bounds['last'] or start
+        rows = rollups.filter(covering_filter(granularity, start_bound, end_bound))
+
+    opening = 0
+    if start is not None:
+        for row in rollups.filter(opening_filter(start)).values('kind').annotate(amount=Sum('amount')).order_by():
+            opening += -row['amount'] if row['kind'] == 'expense' else row['amount']
+
+    rows = rows.values_list('period', 'kind', 'category_id', 'amount')
+    return summarize_ledger(granularity, opening, rows, kinds)
+
+
+def transactions_report(querysets, granularity='month', start=None, end=None):
+    """
+    Cùng kết quả với ledger_report nhưng GROUP BY trực tiếp trên giao dịch của
+    querysets ({kind: queryset}), dùng khi có bộ lọc theo dòng (số tiền, tìm
+    kiếm) mà bảng rollup không trả lời được.
+    """
+    opening, rows = 0, []
+    for kind, queryset in querysets.items():
+        date_field, amount_field, _ = SOURCES[kind]
+        if start is not None:
+            before = queryset.filter(**{f'{date_field}__lt': start}).aggregate(amount=Sum(amount_field))['amount'] or 0
+            opening += -before if kind == 'expense' else before
+        rows.extend((period, kind, category_id, amount) for period, category_id, amount, _ in
+                    grouped_amounts(filter_dates(queryset, kind, start, end), kind, granularity))
+    return summarize_ledger(granularity, opening, rows, tuple(querysets))
+
+
+def summarize_ledger(granularity, opening, rows, kinds):
+    """Gom các dòng (kỳ, kind, category_id, số tiền) thành tổng theo kỳ và số dư lũy kế."""
+    from .models import ExpenseCategory
+
+    periods = defaultdict(lambda: dict.fromkeys(kinds, 0))
+    totals = dict.fromkeys(kinds, 0)
+    categories = defaultdict(int)
+    for period, kind, category_id, amount in rows:
+        periods[truncate(period, granularity)][kind] += amount
+        totals[kind] += amount
+        if kind == 'expense':
+            categories[category_id] += amount
+
+    balance = opening
+    result = []
+    for period in sorted(periods):
+        amounts = periods[period]
+        net = amounts.get('income', 0) + amounts.get('sponsor', 0) - amounts.get('expense', 0)
+        balance += net
+        result.append({'period': period, **amounts, 'net': net, 'balance': balance})
+
+    names = dict(ExpenseCategory.objects.filter(id__in=[c for c in categories if c]).values_list('id', 'name'))
+    return {
+        'granularity': granularity,
+        'opening_balance': opening,
+        'totals': totals,
+        'total_amount': totals.get('income', 0) + totals.get('sponsor', 0) - totals.get('expense', 0),
+        'closing_balance': balance,
+        'expense_categories': [{'id': category_id, 'name': names.get(category_id), 'amount': amount}
+                               for category_id, amount in sorted(categories.items(), key=lambda item: -item[1])],
+        'periods': result,
+    }
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from financial_management.ledger import rebuild_ledger
+
+
+class Command(BaseCommand):
+    help = 'Tính lại bảng tổng hợp thu/chi (LedgerRollup) theo ngày, tháng, năm từ các giao dịch'
+
+    def handle(self, *args, **options):
+        created = rebuild_ledger()
+
+        self.stdout.write(self.style.SUCCESS(f'Đã tạo {created} dòng tổng hợp'))
@@ -0,0 +1,29 @@
+# Generated by Django 4.1 on 2026-10-18 21:00
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_incomes(apps, schema_editor):
+    # Không tự xóa khoản thu trùng; báo rõ để thủ quỹ xử lý trước khi thêm ràng buộc
+    Income = apps.get_model('financial_management', 'Income')
+    duplicates = list(Income.objects.filter(contributor__isnull=False, member__isnull=False).values(
+        'contributor_id', 'member_id').annotate(count=Count('id')).filter(count__gt=1)[:20])
+    if duplicates:
+        pairs = ', '.join(f"(contributor={row['contributor_id']}, member={row['member_id']})" for row in duplicates)
+        raise RuntimeError(f'Có khoản thu trùng thành viên và mức đóng góp, cần xử lý trước khi migrate: {pairs}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial_management', '0011_expensecategory_note'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_incomes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='income',
+            constraint=models.UniqueConstraint(condition=models.Q(('contributor__isnull', False), ('member__isnull', False)), fields=('contributor', 'member'), name='unique_income_contributor_member'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1 on 2026-10-18 21:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from financial_management.ledger import rebuild_ledger
+
+
+def populate_ledger(apps, schema_editor):
+    rebuild_ledger(apps.get_model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial_management', '0012_income_unique_contributor_member'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('day', 'Ngày'), ('month', 'Tháng'), ('year', 'Năm')], max_length=5)),
+                ('period', models.DateField()),
+                ('kind', models.CharField(choices=[('income', 'Đóng góp'), ('sponsor', 'Tài trợ'), ('expense', 'Chi')], max_length=10)),
+                ('amount', models.BigIntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='financial_management.expensecategory')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgerrollup',
+            index=models.Index(fields=['granularity', 'period'], name='financial_m_granula_fec171_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', False)), fields=('granularity', 'period', 'kind', 'category'), name='unique_ledger_rollup_category'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('granularity', 'period', 'kind'), name='unique_ledger_rollup'),
+        ),
+        migrations.RunPython(populate_ledger, migrations.RunPython.noop),
+    ]
@@ -20,6 +20,11 @@ class Sponsor(models.Model):
     start_date = models.DateField()
     amount = models.BigIntegerField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_date', 'amount'], name='sponsor_start_date_amount_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -30,6 +35,16 @@ class Income(models.Model):
     sponsor = models.ForeignKey(Sponsor, on_delete=models.SET_NULL, blank=True, null=True)
     member = models.ForeignKey(FamilyTree, on_delete=models.SET_NULL, blank=True, null=True)
 
+    class Meta:
+        constraints = [
+            # Mỗi thành viên chỉ đóng một lần cho mỗi mức đóng góp (năm); khoản tài trợ không bị giới hạn
+            models.UniqueConstraint(fields=['contributor', 'member'], name='unique_income_contributor_member',
+                                    condition=models.Q(contributor__isnull=False, member__isnull=False)),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='income_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.date}'
 
@@ -47,6 +62,53 @@ class Expense(models.Model):
     date = models.DateField()
     category = models.ForeignKey(ExpenseCategory, on_delete=models.SET_NULL, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'amount'], name='expense_date_amount_idx'),
+        ]
+
     def __str__(self):
         return f'{self.amount} - {self.date}'
 
+
+class LedgerRollup(models.Model):
+    # Tổng thu/chi theo ngày, tháng, năm; được cập nhật bằng signal để báo cáo không phải cộng từng giao dịch
+    DAY = 'day'
+    MONTH = 'month'
+    YEAR = 'year'
+    GRANULARITY_CHOICES = (
+        (DAY, 'Ngày'),
+        (MONTH, 'Tháng'),
+        (YEAR, 'Năm'),
+    )
+    INCOME = 'income'
+    SPONSOR = 'sponsor'
+    EXPENSE = 'expense'
+    KIND_CHOICES = (
+        (INCOME, 'Đóng góp'),
+        (SPONSOR, 'Tài trợ'),
+        (EXPENSE, 'Chi'),
+    )
+    granularity = models.CharField(max_length=5, choices=GRANULARITY_CHOICES)
+    # Ngày đầu tiên của kỳ
+    period = models.DateField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Chỉ dùng cho khoản chi
+    category = models.ForeignKey(ExpenseCategory, on_delete=models.CASCADE, blank=True, null=True,
+                                 related_name='rollups')
+    amount = models.BigIntegerField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'period', 'kind', 'category'],
+                                    condition=models.Q(category__isnull=False), name='unique_ledger_rollup_category'),
+            models.UniqueConstraint(fields=['granularity', 'period', 'kind'],
+                                    condition=models.Q(category__isnull=True), name='unique_ledger_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'period']),
+        ]
+
+    def __str__(self):
+        return f'{self.granularity} {self.period} {self.kind}: {self.amount}'
@@ -0,0 +1,78 @@
+from django.db.models import Count, Sum
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+
+from .ledger import (apply_deltas, entries_delta, expense_entries, grouped_income_deltas, income_entries,
+                     sponsor_entries)
+from .models import ContributionLevel, Expense, ExpenseCategory, Income, Sponsor
+from .signals import incomes_created
+
+LEDGER_ENTRIES = {
+    Income: income_entries,
+    Sponsor: sponsor_entries,
+    Expense: expense_entries,
+}
+
+
+@receiver(pre_save, sender=Income)
+@receiver(pre_save, sender=Sponsor)
+@receiver(pre_save, sender=Expense)
+@receiver(pre_delete, sender=Income)
+@receiver(pre_delete, sender=Sponsor)
+@receiver(pre_delete, sender=Expense)
+def collect_ledger_entries(sender, instance, **kwargs):
+    # Bút toán đang có trong database (không dùng instance có thể đã cũ) để trừ ra khi sửa/xóa
+    previous = None
+    if instance.pk:
+        queryset = sender.objects.select_related('contributor') if sender is Income else sender.objects
+        previous = queryset.filter(pk=instance.pk).first()
+    instance._ledger_entries = LEDGER_ENTRIES[sender](previous) if previous else []
+
+
+@receiver(post_save, sender=Income)
+@receiver(post_save, sender=Sponsor)
+@receiver(post_save, sender=Expense)
+def update_ledger_on_save(sender, instance, **kwargs):
+    apply_deltas(entries_delta(getattr(instance, '_ledger_entries', ()), LEDGER_ENTRIES[sender](instance)))
+
+
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Sponsor)
+@receiver(post_delete, sender=Expense)
+def update_ledger_on_delete(sender, instance, **kwargs):
+    apply_deltas(entries_delta(getattr(instance, '_ledger_entries', ())))
+
+
+@receiver(incomes_created)
+def update_ledger_on_bulk_incomes(sender, income_ids=(), **kwargs):
+    incomes = Income.objects.filter(id__in=income_ids).select_related('contributor')
+    apply_deltas(entries_delta(after=[entry for income in incomes for entry in income_entries(income)]))
+
+
+@receiver(pre_save, sender=ContributionLevel)
+def collect_contribution_amount(sender, instance, **kwargs):
+    instance._previous_amount = sender.objects.filter(pk=instance.pk).values_list(
+        'amount', flat=True).first() if instance.pk else None
+
+
+@receiver(post_save, sender=ContributionLevel)
+def update_ledger_on_amount_change(sender, instance, **kwargs):
+    # Đổi số tiền của mức đóng góp làm thay đổi mọi khoản thu thuộc mức đó, gom theo ngày
+    previous = getattr(instance, '_previous_amount', None)
+    if previous is not None and previous != instance.amount:
+        deltas = grouped_income_deltas(Income.objects.filter(contributor=instance), instance.amount - previous)
+        apply_deltas({key: (amount, 0) for key, (amount, _) in deltas.items()})
+
+
+@receiver(pre_delete, sender=ContributionLevel)
+def update_ledger_on_level_delete(sender, instance, **kwargs):
+    # Khoản thu mất mức đóng góp (SET_NULL) không còn được tính là đóng góp
+    apply_deltas(grouped_income_deltas(Income.objects.filter(contributor=instance), instance.amount, sign=-1))
+
+
+@receiver(pre_delete, sender=ExpenseCategory)
+def update_ledger_on_category_delete(sender, instance, **kwargs):
+    # Dòng rollup của danh mục bị xóa theo cascade; khoản chi chuyển sang "không danh mục"
+    rows = Expense.objects.filter(category=instance).values('date').annotate(
+        amount=Sum('amount'), count=Count('id')).order_by()
+    apply_deltas({('expense', row['date'], None): (row['amount'], row['count']) for row in rows})
@@ -1,4 +1,6 @@
 from rest_framework import serializers
+
+from family_tree_manager.serializers import FamilyTreeSerializer
 from .models import ContributionLevel, Sponsor, Income, ExpenseCategory, Expense
 
 
@@ -74,3 +76,13 @@ class ExpenseSerializer(serializers.ModelSerializer):
         model = Expense
         fields = '__all__'
 
+
+class UnpaidMemberSerializer(FamilyTreeSerializer):
+    unpaid_years = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+    arrears = serializers.IntegerField(read_only=True)
+
+
+class DuesEntrySerializer(serializers.Serializer):
+    member = serializers.IntegerField()
+    year = serializers.IntegerField(min_value=1)
+    date = serializers.DateField(required=False)
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Gửi sau khi ghi nhiều khoản thu cùng lúc bằng bulk_create (không phát post_save
+# cho từng dòng). income_ids là id các khoản thu đã tạo.
+incomes_created = Signal()
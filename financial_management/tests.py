@@ -1,3 +1,277 @@
-from django.test import TestCase
+import datetime
+import io
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from family_tree_manager.models import FamilyTree
+
+from .dues import parse_years, record_dues
+from .ledger import GRANULARITIES, ledger_report, rebuild_ledger, transactions_report
+from .models import ContributionLevel, Expense, ExpenseCategory, Income, LedgerRollup, Sponsor
+
+
+class ReportExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('root', 'root@example.com', 'root'))
+        category = ExpenseCategory.objects.create(name='Xây nhà thờ họ')
+        Expense.objects.create(amount=300, date=datetime.date(2024, 1, 5), category=category)
+        Expense.objects.create(amount=200, date=datetime.date(2024, 2, 5), category=category)
+        Sponsor.objects.create(name='Ông B', address='Hà Nội', phone='0900000000', email='b@example.com',
+                               start_date=datetime.date(2024, 1, 10), amount=1000)
+
+    def test_csv_export(self):
+        response = self.client.get('/api/report-ie/export.csv?type=thu-chi')
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+
+        self.assertEqual(lines[0], 'Ngày,Loại,Danh mục,Nội dung,Thu,Chi')
+        self.assertIn('Cộng tháng 01/2024,,,,1000,300', lines)
+        self.assertIn('Cộng tháng 02/2024,,,,0,200', lines)
+        self.assertIn(',,Xây nhà thờ họ,,0,500', lines)
+        self.assertEqual(lines[-1], 'Chênh lệch thu chi,,,,500,')
+
+    def test_xlsx_export(self):
+        response = self.client.get('/api/report-ie/export.xlsx?date_before=2024-02-01')
+        self.assertEqual(response.status_code, 200)
+        workbook = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIn('xl/worksheets/sheet1.xml', workbook.namelist())
+
+
+class RecordDuesTests(TestCase):
+    def test_failed_ledger_update_rolls_back_the_incomes(self):
+        level = ContributionLevel.objects.create(year=2024, amount=100)
+        member = FamilyTree.objects.create(name='Nguyễn Văn A', gender='male', bdate=datetime.date(1950, 1, 1))
+
+        with mock.patch('financial_management.receivers.apply_deltas', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                record_dues([{'member': member.id, 'year': level.year, 'date': datetime.date(2024, 3, 1)}])
+
+        self.assertFalse(Income.objects.exists())
+        self.assertFalse(LedgerRollup.objects.exists())
+
+
+class LedgerRollupTests(TestCase):
+    # Khoảng đủ cả kỳ lẻ đầu/cuối tháng, qua năm và mở một đầu
+    RANGES = (
+        (None, None),
+        (datetime.date(2024, 1, 15), datetime.date(2024, 3, 10)),
+        (datetime.date(2024, 2, 1), datetime.date(2024, 2, 29)),
+        (datetime.date(2023, 12, 31), datetime.date(2024, 1, 1)),
+        (None, datetime.date(2024, 2, 14)),
+        (datetime.date(2024, 2, 14), None),
+    )
+
+    def setUp(self):
+        self.level_2023 = ContributionLevel.objects.create(year=2023, amount=100)
+        self.level_2024 = ContributionLevel.objects.create(year=2024, amount=200)
+        self.category_a = ExpenseCategory.objects.create(name='Giỗ tổ')
+        self.category_b = ExpenseCategory.objects.create(name='Sửa nhà thờ')
+        self.income = Income.objects.create(date=datetime.date(2023, 12, 31), contributor=self.level_2023)
+        Income.objects.create(date=datetime.date(2024, 1, 20), contributor=self.level_2024)
+        Income.objects.create(date=datetime.date(2024, 2, 14), contributor=self.level_2024)
+        self.sponsor = Sponsor.objects.create(name='Ông B', address='Hà Nội', phone='0900000000',
+                                              email='b@example.com', start_date=datetime.date(2024, 2, 1), amount=1000)
+        self.expense = Expense.objects.create(amount=300, date=datetime.date(2024, 1, 15), category=self.category_a)
+        Expense.objects.create(amount=50, date=datetime.date(2024, 3, 10), category=self.category_b)
+        Expense.objects.create(amount=70, date=datetime.date(2024, 2, 29))
+
+    def rollup_rows(self):
+        return set(LedgerRollup.objects.values_list(
+            'granularity', 'period', 'kind', 'category_id', 'amount', 'count'))
+
+    def report(self, result):
+        result['expense_categories'].sort(key=lambda category: (category['id'] is not None, category['id'] or 0))
+        return result
+
+    maxDiff = None
+
+    def assertLedgerConsistent(self):
+        querysets = {
+            'income': Income.objects.filter(contributor__isnull=False),
+            'sponsor': Sponsor.objects.all(),
+            'expense': Expense.objects.all(),
+        }
+        for granularity in GRANULARITIES:
+            for start, end in self.RANGES:
+                with self.subTest(granularity=granularity, start=start, end=end):
+                    self.assertEqual(self.report(ledger_report(granularity, start, end)),
+                                     self.report(transactions_report(querysets, granularity, start, end)))
+
+        maintained = self.rollup_rows()
+        rebuild_ledger()
+        self.assertEqual(maintained, self.rollup_rows())
+
+    def test_created_transactions(self):
+        report = ledger_report('month', datetime.date(2024, 1, 15), datetime.date(2024, 2, 14))
+        self.assertEqual(report['opening_balance'], 100)
+        self.assertEqual(report['totals'], {'income': 400, 'sponsor': 1000, 'expense': 300})
+        self.assertLedgerConsistent()
+
+    def test_updated_transactions(self):
+        self.income.date = datetime.date(2024, 3, 1)
+        self.income.contributor = self.level_2024
+        self.income.save()
+        income = Income.objects.get(date=datetime.date(2024, 1, 20))
+        income.contributor = None
+        income.save()
+        self.sponsor.start_date = datetime.date(2023, 6, 1)
+        self.sponsor.amount = 1500
+        self.sponsor.save()
+        self.expense.date = datetime.date(2024, 2, 2)
+        self.expense.amount = 350
+        self.expense.category = self.category_b
+        self.expense.save()
+        self.assertLedgerConsistent()
+
+    def test_deleted_transactions(self):
+        self.income.delete()
+        self.sponsor.delete()
+        self.expense.delete()
+        self.assertLedgerConsistent()
+
+    def test_contribution_level_amount_change(self):
+        self.level_2024.amount = 250
+        self.level_2024.save()
+        self.assertLedgerConsistent()
+
+    def test_contribution_level_delete(self):
+        self.level_2024.delete()
+        self.assertLedgerConsistent()
+
+    def test_expense_category_delete(self):
+        self.category_a.delete()
+        self.assertLedgerConsistent()
+
+    def test_bulk_dues(self):
+        ContributionLevel.objects.create(year=2025, amount=300)
+        members = [FamilyTree.objects.create(name=name, gender='male', bdate=datetime.date(1950, 1, 1))
+                   for name in ('Nguyễn Văn A', 'Nguyễn Văn B')]
+        record_dues([{'member': member.id, 'year': 2025, 'date': datetime.date(2024, 2, 20)} for member in members])
+        self.assertLedgerConsistent()
+
+
+def make_member(name):
+    return FamilyTree.objects.create(name=name, gender='male', bdate=datetime.date(1950, 1, 1))
+
+
+class ParseYearsTests(SimpleTestCase):
+    def test_ranges_and_lists(self):
+        self.assertEqual(parse_years('2024, 2020-2022,2021'), [2020, 2021, 2022, 2024])
+
+    def test_invalid_values(self):
+        for value in ('abc', '2020-', ' , ', '1900-2000'):
+            with self.subTest(value=value), self.assertRaises(ValidationError):
+                parse_years(value)
+
+
+class UnpaidMemberApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('root', 'root@example.com', 'root'))
+        level_2023 = ContributionLevel.objects.create(year=2023, amount=100)
+        level_2024 = ContributionLevel.objects.create(year=2024, amount=200)
+        self.partly_paid = make_member('Nguyễn Văn A')
+        self.fully_paid = make_member('Nguyễn Văn B')
+        self.unpaid = make_member('Nguyễn Văn C')
+        for member, level in ((self.partly_paid, level_2023), (self.fully_paid, level_2023),
+                              (self.fully_paid, level_2024)):
+            Income.objects.create(date=datetime.date(level.year, 3, 1), contributor=level, member=member)
+
+    def unpaid_members(self, query):
+        response = self.client.get(f'/api/unpaid-members/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return {member['id']: (member['unpaid_years'], member['arrears']) for member in response.data['results']}
+
+    def test_arrears_across_years(self):
+        self.assertEqual(self.unpaid_members('years=2023-2024'), {
+            self.partly_paid.id: ([2024], 200),
+            self.unpaid.id: ([2023, 2024], 300),
+        })
+
+    def test_year_without_level_is_unpaid_without_arrears(self):
+        self.assertEqual(self.unpaid_members('years=2024,2025'), {
+            self.partly_paid.id: ([2024, 2025], 200),
+            self.fully_paid.id: ([2025], 0),
+            self.unpaid.id: ([2024, 2025], 200),
+        })
+
+    def test_single_year_legacy_param(self):
+        self.assertEqual(self.unpaid_members('contribution_level_year=2023'), {self.unpaid.id: ([2023], 100)})
+
+    def test_years_are_required(self):
+        self.assertEqual(self.client.get('/api/unpaid-members/').status_code, 400)
+
+
+class BulkDuesApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('root', 'root@example.com', 'root'))
+        self.level = ContributionLevel.objects.create(year=2024, amount=200)
+        self.paid = make_member('Nguyễn Văn A')
+        self.member = make_member('Nguyễn Văn B')
+        Income.objects.create(date=datetime.date(2024, 1, 1), contributor=self.level, member=self.paid)
+
+    def test_per_row_results(self):
+        response = self.client.post('/api/incomes/bulk/', {'entries': [
+            {'member': self.member.id, 'year': 2024, 'date': '2024-05-01'},
+            {'member': self.member.id, 'year': 2024},
+            {'member': self.paid.id, 'year': 2024},
+            {'member': 999999, 'year': 2024},
+            {'member': self.member.id, 'year': 2030},
+            {'member': self.member.id},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 5))
+        results = response.data['results']
+        self.assertEqual([result['index'] for result in results], list(range(6)))
+        self.assertEqual([result['status'] for result in results], ['created'] + ['error'] * 5)
+        self.assertIn('non_field_errors', results[1]['errors'])
+        self.assertIn('non_field_errors', results[2]['errors'])
+        self.assertIn('member', results[3]['errors'])
+        self.assertIn('year', results[4]['errors'])
+        self.assertIn('year', results[5]['errors'])
+
+        income = Income.objects.get(id=results[0]['id'])
+        self.assertEqual((income.member_id, income.contributor_id, income.date),
+                         (self.member.id, self.level.id, datetime.date(2024, 5, 1)))
+        self.assertEqual(Income.objects.count(), 2)
+
+    def test_nothing_created_is_a_bad_request(self):
+        response = self.client.post('/api/incomes/bulk/', [{'member': self.paid.id, 'year': 2024}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+
+
+class AmountRangeFilterTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('root', 'root@example.com', 'root'))
+        level = ContributionLevel.objects.create(year=2024, amount=200)
+        Income.objects.create(date=datetime.date(2024, 1, 10), contributor=level)
+        Sponsor.objects.create(name='Ông B', address='Hà Nội', phone='0900000000', email='b@example.com',
+                               start_date=datetime.date(2024, 1, 20), amount=1000)
+        for amount, date in ((50, datetime.date(2024, 1, 5)), (300, datetime.date(2024, 2, 5)),
+                             (700, datetime.date(2024, 2, 25))):
+            Expense.objects.create(amount=amount, date=date)
+
+    def test_report_amount_range(self):
+        response = self.client.get('/api/report-ie/?amount_min=100&amount_max=500&date_before=2024-01-01')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['totals'], {'income': 200, 'sponsor': 0, 'expense': 300})
+        self.assertEqual([(period['period'], period['net']) for period in response.data['periods']],
+                         [(datetime.date(2024, 1, 1), 200), (datetime.date(2024, 2, 1), -300)])
+
+    def test_report_rejects_non_numeric_amount(self):
+        self.assertEqual(self.client.get('/api/report-ie/?amount_min=abc').status_code, 400)
+
+    def test_list_amount_range(self):
+        response = self.client.get('/api/expenses/?amount_min=100&amount_max=500')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([expense['amount'] for expense in response.data['results']], [300])
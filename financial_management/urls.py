@@ -1,4 +1,4 @@
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     ContributionLevelViewSet, SponsorViewSet,
@@ -15,5 +15,8 @@ router.register(r'report-ie', ReportViewSet, basename='report-ie')
 router.register(r'unpaid-members', UnpaidMemberViewSet, basename='unpaid-members')
 
 urlpatterns = [
+    # Đường dẫn file export không có dấu / ở cuối như trong tài liệu (router chỉ nhận dạng có /)
+    re_path(r'^api/report-ie/export\.(?P<export_format>csv|xlsx)$',
+            ReportViewSet.as_view({'get': 'export'}), name='report-ie-export-file'),
     path('api/', include(router.urls))
 ]
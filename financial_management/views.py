@@ -1,19 +1,27 @@
-from django.db import models
+import datetime
+
+from django.db import IntegrityError
 from django.db.models import Q
+from django.http import FileResponse, StreamingHttpResponse
 
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 
 from family_tree_manager.models import FamilyTree
-from family_tree_manager.serializers import FamilyTreeSerializer
-from .models import ContributionLevel, Sponsor, Income, ExpenseCategory, Expense
+from family_tree_manager.search import NameSearchFilter
+from src.pagination import CursorOptInPagination
+from src.streaming import StreamingListMixin
+from .dues import MAX_BULK_DUES, DuesMatrix, parse_years, record_dues
+from .exports import XLSX_CONTENT_TYPE, iter_csv, iter_report_rows, write_xlsx
+from .ledger import SOURCES, filter_dates, ledger_report, transactions_report
+from .models import ContributionLevel, Sponsor, Income, ExpenseCategory, Expense, LedgerRollup
 from rest_framework.filters import SearchFilter, OrderingFilter
 from .serializers import (
     ContributionLevelSerializer, SponsorSerializer,
-    IncomeSerializer, ExpenseCategorySerializer, ExpenseSerializer
+    IncomeSerializer, ExpenseCategorySerializer, ExpenseSerializer, UnpaidMemberSerializer, DuesEntrySerializer
 )
 from rest_framework.permissions import IsAuthenticated, BasePermission, SAFE_METHODS
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
 from django_filters import rest_framework as filters
@@ -38,25 +46,34 @@ class IsReadOnly(BasePermission):
         return False
 
 
-class BasePagination(PageNumberPagination):
+class BasePagination(CursorOptInPagination):
     page_size = 10
     page_size_query_param = 'pageSize'
 
 
-class ContributionLevelViewSet(viewsets.ModelViewSet):
+class ContributionLevelFilter(filters.FilterSet):
+    amount_min = filters.NumberFilter(field_name='amount', lookup_expr='gte')
+    amount_max = filters.NumberFilter(field_name='amount', lookup_expr='lte')
+
+    class Meta:
+        model = ContributionLevel
+        fields = ['year']
+
+
+class ContributionLevelViewSet(StreamingListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsSuperUserOrReadOnly]
     queryset = ContributionLevel.objects.all()
     serializer_class = ContributionLevelSerializer
     pagination_class = BasePagination
-    filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ['year', 'amount', 'note']
+    filter_backends = [SearchFilter, OrderingFilter, filters.DjangoFilterBackend]
+    search_fields = ['note']
     ordering_fields = '__all__'
+    filterset_class = ContributionLevelFilter
 
     def list(self, request, *args, **kwargs):
         if 'query_all' in request.query_params:
             queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+            return self.stream_list(queryset)
         else:
             return super().list(request, *args, **kwargs)
 
@@ -65,6 +82,8 @@ class SponsorFilter(filters.FilterSet):
     # start_date = filters.DateFromToRangeFilter(field_name='start_date')
     start_date_before = filters.DateFilter(field_name='start_date', lookup_expr='gte')
     start_date_after = filters.DateFilter(field_name='start_date', lookup_expr='lte')
+    amount_min = filters.NumberFilter(field_name='amount', lookup_expr='gte')
+    amount_max = filters.NumberFilter(field_name='amount', lookup_expr='lte')
 
     class Meta:
         model = Sponsor
@@ -73,29 +92,28 @@ class SponsorFilter(filters.FilterSet):
         }
 
 
-class SponsorViewSet(viewsets.ModelViewSet):
+class SponsorViewSet(StreamingListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsSuperUserOrReadOnly]
     queryset = Sponsor.objects.all()
     serializer_class = SponsorSerializer
     pagination_class = BasePagination
     filter_backends = [SearchFilter, OrderingFilter, filters.DjangoFilterBackend]
-    search_fields = ['name', 'phone', 'address', 'amount']
+    search_fields = ['name', 'phone', 'address']
     ordering_fields = '__all__'
     filterset_class = SponsorFilter
 
     def list(self, request, *args, **kwargs):
         if 'query_all' in request.query_params:
             queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+            return self.stream_list(queryset)
         else:
             return super().list(request, *args, **kwargs)
 
 
-def validate_unique(contributor_id, member_id):
-    # Kiểm tra tính duy nhất của sponsor và member
+def validate_unique(contributor_id, member_id, exclude_id=None):
+    # Kiểm tra tính duy nhất của contributor và member
     if contributor_id and member_id:
-        queryset = Income.objects.filter(contributor_id=contributor_id, member_id=member_id)
+        queryset = Income.objects.filter(contributor_id=contributor_id, member_id=member_id).exclude(id=exclude_id)
         if queryset.exists():
             raise ValidationError('Contributor and member must be unique.')
 
@@ -106,6 +124,9 @@ class IncomeFilter(filters.FilterSet):
     date_after = filters.DateFilter(field_name='date', lookup_expr='lte')
     contributor = filters.BooleanFilter(field_name='contributor', method='filter_contributor')
     year = filters.NumberFilter(field_name='contributor__year')
+    branch = filters.NumberFilter(field_name='member__branch')
+    amount_min = filters.NumberFilter(field_name='contributor__amount', lookup_expr='gte')
+    amount_max = filters.NumberFilter(field_name='contributor__amount', lookup_expr='lte')
 
     def filter_contributor(self, queryset, name, value):
         if value is True:
@@ -123,14 +144,15 @@ class IncomeFilter(filters.FilterSet):
         }
 
 
-class IncomeViewSet(viewsets.ModelViewSet):
+class IncomeViewSet(StreamingListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsSuperUserOrReadOnly]
     queryset = Income.objects.all()
     serializer_class = IncomeSerializer
     pagination_class = BasePagination
-    filter_backends = [SearchFilter, OrderingFilter, filters.DjangoFilterBackend]
-    search_fields = ['date', 'contributor__amount', 'contributor__year', 'sponsor__name',
-                     'sponsor__amount', 'member__name']
+    filter_backends = [NameSearchFilter, OrderingFilter, filters.DjangoFilterBackend]
+    # Số tiền, năm, ngày lọc bằng amount_min/amount_max, year, date_before/date_after
+    search_fields = ['sponsor__name']
+    name_search_fields = ['member__name']
     ordering_fields = ['id', 'date', 'contributor__amount']  # or'__all__'
     filterset_fields = {
         'contributor': ['isnull'],
@@ -140,8 +162,7 @@ class IncomeViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         if 'query_all' in request.query_params:
             queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+            return self.stream_list(queryset.select_related('contributor', 'sponsor', 'member'))
         else:
             return super().list(request, *args, **kwargs)
 
@@ -152,58 +173,78 @@ class IncomeViewSet(viewsets.ModelViewSet):
 
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
 
-        # Kiểm tra tính duy nhất của sponsor và member
+        # Kiểm tra tính duy nhất trước khi ghi để không để lại dòng thừa khi lỗi
         validate_unique(contributor_id, member_id)
 
-        income = serializer.instance
-
+        related = {}
         if contributor_id:
-            contributor = ContributionLevel.objects.get(id=contributor_id)
-            income.contributor = contributor
-
+            related['contributor'] = ContributionLevel.objects.get(id=contributor_id)
         if sponsor_id:
-            sponsor = Sponsor.objects.get(id=sponsor_id)
-            income.sponsor = sponsor
-
+            related['sponsor'] = Sponsor.objects.get(id=sponsor_id)
         if member_id:
-            member = FamilyTree.objects.get(id=member_id)
-            income.member = member
+            related['member'] = FamilyTree.objects.get(id=member_id)
 
-        income.save()
+        try:
+            serializer.save(**related)
+        except IntegrityError:
+            raise ValidationError('Contributor and member must be unique.')
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=True)
-        serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
-
         contributor_id = request.data.pop('contributor', None)
         sponsor_id = request.data.pop('sponsor', None)
         member_id = request.data.pop('member', None)
 
-        if contributor_id:
-            contributor = ContributionLevel.objects.get(id=contributor_id)
-            instance.contributor = contributor
+        serializer = self.get_serializer(instance, data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
 
-        if sponsor_id:
-            sponsor = Sponsor.objects.get(id=sponsor_id)
-            instance.sponsor = sponsor
+        validate_unique(contributor_id or instance.contributor_id, member_id or instance.member_id, instance.id)
 
+        related = {}
+        if contributor_id:
+            related['contributor'] = ContributionLevel.objects.get(id=contributor_id)
+        if sponsor_id:
+            related['sponsor'] = Sponsor.objects.get(id=sponsor_id)
         if member_id:
-            member = FamilyTree.objects.get(id=member_id)
-            instance.member = member
+            related['member'] = FamilyTree.objects.get(id=member_id)
 
-        instance.save()
+        try:
+            serializer.save(**related)
+        except IntegrityError:
+            raise ValidationError('Contributor and member must be unique.')
 
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, *args, **kwargs):
+        rows = request.data.get('entries') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError('entries phải là danh sách khoản đóng góp.')
+        if len(rows) > MAX_BULK_DUES:
+            raise ValidationError(f'Mỗi lần chỉ ghi tối đa {MAX_BULK_DUES} khoản.')
+
+        results, entries, positions = [None] * len(rows), [], []
+        for index, row in enumerate(rows):
+            entry = DuesEntrySerializer(data=row)
+            if entry.is_valid():
+                entries.append(entry.validated_data)
+                positions.append(index)
+            else:
+                results[index] = {'index': index, 'status': 'error', 'errors': entry.errors}
+
+        for position, result in zip(positions, record_dues(entries) if entries else []):
+            results[position] = {**result, 'index': position}
 
-class ExpenseCategoryViewSet(viewsets.ModelViewSet):
+        created = sum(1 for result in results if result['status'] == 'created')
+        return Response({'created': created, 'failed': len(results) - created, 'results': results},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+
+class ExpenseCategoryViewSet(StreamingListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsSuperUserOrReadOnly]
     queryset = ExpenseCategory.objects.all()
     serializer_class = ExpenseCategorySerializer
@@ -215,8 +256,7 @@ class ExpenseCategoryViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         if 'query_all' in request.query_params:
             queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+            return self.stream_list(queryset)
         else:
             return super().list(request, *args, **kwargs)
 
@@ -225,6 +265,8 @@ class ExpenseFilter(filters.FilterSet):
     # date = filters.DateFromToRangeFilter(field_name='date')
     date_before = filters.DateFilter(field_name='date', lookup_expr='gte')
     date_after = filters.DateFilter(field_name='date', lookup_expr='lte')
+    amount_min = filters.NumberFilter(field_name='amount', lookup_expr='gte')
+    amount_max = filters.NumberFilter(field_name='amount', lookup_expr='lte')
 
     class Meta:
         model = Expense
@@ -233,21 +275,20 @@ class ExpenseFilter(filters.FilterSet):
         }
 
 
-class ExpenseViewSet(viewsets.ModelViewSet):
+class ExpenseViewSet(StreamingListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsSuperUserOrReadOnly]
     queryset = Expense.objects.all()
     serializer_class = ExpenseSerializer
     pagination_class = BasePagination
     filter_backends = [SearchFilter, OrderingFilter, filters.DjangoFilterBackend]
-    search_fields = ['category__name', 'amount']
+    search_fields = ['category__name']
     ordering_fields = '__all__'
     filterset_class = ExpenseFilter
 
     def list(self, request, *args, **kwargs):
         if 'query_all' in request.query_params:
             queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+            return self.stream_list(queryset.select_related('category'))
         else:
             return super().list(request, *args, **kwargs)
 
@@ -288,81 +329,142 @@ class ExpenseViewSet(viewsets.ModelViewSet):
 
 class UnpaidMemberViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsReadOnly]
-    queryset = FamilyTree.objects.all()
-    serializer_class = FamilyTreeSerializer
+    queryset = FamilyTree.objects.all().order_by('-id')
+    serializer_class = UnpaidMemberSerializer
     pagination_class = BasePagination
-    search_fields = ['name']
+    filter_backends = [NameSearchFilter]
+    name_search_fields = ['name']
 
     def list(self, request, *args, **kwargs):
-        contribution_level_year = request.query_params.get('contribution_level_year')
-        search = request.query_params.get('search', '')
-        if contribution_level_year:
-            data = []
-            query_set = FamilyTree.objects.filter(Q(name__icontains=search))
-            for family_tree in query_set:
-                if not Income.objects.filter(member_id=family_tree.id, contributor__year=contribution_level_year):
-                    data.append(family_tree)
+        # ?contribution_level_year= (một năm) vẫn được hỗ trợ cho client cũ
+        years = request.query_params.get('years') or request.query_params.get('contribution_level_year')
+        if not years:
+            raise ValidationError("Must have param years or contribution_level_year")
+
+        dues = DuesMatrix(parse_years(years))
+        queryset = dues.unpaid(self.filter_queryset(self.get_queryset())).prefetch_related('pids')
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(dues.annotate_page(page), many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(dues.annotate_page(list(queryset)), many=True)
+        return Response(serializer.data)
+
+
+REPORT_KINDS = {
+    'thu': ('income', 'sponsor'),
+    'chi': ('expense',),
+    'thu-chi': ('income', 'sponsor', 'expense'),
+}
+
+
+# Cột văn bản được tìm kiếm theo ?search= của từng loại giao dịch
+REPORT_SEARCH_FIELDS = {
+    'income': ('member__name', 'sponsor__name'),
+    'sponsor': ('name', 'phone', 'address'),
+    'expense': ('category__name',),
+}
+
 
-            page = self.paginate_queryset(data)
-            if page is not None:
-                serializer = self.get_serializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
+def parse_report_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f'{name} phải có dạng YYYY-MM-DD.')
 
-            serializer = self.get_serializer(page, many=True)
-            return Response(serializer.data)
-        raise ValidationError("Must have param contribution_level_year")
+
+def parse_amount(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError(f'{name} phải là số nguyên.')
 
 
 class ReportViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated, IsSuperUserOrReadOnly]
 
-    def list(self, request, *args, **kwargs):
-        type = request.query_params.get('type')
-        search = request.query_params.get('search') or ''
-        date_before = request.query_params.get('date_before')
-        date_after = request.query_params.get('date_after')
-
-        if date_before and date_after:
-            expenses = Expense.objects.filter(
-                date__range=[date_before,
-                             date_after],
-                amount__icontains=search) if type == 'chi' or type == 'thu-chi' else Expense.objects.filter(
-                id__isnull=True)
-            incomes = Income.objects.filter(
-                contributor__isnull=False,
-                date__range=[date_before, date_after],
-                contributor__amount__icontains=search) if type == 'thu' or type == 'thu-chi' else Income.objects.filter(
-                id__isnull=True)
-            sponsors = Sponsor.objects.filter(
-                start_date__range=[date_before,
-                                   date_after],
-                amount__icontains=search) if type == 'thu' or type == 'thu-chi' else Sponsor.objects.filter(
-                id__isnull=True)
-        else:
-            expenses = Expense.objects.filter(amount__icontains=search) if type == 'chi' or type == 'thu-chi' else Expense.objects.filter(
-                id__isnull=True)
-            incomes = Income.objects.filter(
-                contributor__isnull=False,
-                contributor__amount__icontains=search) if type == 'thu' or type == 'thu-chi' else Income.objects.filter(
-                id__isnull=True)
-            sponsors = Sponsor.objects.filter(amount__icontains=search) if type == 'thu' or type == 'thu-chi' else Sponsor.objects.filter(
-                id__isnull=True)
-
-        total_amount_expenses = expenses.aggregate(total_amount=models.Sum('amount'))['total_amount'] or 0
-        total_amount_incomes = incomes.aggregate(total_contributor__amount=models.Sum('contributor__amount'))[
-                                   'total_contributor__amount'] or 0
-        total_amount_sponsors = sponsors.aggregate(total_amount=models.Sum('amount'))['total_amount'] or 0
-        total_amount = total_amount_incomes + total_amount_sponsors - total_amount_expenses
-
-        expense_serializer = ExpenseSerializer(expenses, many=True)
-        income_serializer = IncomeSerializer(incomes, many=True)
-        sponsor_serializer = SponsorSerializer(sponsors, many=True)
-
-        report_data = {
-            'expenses': expense_serializer.data,
-            'incomes': income_serializer.data,
-            'sponsors': sponsor_serializer.data,
-            'total_amount': total_amount,
+    def get_report_params(self):
+        params = self.request.query_params
+        # date_before là ngày bắt đầu, date_after là ngày kết thúc (giữ nguyên như client hiện tại)
+        start = parse_report_date(params.get('date_before'), 'date_before')
+        end = parse_report_date(params.get('date_after'), 'date_after')
+        kinds = REPORT_KINDS.get(params.get('type'), REPORT_KINDS['thu-chi'])
+        return start, end, kinds
+
+    def get_transaction_querysets(self):
+        """
+        Queryset giao dịch theo từng loại với bộ lọc theo dòng (khoảng số tiền,
+        tìm kiếm trên cột văn bản) nhưng chưa lọc ngày. Trả về thêm cờ cho biết
+        có bộ lọc theo dòng hay không.
+        """
+        _, _, kinds = self.get_report_params()
+        params = self.request.query_params
+        search = (params.get('search') or '').strip()
+        amount_min = parse_amount(params.get('amount_min'), 'amount_min')
+        amount_max = parse_amount(params.get('amount_max'), 'amount_max')
+
+        querysets = {
+            'income': Income.objects.filter(contributor__isnull=False).select_related('contributor', 'sponsor', 'member'),
+            'sponsor': Sponsor.objects.all(),
+            'expense': Expense.objects.select_related('category'),
         }
+        for kind, queryset in querysets.items():
+            amount_field = SOURCES[kind][1]
+            if amount_min is not None:
+                queryset = queryset.filter(**{f'{amount_field}__gte': amount_min})
+            if amount_max is not None:
+                queryset = queryset.filter(**{f'{amount_field}__lte': amount_max})
+            if search:
+                condition = Q()
+                for field in REPORT_SEARCH_FIELDS[kind]:
+                    condition |= Q(**{f'{field}__icontains': search})
+                queryset = queryset.filter(condition)
+            querysets[kind] = queryset
+        filtered = bool(search) or amount_min is not None or amount_max is not None
+        return {kind: queryset for kind, queryset in querysets.items() if kind in kinds}, filtered
 
-        return Response(report_data)
+    def list(self, request, *args, **kwargs):
+        start, end, kinds = self.get_report_params()
+        granularity = request.query_params.get('granularity', LedgerRollup.MONTH)
+        if granularity not in dict(LedgerRollup.GRANULARITY_CHOICES):
+            raise ValidationError('granularity phải là day, month hoặc year.')
+
+        querysets, filtered = self.get_transaction_querysets()
+        if filtered:
+            # Bảng rollup không phân theo số tiền/nội dung: GROUP BY trên giao dịch, dùng index (ngày, số tiền)
+            return Response(transactions_report(querysets, granularity, start, end))
+        return Response(ledger_report(granularity, start, end, kinds))
+
+    @action(detail=False)
+    def details(self, request, *args, **kwargs):
+        start, end, _ = self.get_report_params()
+        kind = request.query_params.get('kind')
+        querysets, _ = self.get_transaction_querysets()
+        if kind not in querysets:
+            raise ValidationError(f'kind phải là một trong: {", ".join(querysets)}.')
+
+        serializer_class = {'income': IncomeSerializer, 'sponsor': SponsorSerializer,
+                            'expense': ExpenseSerializer}[kind]
+        queryset = filter_dates(querysets[kind], kind, start, end).order_by('-id')
+        paginator = BasePagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(serializer_class(page, many=True).data)
+
+    @action(detail=False, url_path=r'export\.(?P<export_format>csv|xlsx)')
+    def export(self, request, export_format=None, *args, **kwargs):
+        start, end, _ = self.get_report_params()
+        querysets, _ = self.get_transaction_querysets()
+        rows = iter_report_rows(querysets, start, end)
+
+        if export_format == 'csv':
+            response = StreamingHttpResponse(iter_csv(rows), content_type='text/csv; charset=utf-8')
+        else:
+            response = FileResponse(write_xlsx(rows), content_type=XLSX_CONTENT_TYPE)
+        response['Content-Disposition'] = f'attachment; filename="report-ie.{export_format}"'
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_upload', '0007_rename_image_image_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='media/images/thumbnails'),
+        ),
+    ]
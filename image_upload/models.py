@@ -1,5 +1,65 @@
-from django.db import models
+from django.core.files.base import ContentFile
+from django.db import models, transaction
+
+from PIL import UnidentifiedImageError
+
+from .thumbnails import convert_data_url, make_thumbnail, unique_name
+
+
+class ImageManager(models.Manager):
+    def create_from_converted(self, converted):
+        data, extension, thumbnail, thumbnail_extension = converted
+        image = self.model()
+        image.file.save(unique_name(extension), ContentFile(data), save=False)
+        image.thumbnail.save(unique_name(thumbnail_extension), ContentFile(thumbnail), save=False)
+        try:
+            image.save()
+        except Exception:
+            image.delete_files()
+            raise
+        return image
+
+    def create_from_data_url(self, data_url):
+        converted = convert_data_url(data_url)
+        if converted is None:
+            return None
+        return self.create_from_converted(converted)
+
+    def delete_unused(self, image_ids):
+        # Ảnh không còn thành viên nào trỏ tới thì xóa cả dòng lẫn file
+        for image in self.filter(id__in=image_ids, members__isnull=True):
+            image.delete()
 
 
 class Image(models.Model):
     file = models.ImageField(upload_to='media/images')
+    thumbnail = models.ImageField(upload_to='media/images/thumbnails', blank=True, null=True)
+
+    objects = ImageManager()
+
+    def save(self, *args, **kwargs):
+        if self.file and not self.thumbnail:
+            self.generate_thumbnail()
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        # File chỉ bị xóa khi việc xóa dòng đã commit
+        transaction.on_commit(self.delete_files)
+        return result
+
+    def delete_files(self):
+        # Xóa file ảnh và thumbnail trên storage, không đụng tới dòng trong DB
+        for field in (self.file, self.thumbnail):
+            if field:
+                field.delete(save=False)
+
+    def generate_thumbnail(self):
+        try:
+            self.file.seek(0)
+            thumbnail, extension = make_thumbnail(self.file.read())
+        except (UnidentifiedImageError, OSError, ValueError):
+            return
+        finally:
+            self.file.seek(0)
+        self.thumbnail.save(unique_name(extension), ContentFile(thumbnail), save=False)
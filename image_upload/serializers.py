@@ -6,3 +6,4 @@ class ImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = '__all__'
+        read_only_fields = ('thumbnail',)
@@ -0,0 +1,57 @@
+import base64
+import binascii
+import io
+import uuid
+
+from PIL import Image as PILImage, ImageOps, UnidentifiedImageError
+
+THUMBNAIL_SIZE = (128, 128)
+IMAGE_FORMATS = {'jpeg': 'jpg', 'jpg': 'jpg', 'png': 'png', 'gif': 'gif', 'webp': 'webp', 'bmp': 'bmp'}
+
+
+def decode_data_url(data_url):
+    # data:image/png;base64,iVBORw0...
+    header, _, encoded = data_url.partition(',')
+    if not header.startswith('data:image/') or ';base64' not in header:
+        return None, None
+    extension = IMAGE_FORMATS.get(header[len('data:image/'):].split(';')[0].lower())
+    if extension is None:
+        return None, None
+    try:
+        return base64.b64decode(encoded), extension
+    except (binascii.Error, ValueError):
+        return None, None
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    with PILImage.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA', 'P')
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        thumbnail = ImageOps.fit(image, size, PILImage.LANCZOS)
+
+        output = io.BytesIO()
+        if has_alpha:
+            thumbnail.save(output, format='PNG', optimize=True)
+            return output.getvalue(), 'png'
+        thumbnail.save(output, format='JPEG', quality=85, optimize=True)
+        return output.getvalue(), 'jpg'
+
+
+def convert_data_url(data_url):
+    """
+    Giải mã ảnh base64 và tạo thumbnail. Không dùng tới ORM nên có thể chạy
+    trong ProcessPoolExecutor. Trả về None nếu dữ liệu không phải ảnh hợp lệ.
+    """
+    data, extension = decode_data_url(data_url)
+    if data is None:
+        return None
+    try:
+        thumbnail, thumbnail_extension = make_thumbnail(data)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+    return data, extension, thumbnail, thumbnail_extension
+
+
+def unique_name(extension):
+    return f'{uuid.uuid4().hex}.{extension}'
@@ -0,0 +1,148 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from .broker import get_broker
+
+LIVE_UPDATES_PATH = '/api/live/'
+TOPICS = ('family_tree', 'event', 'income')
+
+
+def authenticate(raw_token):
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def scope_token(scope):
+    # Trình duyệt không gửi được header Authorization với EventSource/WebSocket nên cho phép ?token=
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode().split()
+            if len(parts) == 2 and parts[0].lower() == 'bearer':
+                return parts[1]
+    return None
+
+
+def scope_topics(scope):
+    query = parse_qs(scope.get('query_string', b'').decode())
+    requested = {topic for value in query.get('topics', []) for topic in value.split(',') if topic}
+    return (requested & set(TOPICS)) or set(TOPICS)
+
+
+def visible(message, user, topics):
+    if message['topic'] == 'resync':
+        return True
+    if message['topic'] not in topics:
+        return False
+    return user.is_superuser or message['user_ids'] is None or user.id in message['user_ids']
+
+
+def public_message(message):
+    return {key: value for key, value in message.items() if key != 'user_ids'}
+
+
+class LiveUpdatesApp:
+    """
+    Đẩy thay đổi FamilyTree, Event, Income tới client qua SSE (GET /api/live/)
+    hoặc WebSocket (cùng đường dẫn). Tin chỉ gồm topic, action và ids; client
+    tự tải lại dữ liệu qua REST.
+    """
+
+    def __init__(self, heartbeat=None):
+        self.heartbeat = heartbeat or getattr(settings, 'LIVE_UPDATES_HEARTBEAT', 15)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.server_sent_events(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await self.websocket(scope, receive, send)
+
+    async def stream(self, scope, user, receive, emit, is_disconnect):
+        topics = scope_topics(scope)
+        subscription = get_broker().subscribe()
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive, is_disconnect))
+        try:
+            while True:
+                message = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait({message, disconnect}, timeout=self.heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    message.cancel()
+                    break
+                if message in done:
+                    if visible(message.result(), user, topics):
+                        await emit(public_message(message.result()))
+                else:
+                    message.cancel()
+                    await emit(None)
+        finally:
+            subscription.close()
+            disconnect.cancel()
+
+    async def wait_disconnect(self, receive, is_disconnect):
+        while True:
+            event = await receive()
+            if is_disconnect(event):
+                return
+
+    async def http_error(self, send, status, detail):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps({'detail': detail}).encode()})
+
+    async def server_sent_events(self, scope, receive, send):
+        if scope['method'] != 'GET':
+            await self.http_error(send, 405, 'Method not allowed')
+            return
+        user = await sync_to_async(authenticate)(scope_token(scope) or '')
+        if user is None:
+            await self.http_error(send, 401, 'Token không hợp lệ hoặc đã hết hạn.')
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                (b'access-control-allow-origin', b'*'),
+            ],
+        })
+
+        async def emit(message):
+            if message is None:
+                body = b': ping\n\n'
+            else:
+                body = f"event: {message['topic']}\ndata: {json.dumps(message)}\n\n".encode()
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+        await self.stream(scope, user, receive, emit, lambda event: event['type'] == 'http.disconnect')
+
+    async def websocket(self, scope, receive, send):
+        event = await receive()
+        if event['type'] != 'websocket.connect':
+            return
+        user = await sync_to_async(authenticate)(scope_token(scope) or '')
+        if user is None:
+            await send({'type': 'websocket.close', 'code': 4401})
+            return
+        await send({'type': 'websocket.accept'})
+
+        async def emit(message):
+            if message is not None:
+                await send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+        await self.stream(scope, user, receive, emit, lambda event: event['type'] == 'websocket.disconnect')
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_QUEUE_SIZE = 1000
+RESYNC_MESSAGE = {'topic': 'resync', 'action': 'resync', 'ids': []}
+
+
+class Subscription:
+    def __init__(self, broker, loop, maxsize=SUBSCRIPTION_QUEUE_SIZE):
+        self.broker = broker
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def deliver(self, message):
+        # publish chạy ở thread của view (sync), hàng đợi thuộc event loop của ASGI
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        if self.queue.full():
+            # Client đọc không kịp: bỏ các tin cũ, báo client đồng bộ lại qua ?since=
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = RESYNC_MESSAGE
+        self.queue.put_nowait(message)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Pub/sub trong cùng process: chỉ dùng được khi view và kết nối SSE/WebSocket
+    chạy chung một process ASGI. Chạy nhiều worker hoặc ghi dữ liệu từ WSGI thì
+    dùng PostgresBroker.
+    """
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+    def subscribe(self):
+        subscription = Subscription(self, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+
+class PostgresBroker(InProcessBroker):
+    """
+    Pub/sub qua LISTEN/NOTIFY của Postgres: tin publish từ bất kỳ process nào
+    (WSGI trên Vercel, worker khác) tới mọi process ASGI đang giữ kết nối
+    SSE/WebSocket. Mỗi process mở một kết nối LISTEN trong thread nền khi có
+    subscriber đầu tiên. Database không phải Postgres thì chỉ phát trong process.
+    """
+
+    CHANNEL = 'live_updates'
+    # NOTIFY giới hạn payload 8000 byte; tin dài hơn được thay bằng tin resync
+    MAX_PAYLOAD = 7900
+    POLL_TIMEOUT = 5
+    RECONNECT_DELAY = 5
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def publish(self, message):
+        if connection.vendor != 'postgresql':
+            super().publish(message)
+            return
+        payload = json.dumps(message)
+        if len(payload.encode()) > self.MAX_PAYLOAD:
+            payload = json.dumps(RESYNC_MESSAGE)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.CHANNEL, payload])
+
+    def subscribe(self):
+        if connection.vendor == 'postgresql':
+            with self._lock:
+                # Thread nghe chết (lỗi ngoài dự kiến) thì được chạy lại ở lần subscribe sau
+                if self._listener is None or not self._listener.is_alive():
+                    self._listener = threading.Thread(target=self.listen, name='live-updates-listener', daemon=True)
+                    self._listener.start()
+        return super().subscribe()
+
+    def listen(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        while True:
+            try:
+                listen_connection = psycopg2.connect(**connection.get_connection_params())
+            except Exception:
+                logger.exception('Không kết nối được Postgres để LISTEN')
+                time.sleep(self.RECONNECT_DELAY)
+                continue
+            try:
+                listen_connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with listen_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.CHANNEL}')
+                # Tin phát trong lúc mất kết nối đã mất: báo client đồng bộ lại qua ?since=
+                super().publish(RESYNC_MESSAGE)
+                while True:
+                    if select.select([listen_connection], [], [], self.POLL_TIMEOUT) == ([], [], []):
+                        continue
+                    listen_connection.poll()
+                    while listen_connection.notifies:
+                        self.dispatch(listen_connection.notifies.pop(0).payload)
+            except Exception:
+                logger.exception('Mất kết nối LISTEN, kết nối lại')
+                time.sleep(self.RECONNECT_DELAY)
+            finally:
+                listen_connection.close()
+
+    def dispatch(self, payload):
+        # Một tin hỏng (payload không phải JSON do nơi khác NOTIFY) không được làm dừng thread nghe
+        try:
+            super().publish(json.loads(payload))
+        except Exception:
+            logger.exception('Bỏ qua tin live_updates không xử lý được: %r', payload)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'LIVE_UPDATES_BROKER', 'live_updates.broker.InProcessBroker'))()
+    return _broker
@@ -0,0 +1,106 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from event_manager.models import Event
+from family_tree_manager.models import FamilyTree
+from family_tree_manager.signals import members_changed, members_deleted
+from financial_management.models import Income
+from financial_management.signals import incomes_created
+
+from .broker import get_broker
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+
+def publish(topic, action, ids, audience=None):
+    """
+    Gửi tin sau khi commit. audience trả về danh sách user id được nhận tin
+    (None = mọi người dùng đã đăng nhập), được gọi lúc commit.
+    """
+    ids = sorted({object_id for object_id in ids if object_id})
+    if not ids:
+        return
+
+    def send():
+        get_broker().publish({
+            'topic': topic,
+            'action': action,
+            'ids': ids,
+            'user_ids': audience() if audience else None,
+        })
+
+    transaction.on_commit(send)
+
+
+def event_audience(event_id):
+    # Người dùng thường chỉ thấy sự kiện mình tham dự
+    return list(FamilyTree.objects.filter(attendees__id=event_id, user__isnull=False).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=FamilyTree)
+def publish_member_saved(sender, instance, **kwargs):
+    publish('family_tree', UPSERT, [instance.id])
+
+
+@receiver(post_delete, sender=FamilyTree)
+def publish_member_deleted(sender, instance, **kwargs):
+    publish('family_tree', DELETE, [instance.id])
+    publish('family_tree', UPSERT, getattr(instance, '_former_spouses', ()))
+
+
+@receiver(members_changed)
+def publish_members_changed(sender, member_ids=(), **kwargs):
+    publish('family_tree', UPSERT, member_ids)
+
+
+@receiver(members_deleted)
+def publish_members_deleted(sender, member_ids=(), **kwargs):
+    publish('family_tree', DELETE, member_ids)
+
+
+@receiver(m2m_changed, sender=FamilyTree.pids.through)
+def publish_spouses_changed(sender, instance, action, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        publish('family_tree', UPSERT, set(pk_set or getattr(instance, '_cleared_pids', ())) | {instance.pk})
+
+
+@receiver(post_save, sender=Event)
+def publish_event_saved(sender, instance, **kwargs):
+    publish('event', UPSERT, [instance.id], lambda: event_audience(instance.id))
+
+
+@receiver(m2m_changed, sender=Event.attendees.through)
+def publish_attendees_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    event_ids = (pk_set or ()) if reverse else [instance.pk]
+    for event_id in event_ids:
+        publish('event', UPSERT, [event_id], lambda event_id=event_id: event_audience(event_id))
+
+
+@receiver(pre_delete, sender=Event)
+def collect_event_audience(sender, instance, **kwargs):
+    instance._audience = event_audience(instance.id)
+
+
+@receiver(post_delete, sender=Event)
+def publish_event_deleted(sender, instance, **kwargs):
+    audience = getattr(instance, '_audience', [])
+    publish('event', DELETE, [instance.id], lambda: audience)
+
+
+@receiver(post_save, sender=Income)
+def publish_income_saved(sender, instance, **kwargs):
+    publish('income', UPSERT, [instance.id])
+
+
+@receiver(post_delete, sender=Income)
+def publish_income_deleted(sender, instance, **kwargs):
+    publish('income', DELETE, [instance.id])
+
+
+@receiver(incomes_created)
+def publish_incomes_created(sender, income_ids=(), **kwargs):
+    publish('income', UPSERT, income_ids)
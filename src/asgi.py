@@ -9,8 +9,34 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'src.settings')
 
-application = get_asgi_application()
+# Các API còn lại chạy qua WSGI như trên Vercel: response stream (export GEDCOM/NDJSON,
+# CSV/XLSX, danh sách stream) đọc ORM đồng bộ nên không được lặp trong event loop
+django_application = WsgiToAsgi(get_wsgi_application())
+
+from live_updates.asgi import LIVE_UPDATES_PATH, LiveUpdatesApp  # noqa: E402
+
+live_updates_application = LiveUpdatesApp()
+
+
+async def application(scope, receive, send):
+    # Chỉ SSE/WebSocket của live_updates (/api/live/) cần ASGI; chạy bằng uvicorn
+    # (websockets cho WebSocket, cả hai có trong requirements.txt):
+    #   uvicorn src.asgi:application --host 0.0.0.0 --port 8001
+    # Tin được phát qua LISTEN/NOTIFY của Postgres (LIVE_UPDATES_BROKER) nên các
+    # thay đổi ghi từ WSGI trên Vercel vẫn tới được process này
+    if scope['type'] in ('http', 'websocket') and scope['path'] == LIVE_UPDATES_PATH:
+        return await live_updates_application(scope, receive, send)
+    if scope['type'] == 'websocket':
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    if scope['type'] != 'http':
+        return
+    # Mỗi request một thread riêng, không xếp hàng sau các export dài
+    async with ThreadSensitiveContext():
+        return await django_application(scope, receive, send)
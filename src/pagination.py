@@ -0,0 +1,77 @@
+import json
+
+from django.db import connections
+from django.db.models.query import QuerySet
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+APPROXIMATE_COUNT_HEADER = 'X-Approximate-Count'
+
+
+def approximate_count(queryset):
+    """
+    Số dòng ước lượng từ planner của Postgres (EXPLAIN), không phải quét bảng.
+    Database khác không có thống kê này nên dùng COUNT(*) thật.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(CursorPagination):
+    page_size = 10
+    page_size_query_param = 'pageSize'
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        # Chỉ dùng ?ordering khi client truyền vào và là trường trực tiếp của model,
+        # còn lại sắp theo khóa mặc định để con trỏ ổn định khi có bản ghi mới
+        if OrderingFilter.ordering_param in request.query_params:
+            ordering = OrderingFilter().get_ordering(request, queryset, view)
+            if ordering and not any('__' in field for field in ordering):
+                return tuple(ordering)
+        return (self.ordering,) if isinstance(self.ordering, str) else tuple(self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.approximate_count = None
+        if 'approx_count' in request.query_params:
+            self.approximate_count = approximate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.approximate_count is not None:
+            response[APPROXIMATE_COUNT_HEADER] = self.approximate_count
+        return response
+
+
+class CursorOptInPagination(PageNumberPagination):
+    """
+    Phân trang theo số trang như cũ; khi request có ?cursor (kể cả rỗng cho
+    trang đầu) thì chuyển sang phân trang keyset, không COUNT(*) và không OFFSET.
+    """
+    page_size = 10
+    page_size_query_param = 'pageSize'
+    cursor_pagination_class = KeysetPagination
+
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if KeysetPagination.cursor_query_param in request.query_params and isinstance(queryset, QuerySet):
+            self.cursor_paginator = self.cursor_pagination_class()
+            self.cursor_paginator.page_size = self.page_size
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
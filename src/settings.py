@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'family_tree_manager',
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
     'image_upload',
     'financial_management',
     'event_manager',
+    'live_updates',
 
     'rest_framework_simplejwt.token_blacklist',
     'django_filters'
@@ -85,6 +87,7 @@ REST_FRAMEWORK = {
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_EXPOSE_HEADERS = ['X-Approximate-Count']
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
 ]
@@ -193,4 +196,20 @@ MEDIA_URL = '/'
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=30),  # Thời gian sống 30 ngày
     'REFRESH_TOKEN_LIFETIME': timedelta(days=30),  # Thời gian sống 30 ngày
-}
\ No newline at end of file
+}
+
+# Cache thống kê lưu trong database để mọi worker/instance dùng chung, việc xóa cache
+# có hiệu lực với tất cả. Bảng được tạo bằng `manage.py createcachetable` (xem build.sh)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'family_tree_cache',
+    }
+}
+
+FAMILY_TREE_STATISTICS_CACHE_TIMEOUT = 60 * 60
+
+# Pub/sub cho kênh đẩy thay đổi (SSE/WebSocket tại /api/live/, chạy bằng src.asgi).
+# Dùng LISTEN/NOTIFY của Postgres để thay đổi ghi từ WSGI tới được process ASGI
+LIVE_UPDATES_BROKER = 'live_updates.broker.PostgresBroker'
+LIVE_UPDATES_HEARTBEAT = 15
@@ -0,0 +1,30 @@
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class StreamingListMixin:
+    """
+    Trả về toàn bộ queryset dưới dạng một mảng JSON được ghi dần theo từng khối
+    đọc từ server-side cursor, thay vì serialize hết vào bộ nhớ rồi mới gửi.
+    """
+    stream_chunk_size = 500
+
+    def stream_list(self, queryset):
+        return StreamingHttpResponse(self.iter_json_array(queryset), content_type='application/json')
+
+    def iter_json_array(self, queryset):
+        encoder = JSONEncoder(ensure_ascii=False)
+        serializer = self.get_serializer()
+
+        yield '['
+        separator = ''
+        items = []
+        for obj in queryset.iterator(chunk_size=self.stream_chunk_size):
+            items.append(encoder.encode(serializer.to_representation(obj)))
+            if len(items) >= self.stream_chunk_size:
+                yield separator + ','.join(items)
+                separator = ','
+                items = []
+        if items:
+            yield separator + ','.join(items)
+        yield ']'
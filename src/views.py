@@ -1,7 +1,6 @@
 from rest_framework import status
 from rest_framework.decorators import api_view, action
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import BasePermission, SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -15,6 +14,8 @@ from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 
 from src.serializers import UserSerializer, ChangePasswordSerializer
+from src.pagination import CursorOptInPagination
+from src.streaming import StreamingListMixin
 from django_filters import rest_framework as filters
 
 
@@ -98,7 +99,7 @@ class IsSuperUserOrReadOnly(BasePermission):
         return False
 
 
-class BasePagination(PageNumberPagination):
+class BasePagination(CursorOptInPagination):
     page_size = 10
     page_size_query_param = 'pageSize'
 
@@ -116,7 +117,7 @@ class UserFilter(filters.FilterSet):
         }
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(StreamingListMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, IsSuperUserOrReadOnly]
     queryset = User.objects.all().order_by('-id')
     serializer_class = UserSerializer
@@ -129,8 +130,7 @@ class UserViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         if 'query_all' in request.query_params:
             queryset = self.get_queryset()
-            serializer = self.get_serializer(queryset, many=True)
-            return Response(serializer.data)
+            return self.stream_list(queryset)
         else:
             return super().list(request, *args, **kwargs)
 